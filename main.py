@@ -3,38 +3,187 @@ Updated: 11/07/24
 Author: Daniel Potter
 Description: This script synchronizes data between HubSpot and MailerLite.
 It retrieves all contacts from HubSpot and all subscribers from MailerLite, then updates or creates subscribers in MailerLite based on the HubSpot data.
+Several HubSpot portal and MailerLite account pairs can be synced at the same time by listing them in SYNC_ACCOUNTS.
 It can be run as a standalone script or set up as a scheduled task to run periodically.
+
+Every run writes a trace of how long each stage and API call took to output/trace.json, which can be opened in
+https://ui.perfetto.dev or chrome://tracing. Run with --profile to also profile the run with cProfile.
+Run with --daemon to keep the process running and sync on a schedule instead of using cron, e.g.
+python main.py --daemon --interval 3600 --jitter 300. The HubSpot clients, HTTP connections and cached contacts stay warm
+between runs, so after the first run only the HubSpot contacts modified since the last run are fetched.
+Run with --emails emails.txt to sync only the contacts with the email addresses in the file.
 """
-from src.emailFunctions import send_email
-from src.generalFunctions import init, process_all_data, get_all_data, CustomJSONEncoder
+import argparse
+import cProfile
+import os
+import pstats
+from concurrent.futures import ThreadPoolExecutor
 
-# Wrap the main code in a try-except block to catch any unhandled exceptions.
-try:
-    # Initialize clients for HubSpot and MailerLite.
-    # This function should set up the necessary API clients and return them.
-    hubspot_client, mailerlite_api_key = init()
+from dotenv import load_dotenv
+
+from src.emailFunctions import AlertDispatcher
+from src.generalFunctions import init_accounts, sync_account, sync_contacts_by_email, read_emails_file
+from src.coalesceFunctions import log_coalescer_summaries, reset_coalescers
+from src.httpFunctions import log_transfer_summaries, reset_transfer_stats
+from src.rateControlFunctions import log_controller_summaries, reset_controller_summaries
+from src.schedulerFunctions import SyncScheduler
+from src.traceFunctions import enable_tracing, write_trace
+
+# Load the .env file first so it can set the scheduler defaults below.
+load_dotenv()
+
+parser = argparse.ArgumentParser(description="Synchronize HubSpot contacts to MailerLite subscribers.")
+parser.add_argument('--profile', action='store_true',
+                    help="Profile the run with cProfile, save it to output/profile.prof and print the slowest functions.")
+parser.add_argument('--trace', default='output/trace.json', help="Where to write the trace of the run's stages and API calls.")
+parser.add_argument('--no-trace', action='store_true', help="Don't record a trace.")
+parser.add_argument('--daemon', action='store_true', help="Keep running and sync on a schedule.")
+parser.add_argument('--interval', type=float,
+                    help="The number of seconds between syncs in daemon mode. Defaults to SYNC_INTERVAL, or 3600.")
+parser.add_argument('--jitter', type=float,
+                    help="The most each sync's start time is moved by at random in daemon mode, in seconds. "
+                         "Defaults to SYNC_JITTER, or 300.")
+parser.add_argument('--full-sync-every', type=int, default=int(os.getenv('SYNC_FULL_EVERY', '24')),
+                    help="In daemon mode, fetch every HubSpot contact again on every nth sync instead of just the changes.")
+parser.add_argument('--emails', help="Only sync the contacts with the email addresses in this file, one per line.")
+args = parser.parse_args()
+enable_tracing(not args.no_trace)
+
+# cProfile only profiles the thread it is enabled in, so each account's sync thread gets its own profiler and
+# they are merged at the end. Work handed to other threads (e.g. the MailerLite status scans) shows up in the trace.
+profiles = []
+
+
+def get_schedule_settings():
+    # The command line wins, otherwise read the environment, so a reload picks up a changed SYNC_INTERVAL or SYNC_JITTER.
+    interval = args.interval if args.interval is not None else float(os.getenv('SYNC_INTERVAL', '3600'))
+    jitter = args.jitter if args.jitter is not None else float(os.getenv('SYNC_JITTER', '300'))
+    return interval, jitter
+
+
+def run_sync(account):
+    if not args.profile:
+        return sync_account(account, alert_dispatcher)
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return sync_account(account, alert_dispatcher)
+    finally:
+        profile.disable()
+        profiles.append(profile)
+
+
+def sync_all_accounts(accounts):
+    # Sync every account at the same time. Each account has its own rate limits, state and output folder.
+    with ThreadPoolExecutor(max_workers=len(accounts), thread_name_prefix='sync') as executor:
+        reports = list(executor.map(run_sync, accounts))
 
-    # Step 1: Retrieve all HubSpot contacts and MailerLite subscribers.
-    # The data is returned as a tuple of two lists.
-    (all_hubspot_contacts, all_mailerlite_subscribers) = get_all_data(hubspot_client, mailerlite_api_key)
+    # Print a report for each account, including what page sizes and concurrency each API endpoint ended up running at.
+    for report in reports:
+        status = f"failed: {report['error']}" if report['error'] else "completed successfully"
+        print(f"[{report['account']}] Data synchronization {status} in {report['duration']:.1f}s. "
+              f"{report['hubspot_contacts']} HubSpot contacts, {report['mailerlite_subscribers']} MailerLite subscribers, "
+              f"{report['groups_assigned']} group memberships added, {report['groups_unassigned']} removed, "
+              f"{report['archived_removed']} archived contacts removed, "
+              f"{report['engagement_pushed']} contacts' engagement stats pushed to HubSpot, {report['retried']} writes retried, "
+              f"{report['dead_letters']} dead-lettered.")
+    log_controller_summaries()
+    # Print how many repeated lookups were shared or batched instead of being sent on their own.
+    log_coalescer_summaries()
+    # Print the bytes sent and received per API, before and after compression.
+    log_transfer_summaries()
+    # In daemon mode the controllers and session live on, so start their counts again for the next run's summaries.
+    # The coalescers are dropped, so they don't build up or keep old clients alive across runs.
+    reset_controller_summaries()
+    reset_transfer_stats()
+    reset_coalescers()
 
-    # Output the data to a file for debugging purposes.
-    with open("allHubSpotContacts.json", "w") as f:
-        f.write(CustomJSONEncoder().encode(all_hubspot_contacts))
-    with open("allMailerLiteSubscribers.json", "w") as f:
-        f.write(CustomJSONEncoder().encode(all_mailerlite_subscribers))
+    # Save the profile and trace for this run. The trace is cleared after writing, ready for the next run.
+    if profiles:
+        os.makedirs('output', exist_ok=True)
+        stats = pstats.Stats(*profiles)
+        profiles.clear()
+        stats.dump_stats('output/profile.prof')
+        print("Saved the profile to output/profile.prof. The 20 functions with the most cumulative time were:")
+        stats.sort_stats('cumulative').print_stats(20)
+    if not args.no_trace:
+        write_trace(args.trace)
+    return reports
 
-    # Step 2: Update or create MailerLite subscribers with HubSpot data.
-    # Todo: Uncomment the following line to enable data processing once testing is complete.
-    # process_all_data(all_hubspot_contacts, all_mailerlite_subscribers, mailerlite_api_key)
 
-    print("Data synchronization completed successfully.")
+def run_daemon():
+    # Keep the accounts, and with them the HubSpot clients and cached contacts, between runs.
+    accounts = init_accounts()
+    for account in accounts:
+        account['contact_cache'] = {}
+    runs = 0
+
+    def scheduled_sync():
+        nonlocal runs
+        if args.full_sync_every and runs and runs % args.full_sync_every == 0:
+            # Fetch every contact now and then, so contacts deleted permanently in HubSpot drop out of the cache.
+            print("Fetching every HubSpot contact again on this sync.")
+            for account in accounts:
+                account['contact_cache'].clear()
+        runs += 1
+        sync_all_accounts(accounts)
+
+    def reload_settings():
+        # Read the .env file again, replacing what was loaded before, then recreate every account's clients.
+        nonlocal accounts
+        load_dotenv(override=True)
+        reloaded_accounts = init_accounts()
+        for account in reloaded_accounts:
+            account['contact_cache'] = {}
+        accounts = reloaded_accounts
+        scheduler.set_schedule(*get_schedule_settings())
+
+    scheduler = SyncScheduler(scheduled_sync, *get_schedule_settings(), reload_function=reload_settings)
+    scheduler.run_forever()
+
+
+def sync_emails_for_all_accounts(accounts, emails):
+    # Look the emails up in every account at the same time.
+    with ThreadPoolExecutor(max_workers=len(accounts), thread_name_prefix='sync') as executor:
+        reports = list(executor.map(lambda account: sync_contacts_by_email(account, emails, alert_dispatcher), accounts))
+
+    for report in reports:
+        status = f"failed: {report['error']}" if report['error'] else "completed successfully"
+        print(f"[{report['account']}] Targeted synchronization {status} in {report['duration']:.1f}s. "
+              f"{report['hubspot_contacts']} of {report['requested']} emails found in HubSpot, "
+              f"{report['written']} subscribers written, {report['retried']} writes retried, "
+              f"{report['dead_letters']} dead-lettered.")
+    log_controller_summaries()
+    log_coalescer_summaries()
+    log_transfer_summaries()
+    if not args.no_trace:
+        write_trace(args.trace)
+    return reports
+
+
+# Alerts are queued and sent as one digest email in the background, so they never hold up the sync.
+# A daemon never closes the dispatcher between runs, so it sends a digest at most once an interval instead.
+alert_dispatcher = AlertDispatcher(digest_interval=get_schedule_settings()[0] if args.daemon else None)
+
+# Wrap the main code in a try-except block to catch any unhandled exceptions.
+try:
+    if args.daemon:
+        run_daemon()
+    elif args.emails:
+        sync_emails_for_all_accounts(init_accounts(), read_emails_file(args.emails))
+    else:
+        # Initialize clients for every HubSpot and MailerLite account pair.
+        # This function should set up the necessary API clients and return them.
+        sync_all_accounts(init_accounts())
 
 except Exception as e:
     # Define an error message to print and send in an email alert.
     error_message = f"An uncaught exception occurred in the HubSpot to MailerLite synchronization script: {e}"
     # Print the error message to the console for debugging purposes.
     print(error_message)
-    # Send an email alert with the error message to the specified recipient.
-    # Todo: Currently not implemented properly, uncomment to enable.
-    # send_email("Script Error Alert", error_message, "alert_recipient@example.com")
+    # Add the error to the alert digest for the recipient set in ALERT_TO_EMAIL.
+    alert_dispatcher.alert("Script Error Alert", error_message)
+
+finally:
+    # Send the alert digest, if there is one, and close the SMTP connection.
+    alert_dispatcher.close()
@@ -0,0 +1,231 @@
+"""
+Micro-benchmarks for the in-process stages of a sync, using synthetic contacts and subscribers.
+
+Each stage is timed on its own, without any API calls, and reported as nanoseconds per contact along with the
+memory it allocates per contact. Results can be saved as a baseline and compared against later, e.g. to check
+whether a faster JSON encoder or a new field mapping is actually faster.
+
+Usage:
+    python -m src.benchmarkFunctions                         # Run every stage with 100,000 contacts
+    python -m src.benchmarkFunctions --stage build_payloads  # Run a single stage
+    python -m src.benchmarkFunctions --save                  # Save the results as output/benchmarks/baseline.json
+    python -m src.benchmarkFunctions --compare               # Compare the results with the saved baseline
+
+orjson is benchmarked alongside CustomJSONEncoder if it is installed.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from hubspot.crm.contacts import SimplePublicObjectWithAssociations
+
+from src.engagementFunctions import diff_engagement_stats
+from src.generalFunctions import HUBSPOT_CONTACT_PROPERTIES, build_email_index, build_subscriber_payloads
+from src.jsonFunctions import CustomJSONEncoder
+from src.purchaseFunctions import PURCHASE_FIELD_NAMES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_BASELINE_PATH = 'output/benchmarks/baseline.json'
+
+
+def build_fixtures(size=100_000, seed=1):
+    """
+    Builds synthetic HubSpot contacts and MailerLite subscribers shaped like the real ones.
+    Half the contacts already have a subscriber, and a third have purchase fields.
+
+    :param size: The number of contacts to build.
+    :type size: int
+    :param seed: The random seed, so every run benchmarks the same data.
+    :type seed: int
+    :return: A dictionary of the contacts, their dictionaries, subscribers, purchase fields and pushed engagement stats.
+    :rtype: dict
+    """
+    rng = random.Random(seed)
+    created_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    contacts = []
+    subscribers = []
+    purchase_fields = {}
+    for number in range(size):
+        contact_id = str(100000 + number)
+        email = f"contact{number}@example.com"
+        # Most contacts only have a handful of properties filled in, like the real data.
+        properties = {name: (f"{name} {rng.randrange(1000)}" if rng.random() < 0.3 else None)
+                      for name in HUBSPOT_CONTACT_PROPERTIES}
+        properties.update(email=email, hs_object_id=contact_id, firstname=f"First{number}", lastname=f"Last{number}")
+        contact_created_at = created_at + timedelta(minutes=number)
+        contacts.append(SimplePublicObjectWithAssociations(id=contact_id, properties=properties, created_at=contact_created_at,
+                                                           updated_at=contact_created_at, archived=False))
+
+        if number % 2 == 0:
+            subscribers.append({
+                'id': str(900000 + number), 'email': email, 'status': 'active',
+                'opens_count': rng.randrange(50), 'clicks_count': rng.randrange(10),
+                'open_rate': round(rng.random(), 2), 'click_rate': round(rng.random() / 4, 2),
+                'fields': {'hs_object_id': contact_id, 'name': f"First{number}"},
+            })
+        if number % 3 == 0:
+            purchase_fields[contact_id] = {name: f"{name} {number}" for name in PURCHASE_FIELD_NAMES}
+
+    # Pretend the stats were pushed last run, then a tenth of the subscribers opened another email since.
+    pushed = {}
+    for subscriber in subscribers:
+        stats = {name: subscriber[name] for name in ('opens_count', 'clicks_count', 'open_rate', 'click_rate')}
+        if rng.random() < 0.1:
+            stats = dict(stats, opens_count=stats['opens_count'] - 1)
+        pushed[subscriber['fields']['hs_object_id']] = {'contact_id': subscriber['fields']['hs_object_id'],
+                                                        'stats': stats, 'last_activity': None}
+
+    return {
+        'contacts': contacts,
+        'contact_dicts': [contact.to_dict() for contact in contacts],
+        'subscribers': subscribers,
+        'subscribers_by_email': build_email_index(subscribers),
+        'purchase_fields': purchase_fields,
+        'pushed': pushed,
+    }
+
+
+def _encode_with_orjson(contact_dicts):
+    # orjson writes datetimes as ISO 8601 itself, so it doesn't need CustomJSONEncoder.
+    return orjson.dumps(contact_dicts)
+
+
+# Each stage takes the fixtures and runs the code being benchmarked once over every contact.
+STAGES = {
+    'build_email_index': lambda fixtures: build_email_index(fixtures['subscribers']),
+    # The payloads are built lazily during a sync, so collect them here to measure building every one.
+    'build_payloads': lambda fixtures: list(build_subscriber_payloads(fixtures['contacts'], fixtures['subscribers_by_email'],
+                                                                      fixtures['purchase_fields'])),
+    'contact_to_dict': lambda fixtures: [contact.to_dict() for contact in fixtures['contacts']],
+    'json_encode': lambda fixtures: json.dumps(fixtures['contact_dicts'], cls=CustomJSONEncoder),
+    'diff_engagement_stats': lambda fixtures: diff_engagement_stats(fixtures['subscribers'], fixtures['pushed'],
+                                                                    datetime.now(timezone.utc)),
+}
+if orjson is not None:
+    STAGES['json_encode_orjson'] = lambda fixtures: _encode_with_orjson(fixtures['contact_dicts'])
+
+
+def run_stage(stage, fixtures, repeat=5):
+    """
+    Times a stage and measures the memory it allocates.
+    The time is the fastest of several runs, which is the least affected by everything else running on the machine.
+    Memory is measured on a separate run, since tracing allocations slows the code down.
+
+    :param stage: The function that runs the stage.
+    :param fixtures: The fixtures from build_fixtures().
+    :type fixtures: dict
+    :param repeat: The number of timed runs.
+    :type repeat: int
+    :return: A dictionary of nanoseconds per contact, peak bytes allocated per contact and memory blocks kept per contact.
+    :rtype: dict
+    """
+    size = len(fixtures['contacts'])
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter_ns()
+        stage(fixtures)
+        timings.append(time.perf_counter_ns() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    result = stage(fixtures)
+    _, peak = tracemalloc.get_traced_memory()
+    # Count the memory blocks still held by the result, e.g. every dictionary built for a payload.
+    kept_blocks = sum(statistic.count for statistic in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    del result
+
+    return {
+        'ns_per_contact': min(timings) / size,
+        'peak_bytes_per_contact': peak / size,
+        'blocks_per_contact': kept_blocks / size,
+    }
+
+
+def run_benchmarks(size=100_000, repeat=5, stage_names=None):
+    """
+    Runs every stage, or only the stages named, and prints a line for each.
+
+    :param size: The number of synthetic contacts to benchmark with.
+    :type size: int
+    :param repeat: The number of timed runs of each stage.
+    :type repeat: int
+    :param stage_names: The stages to run. Runs every stage if None.
+    :type stage_names: list[str]
+    :return: The results, with the settings used under 'meta' and each stage's results under 'stages'.
+    :rtype: dict
+    """
+    print(f"Building {size} synthetic contacts...")
+    fixtures = build_fixtures(size)
+    results = {
+        'meta': {'size': size, 'repeat': repeat, 'python': platform.python_version(),
+                 'created_at': datetime.now(timezone.utc).isoformat()},
+        'stages': {},
+    }
+    for name in stage_names or STAGES:
+        stage_results = run_stage(STAGES[name], fixtures, repeat)
+        results['stages'][name] = stage_results
+        print(f"{name:<24} {stage_results['ns_per_contact']:>10.0f} ns/contact "
+              f"{stage_results['peak_bytes_per_contact']:>10.0f} B/contact peak "
+              f"{stage_results['blocks_per_contact']:>8.1f} blocks/contact kept")
+    return results
+
+
+def compare_results(results, baseline):
+    """
+    Prints how each stage changed compared to a baseline. Negative changes are improvements.
+
+    :param results: The results from run_benchmarks().
+    :type results: dict
+    :param baseline: Results saved by an earlier run.
+    :type baseline: dict
+    """
+    if baseline['meta']['size'] != results['meta']['size']:
+        print(f"Warning: the baseline used {baseline['meta']['size']} contacts, so the numbers may not be comparable.")
+    for name, stage_results in results['stages'].items():
+        baseline_results = baseline['stages'].get(name)
+        if baseline_results is None:
+            print(f"{name:<24} not in the baseline")
+            continue
+        changes = []
+        for key, label in (('ns_per_contact', 'time'), ('peak_bytes_per_contact', 'peak memory')):
+            if baseline_results[key]:
+                changes.append(f"{label} {(stage_results[key] - baseline_results[key]) / baseline_results[key]:+.1%}")
+        print(f"{name:<24} {', '.join(changes)}")
+
+
+def _save_results(results, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=4)
+    print(f"Saved the results to {path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the in-process sync stages with synthetic contacts.")
+    parser.add_argument('--size', type=int, default=100_000, help="The number of synthetic contacts.")
+    parser.add_argument('--repeat', type=int, default=5, help="The number of timed runs of each stage.")
+    parser.add_argument('--stage', action='append', choices=list(STAGES), help="Only run this stage. Can be repeated.")
+    parser.add_argument('--save', nargs='?', const=DEFAULT_BASELINE_PATH, help="Save the results as a baseline.")
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE_PATH, help="Compare the results with a saved baseline.")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmarks(args.size, args.repeat, args.stage)
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            compare_results(benchmark_results, json.load(baseline_file))
+    if args.save:
+        _save_results(benchmark_results, args.save)
@@ -0,0 +1,235 @@
+"""
+Request coalescing for repeated single-object lookups.
+
+A RequestCoalescer sits in front of a batch read API. Callers still ask for one object at a time, but:
+- Callers asking for an object that is already being fetched wait for that request instead of sending another.
+- Objects fetched in the last few seconds are returned straight away.
+- Lookups for different objects that arrive within a short window are gathered into a single batch read.
+
+The first caller in a window becomes the leader: it waits for the window to close, sends the batch and hands
+every caller their object. Nothing runs in the background. A leader with no other callers in the coalescer sends
+straight away, so lookups made one after another don't each wait for the window.
+
+Every coalescer counts how many lookups it was asked for and how many requests it actually sent, and
+log_coalescer_summaries() prints how many calls were saved. reset_coalescers() starts again for the next run.
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+from src.rateControlFunctions import get_scoped_name
+
+
+class RequestCoalescer:
+    """
+    Coalesces lookups by key into batch reads.
+
+    Usage:
+        coalescer = get_coalescer('hubspot_deals', lambda deal_ids: batch_read(client, deal_ids), owner=client)
+        deal = coalescer.get('123')
+        deals = coalescer.get_many(['123', '456'])
+    """
+
+    def __init__(self, name, batch_function, window=0.02, max_batch=100, ttl=5.0):
+        """
+        :param name: The name used in log messages.
+        :param batch_function: A function taking a list of keys and returning a dictionary of key to result.
+                               Keys missing from the dictionary get None. If it raises, every caller waiting on
+                               the batch gets the exception.
+        :param window: How long the leader waits for more lookups before sending the batch, in seconds.
+        :param max_batch: The number of keys per batch request. A batch is sent early once it is full.
+        :param ttl: How long a result is reused for, in seconds. Results of None are never reused.
+        """
+        self.name = name
+        self.batch_function = batch_function
+        self.window = window
+        self.max_batch = max_batch
+        self.ttl = ttl
+
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._in_flight = {}
+        self._cache = {}
+        self._leader_active = False
+        # The number of callers inside get_many(), so a leader on its own knows it has nobody to wait for.
+        self._callers = 0
+        self._calls = 0
+        self._cache_hits = 0
+        self._joined = 0
+        self._requests = 0
+
+    def get(self, key):
+        """
+        Looks up a single object.
+
+        :param key: The key of the object, e.g. a deal ID.
+        :return: The object, or None if the batch function didn't return it.
+        """
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """
+        Looks up several objects, sharing batches and in-flight requests with every other caller.
+
+        :param keys: The keys of the objects.
+        :type keys: list
+        :return: The objects, in the same order as the keys.
+        :rtype: list
+        """
+        futures = []
+        is_leader = False
+        with self._condition:
+            self._callers += 1
+            now = time.monotonic()
+            for key in keys:
+                self._calls += 1
+                cached = self._cache.get(key)
+                if cached is not None and now - cached[0] < self.ttl:
+                    self._cache_hits += 1
+                    future = Future()
+                    future.set_result(cached[1])
+                elif key in self._in_flight:
+                    # Someone has already asked for this object, so wait for their request.
+                    self._joined += 1
+                    future = self._in_flight[key]
+                else:
+                    future = Future()
+                    self._in_flight[key] = future
+                    self._pending[key] = future
+                futures.append(future)
+
+            if self._pending and not self._leader_active:
+                self._leader_active = True
+                is_leader = True
+            elif len(self._pending) >= self.max_batch:
+                # Wake the leader so it sends the full batch straight away.
+                self._condition.notify_all()
+
+        try:
+            if is_leader:
+                self._lead()
+            return [future.result() for future in futures]
+        finally:
+            with self._condition:
+                self._callers -= 1
+
+    def _lead(self):
+        # Wait for the window to close or the batch to fill up, then take every pending key.
+        # If nobody else is asking for anything there is nothing to wait for, so send straight away.
+        with self._condition:
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_batch and self._callers > 1:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending
+            self._pending = {}
+            # Anyone asking after this point starts a new batch with its own leader.
+            self._leader_active = False
+
+        keys = list(batch)
+        for position in range(0, len(keys), self.max_batch):
+            chunk = keys[position:position + self.max_batch]
+            try:
+                with self._condition:
+                    self._requests += 1
+                results = self.batch_function(chunk)
+                if results is None:
+                    results = {}
+                if not isinstance(results, dict):
+                    raise TypeError(f"[{self.name}] The batch function returned a {type(results).__name__}, not a dictionary.")
+                self._finish(chunk, batch, results=results)
+            except Exception as error:
+                # Every caller must get an answer, or anyone waiting on this batch would wait forever.
+                self._finish(chunk, batch, error=error)
+
+    def _finish(self, chunk, batch, results=None, error=None):
+        # Hand every caller their result, and remember the results for the next few seconds.
+        # Callers that already have their answer are skipped, in case a batch fails partway through being handed out.
+        now = time.monotonic()
+        with self._condition:
+            for key in chunk:
+                self._in_flight.pop(key, None)
+                if error is None and results.get(key) is not None:
+                    self._cache[key] = (now, results[key])
+            # Drop expired results so the cache doesn't grow for the whole run.
+            if len(self._cache) > self.max_batch * 100:
+                self._cache = {key: value for key, value in self._cache.items() if now - value[0] < self.ttl}
+        for key in chunk:
+            if batch[key].done():
+                continue
+            if error is not None:
+                batch[key].set_exception(error)
+            else:
+                batch[key].set_result(results.get(key))
+
+    def summary(self):
+        """
+        Summarises how many lookups were made and how many requests they took.
+
+        :return: A dictionary of lookup counts, requests sent and calls saved.
+        :rtype: dict
+        """
+        with self._condition:
+            return {
+                'name': self.name,
+                'calls': self._calls,
+                'cache_hits': self._cache_hits,
+                'joined': self._joined,
+                'requests': self._requests,
+                'saved': self._calls - self._requests,
+            }
+
+
+# Coalescers are shared by name and owner so every caller looking up the same kind of object shares batches.
+_coalescers = {}
+_coalescers_lock = threading.Lock()
+
+
+def get_coalescer(name, batch_function, owner=None, **settings):
+    """
+    Gets the shared coalescer for a kind of lookup, creating it the first time it is asked for.
+    Each account has its own coalescers. The batch function is only taken from the first caller, so pass the client it
+    uses as the owner, and include anything else that changes the result in the name, such as the properties requested.
+
+    :param name: The lookup name, e.g. 'hubspot_deals'.
+    :type name: str
+    :param batch_function: A function taking a list of keys and returning a dictionary of key to result.
+    :param owner: The client the batch function uses. Each client gets its own coalescer.
+    :param settings: Settings passed to RequestCoalescer when it is created.
+    :rtype: RequestCoalescer
+    """
+    name = get_scoped_name(name)
+    key = (name, id(owner))
+    with _coalescers_lock:
+        if key not in _coalescers:
+            _coalescers[key] = RequestCoalescer(name, batch_function, **settings)
+        return _coalescers[key]
+
+
+def log_coalescer_summaries():
+    """
+    Prints a summary line for every coalescer that was used.
+
+    :return: A list of the summaries printed.
+    :rtype: list[dict]
+    """
+    with _coalescers_lock:
+        coalescers = list(_coalescers.values())
+    summaries = [coalescer.summary() for coalescer in coalescers]
+    for summary in summaries:
+        if not summary['calls']:
+            continue
+        print(f"[{summary['name']}] {summary['calls']} lookups took {summary['requests']} requests, saving {summary['saved']} calls "
+              f"({summary['cache_hits']} recently fetched, {summary['joined']} already in flight)")
+    return summaries
+
+
+def reset_coalescers():
+    """
+    Drops every coalescer, with its cached results and counts, so the next run starts again.
+    Also lets go of the clients their batch functions use, e.g. after the settings are reloaded.
+    """
+    with _coalescers_lock:
+        _coalescers.clear()
@@ -1,16 +1,56 @@
+import os
+import queue
 import smtplib
+import threading
+import time
+from datetime import datetime
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from dotenv import load_dotenv
 
-def send_email(subject, message, to_email):
-    # Email configuration
-    smtp_server = "smtp.example.com"
-    smtp_port = 587
-    smtp_user = "your_email@example.com"
-    smtp_password = "your_password"
-    from_email = smtp_user
 
+def get_smtp_settings():
+    """
+    Reads the SMTP settings from the environment variables or the .env file.
+    To test against a local debugging server, e.g. `python -m aiosmtpd -n -l localhost:1025`,
+    set SMTP_SERVER=localhost, SMTP_PORT=1025, SMTP_USE_TLS=false and leave SMTP_USER empty.
+
+    :return: A dictionary of SMTP settings.
+    :rtype: dict
+    """
+    # Load environment variables from the .env file.
+    load_dotenv()
+
+    smtp_user = os.getenv('SMTP_USER', '')
+    # A bad port shouldn't stop the sync from starting, so fall back to the default and say so.
+    try:
+        smtp_port = int(os.getenv('SMTP_PORT', '587'))
+    except ValueError:
+        print(f"SMTP_PORT must be a number, not {os.getenv('SMTP_PORT')!r}. Using port 587.")
+        smtp_port = 587
+    return {
+        'smtp_server': os.getenv('SMTP_SERVER', 'localhost'),
+        'smtp_port': smtp_port,
+        'smtp_user': smtp_user,
+        'smtp_password': os.getenv('SMTP_PASSWORD', ''),
+        'use_tls': os.getenv('SMTP_USE_TLS', 'true').lower() in ('1', 'true', 'yes'),
+        'from_email': os.getenv('ALERT_FROM_EMAIL') or smtp_user,
+        'to_email': os.getenv('ALERT_TO_EMAIL', ''),
+    }
+
+
+def _connect(settings):
+    # Open an SMTP connection, securing it and logging in if the settings ask for it.
+    server = smtplib.SMTP(settings['smtp_server'], settings['smtp_port'], timeout=30)
+    if settings['use_tls']:
+        server.starttls()  # Secure the connection
+    if settings['smtp_user']:
+        server.login(settings['smtp_user'], settings['smtp_password'])
+    return server
+
+
+def _build_message(subject, message, from_email, to_email):
     # Set up the MIME
     msg = MIMEMultipart()
     msg['From'] = from_email
@@ -19,15 +59,162 @@ def send_email(subject, message, to_email):
 
     # Add in the message body
     msg.attach(MIMEText(message, 'plain'))
+    return msg
+
+
+def send_email(subject, message, to_email, settings=None):
+    """
+    Sends a single email straight away using a new SMTP connection.
+    For alerts sent during a sync, use AlertDispatcher so the sync isn't blocked.
+
+    :param subject: The subject of the email.
+    :param message: The plain text body of the email.
+    :param to_email: The recipient's email address.
+    :param settings: The SMTP settings to use. Defaults to get_smtp_settings().
+    """
+    # Email configuration
+    settings = settings or get_smtp_settings()
+    msg = _build_message(subject, message, settings['from_email'], to_email)
 
     # Send the email
     try:
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()  # Secure the connection
-        server.login(smtp_user, smtp_password)
+        server = _connect(settings)
         text = msg.as_string()
-        server.sendmail(from_email, to_email, text)
+        server.sendmail(settings['from_email'], to_email, text)
         server.quit()
         print("Email sent successfully")
     except Exception as e:
         print(f"Failed to send email: {e}")
+
+
+class AlertDispatcher:
+    """
+    Sends alert emails from a background thread so the sync never waits on SMTP.
+
+    Alerts are queued with alert() and merged into a single digest email. With no digest interval,
+    one digest is sent when the dispatcher is closed at the end of the run. With a digest interval,
+    a digest is sent once that many seconds have passed since the first alert in it.
+    The same SMTP connection is reused for every digest and reopened if the server drops it.
+
+    Usage:
+        alerts = AlertDispatcher()
+        alerts.alert("Write failed", "Couldn't update someone@example.com")
+        alerts.close()
+    """
+
+    def __init__(self, to_email=None, digest_interval=None, subject="HubSpot to MailerLite sync alerts", settings=None):
+        """
+        :param to_email: The recipient of the digests. Defaults to ALERT_TO_EMAIL.
+        :param digest_interval: The number of seconds to collect alerts for before sending a digest, or None for one per run.
+        :param subject: The subject line of the digest emails.
+        :param settings: The SMTP settings to use. Defaults to get_smtp_settings().
+        """
+        self.settings = settings or get_smtp_settings()
+        self.to_email = to_email or self.settings['to_email']
+        self.digest_interval = digest_interval
+        self.subject = subject
+        self.sent_digests = 0
+        self._queue = queue.Queue()
+        self._server = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+        self._thread.start()
+
+    @property
+    def enabled(self):
+        # Alerts are only sent if there is someone to send them to.
+        return bool(self.to_email)
+
+    def alert(self, subject, message):
+        """
+        Queues an alert to be included in the next digest. Returns straight away.
+
+        :param subject: A short summary of the alert.
+        :param message: The details of the alert.
+        """
+        if self._closed:
+            print(f"Alert dispatcher is closed, dropping alert: {subject}")
+            return
+        self._queue.put((datetime.now(), subject, message))
+
+    def close(self, timeout=60):
+        """
+        Sends any alerts still waiting, closes the SMTP connection and stops the background thread.
+
+        :param timeout: The longest time to wait for the last digest to send, in seconds.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        pending = []
+        first_alert_at = None
+        while True:
+            # Wait for the next alert, or until the current digest is due.
+            timeout = None
+            if pending and self.digest_interval is not None:
+                timeout = max(0.0, first_alert_at + self.digest_interval - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+
+            if item is None:
+                # The dispatcher is closing, so send whatever is left and stop.
+                self._send_digest(pending)
+                self._disconnect()
+                return
+            if item:
+                if not pending:
+                    first_alert_at = time.monotonic()
+                pending.append(item)
+            if pending and self.digest_interval is not None and time.monotonic() - first_alert_at >= self.digest_interval:
+                self._send_digest(pending)
+                pending = []
+
+    def _send_digest(self, alerts):
+        if not alerts:
+            return
+        if not self.enabled:
+            print(f"No ALERT_TO_EMAIL set, not sending {len(alerts)} alerts.")
+            return
+
+        # Merge every alert into one plain text email.
+        subject = f"{self.subject} ({len(alerts)})" if len(alerts) > 1 else f"{self.subject}: {alerts[0][1]}"
+        body = "\n\n".join(f"[{created_at:%Y-%m-%d %H:%M:%S}] {alert_subject}\n{message}"
+                           for created_at, alert_subject, message in alerts)
+        msg = _build_message(subject, body, self.settings['from_email'], self.to_email).as_string()
+
+        # Reuse the open connection, reconnecting once if the server has dropped it.
+        for attempt in range(2):
+            try:
+                if self._server is None:
+                    self._server = _connect(self.settings)
+                self._server.sendmail(self.settings['from_email'], self.to_email, msg)
+                self.sent_digests += 1
+                print(f"Alert digest with {len(alerts)} alerts sent successfully")
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._server = None
+            except Exception as e:
+                print(f"Failed to send alert digest: {e}")
+                self._disconnect()
+                return
+        print("Failed to send alert digest: the SMTP server keeps disconnecting")
+
+    def _disconnect(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
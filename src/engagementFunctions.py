@@ -0,0 +1,105 @@
+"""
+Copies each subscriber's MailerLite engagement stats back to their HubSpot contact, so sales can see them.
+
+The stats come from the subscribers already downloaded for the sync, so no extra MailerLite requests are needed.
+Subscribers are matched to contacts through the hs_object_id field the sync stores in MailerLite.
+The values pushed on previous runs are kept in a snapshot, and only the contacts whose stats have changed since
+are updated, with the HubSpot batch update API.
+
+MailerLite doesn't say when a subscriber last opened or clicked, so the last activity is the time a sync first saw
+their opens or clicks go up. It stays empty until that happens at least once after the first run.
+"""
+import os
+from datetime import datetime, timezone
+
+from src.hubspotFunctions import batch_update_hubspot_objects
+from src.snapshotFunctions import SnapshotReader, write_snapshot
+
+# The MailerLite subscriber stats and the HubSpot contact properties they are written to.
+# The properties need to be created in HubSpot first, as number properties.
+ENGAGEMENT_PROPERTIES = {
+    "opens_count": "mailerlite_opens_count",
+    "clicks_count": "mailerlite_clicks_count",
+    "open_rate": "mailerlite_open_rate",
+    "click_rate": "mailerlite_click_rate",
+}
+# The HubSpot contact property for the last activity, created in HubSpot as a date and time property.
+LAST_ACTIVITY_PROPERTY = "mailerlite_last_activity"
+
+
+def _get_activity_count(stats):
+    return (stats.get('opens_count') or 0) + (stats.get('clicks_count') or 0)
+
+
+def diff_engagement_stats(subscribers, pushed, detected_at):
+    """
+    Works out which contacts' engagement stats have changed since they were last pushed to HubSpot.
+
+    :param subscribers: The MailerLite subscribers, as returned by get_all_mailerlite_subscribers.
+    :type subscribers: list[dict]
+    :param pushed: A dictionary of contact ID to the record last pushed for the contact.
+    :type pushed: dict
+    :param detected_at: The time to use as the last activity of contacts whose opens or clicks went up.
+    :type detected_at: datetime
+    :return: A tuple of a dictionary of contact ID to the HubSpot properties to update, and a dictionary of contact ID
+             to the record to save once the update has been sent.
+    :rtype: tuple[dict, dict]
+    """
+    updates = {}
+    records = {}
+    for subscriber in subscribers:
+        contact_id = (subscriber.get('fields') or {}).get('hs_object_id')
+        if not contact_id:
+            continue
+        stats = {name: subscriber.get(name) for name in ENGAGEMENT_PROPERTIES}
+        previous = pushed.get(contact_id)
+        if previous is not None and previous['stats'] == stats:
+            continue
+
+        last_activity = previous['last_activity'] if previous is not None else None
+        if previous is not None and _get_activity_count(stats) > _get_activity_count(previous['stats']):
+            last_activity = detected_at.isoformat()
+
+        # HubSpot takes every property value as a string, and an empty string clears the property.
+        properties = {property_name: "" if stats[name] is None else str(stats[name])
+                      for name, property_name in ENGAGEMENT_PROPERTIES.items()}
+        if last_activity:
+            properties[LAST_ACTIVITY_PROPERTY] = last_activity
+        updates[contact_id] = properties
+        records[contact_id] = {'contact_id': contact_id, 'stats': stats, 'last_activity': last_activity}
+
+    return updates, records
+
+
+def push_engagement_stats(hubspot_client, subscribers, output_dir='output'):
+    """
+    Writes the engagement stats that have changed since the last run to the subscribers' HubSpot contacts.
+    The values pushed are kept in output_dir/engagementStats.snap. Contacts that failed to update are left out of it,
+    so they are tried again on the next run.
+
+    :param hubspot_client: The HubSpot client instance.
+    :param subscribers: The MailerLite subscribers, as returned by get_all_mailerlite_subscribers.
+    :type subscribers: list[dict]
+    :param output_dir: The folder to keep the pushed stats snapshot in.
+    :type output_dir: str
+    :return: The number of contacts updated.
+    :rtype: int
+    """
+    snapshot_path = os.path.join(output_dir, 'engagementStats.snap')
+    pushed = {}
+    if os.path.exists(snapshot_path):
+        with SnapshotReader(snapshot_path) as snapshot:
+            pushed = {record['contact_id']: record for record in snapshot}
+
+    updates, records = diff_engagement_stats(subscribers, pushed, datetime.now(timezone.utc))
+    if not updates:
+        print("No MailerLite engagement stats have changed since the last run.")
+        return 0
+
+    updated_ids = batch_update_hubspot_objects(hubspot_client, 'contacts', updates)
+    for contact_id in updated_ids:
+        pushed[contact_id] = records[contact_id]
+    write_snapshot(list(pushed.values()), snapshot_path, email_getter=lambda record: record['contact_id'])
+
+    print(f"Updated the MailerLite engagement stats of {len(updated_ids)} of {len(updates)} changed HubSpot contacts.")
+    return len(updated_ids)
@@ -1,13 +1,29 @@
-import json
-from datetime import datetime
+from datetime import datetime, timezone
 import os
+import threading
+import time
 
 from hubspot.crm.contacts import SimplePublicObjectWithAssociations
 from dotenv import load_dotenv
 from hubspot import HubSpot
+from hubspot.discovery.discovery_base import DiscoveryBase
 
-from src.hubspotFunctions import get_hubspot_contacts_with_http, get_all_hubspot_contacts
-from src.mailerliteFunctions import update_mailerlite_subscriber, create_mailerlite_subscriber, get_all_mailerlite_subscribers
+from src.jsonFunctions import CustomJSONEncoder
+from src.hubspotFunctions import get_hubspot_contacts_with_http, get_all_hubspot_contacts, get_archived_hubspot_contacts, \
+    search_hubspot_contacts_modified_since, batch_read_hubspot_contacts_by_email
+from src.mailerliteFunctions import update_mailerlite_subscriber, create_mailerlite_subscriber, get_all_mailerlite_subscribers, \
+    unsubscribe_mailerlite_subscribers, upsert_mailerlite_subscribers, get_mailerlite_retry_handlers, MAILERLITE_BATCH_LIMIT
+from src.engagementFunctions import push_engagement_stats
+from src.groupFunctions import sync_group_memberships
+from src.purchaseFunctions import get_purchase_fields
+from src.rateControlFunctions import account_scope
+from src.retryFunctions import RetryQueue, get_circuit_breaker
+from src.snapshotFunctions import SnapshotReader, write_snapshot
+from src.stateFunctions import load_state, save_state
+from src.traceFunctions import span
+
+# Todo: Set to True to enable writing subscribers to MailerLite once testing is complete.
+WRITE_SUBSCRIBERS = False
 
 
 def init():
@@ -24,84 +40,266 @@ def init():
     mailerlite_api_key = os.getenv('MAILERLITE_API_KEY')
 
     # Instantiate the HubSpot client using the API key
-    hubspot_client = HubSpot(access_token=hubspot_api_key)
+    hubspot_client = create_hubspot_client(hubspot_api_key)
 
     return hubspot_client, mailerlite_api_key
 
 
-# Custom JSON encoder to handle datetime objects
-class CustomJSONEncoder(json.JSONEncoder):
+def init_accounts():
+    """
+    Initialises the clients for every HubSpot portal and MailerLite account pair to sync.
+
+    Account names are listed in SYNC_ACCOUNTS, separated by commas, and each account's keys are read from
+    environment variables prefixed with its upper case name, e.g. for SYNC_ACCOUNTS=brand_a,brand_b:
+    BRAND_A_HUBSPOT_API_KEY, BRAND_A_MAILERLITE_API_KEY, BRAND_B_HUBSPOT_API_KEY and BRAND_B_MAILERLITE_API_KEY.
+    Each account's output files are kept in its own folder, e.g. output/brand_a.
+    If SYNC_ACCOUNTS isn't set, a single default account is created from HUBSPOT_API_KEY and MAILERLITE_API_KEY.
+
+    :return: A list of accounts, each a dictionary with the name, HubSpot client, MailerLite API key and settings.
+    :rtype: list[dict]
+    """
+
+    # Load environment variables from the .env file.
+    load_dotenv()
+
+    account_names = [name.strip() for name in os.getenv('SYNC_ACCOUNTS', '').split(',') if name.strip()]
+    if not account_names:
+        # Fall back to the single pair of keys used by init().
+        hubspot_client, mailerlite_api_key = init()
+        return [{
+            'name': None,
+            'hubspot_client': hubspot_client,
+            'mailerlite_api_key': mailerlite_api_key,
+            'output_dir': 'output',
+            'sync_archived': _get_bool_env('MAILERLITE_SYNC_ARCHIVED'),
+            'delete_archived': _get_bool_env('MAILERLITE_DELETE_ARCHIVED'),
+            'push_engagement': _get_bool_env('PUSH_ENGAGEMENT_STATS'),
+            'sync_groups': _get_bool_env('MAILERLITE_SYNC_GROUPS'),
+        }]
+
+    accounts = []
+    for name in account_names:
+        prefix = f"{name.upper()}_"
+        hubspot_api_key = os.getenv(f'{prefix}HUBSPOT_API_KEY')
+        mailerlite_api_key = os.getenv(f'{prefix}MAILERLITE_API_KEY')
+        if not hubspot_api_key or not mailerlite_api_key:
+            raise ValueError(f"Missing {prefix}HUBSPOT_API_KEY or {prefix}MAILERLITE_API_KEY for account {name}.")
+        accounts.append({
+            'name': name,
+            'hubspot_client': create_hubspot_client(hubspot_api_key),
+            'mailerlite_api_key': mailerlite_api_key,
+            'output_dir': os.path.join('output', name),
+            'sync_archived': _get_bool_env(f'{prefix}MAILERLITE_SYNC_ARCHIVED'),
+            'delete_archived': _get_bool_env(f'{prefix}MAILERLITE_DELETE_ARCHIVED'),
+            'push_engagement': _get_bool_env(f'{prefix}PUSH_ENGAGEMENT_STATS'),
+            'sync_groups': _get_bool_env(f'{prefix}MAILERLITE_SYNC_GROUPS'),
+        })
+    return accounts
+
+
+def create_hubspot_client(access_token):
     """
-    Custom JSON encoder to handle datetime objects.
-    Datetime objects are converted to ISO 8601 string format which is compatible with JSON serialization.
+    Creates a HubSpot client that reuses its API objects and asks for gzipped responses.
+    The SDK otherwise builds a new ApiClient, with its own connection pool, every time an API is used,
+    so no connection would be reused between requests. Each API is built once instead, through the factory the SDK
+    creates them with, and kept for as long as the client is. Its urllib3 pool decompresses the responses itself.
+
+    :param access_token: The HubSpot private app access token.
+    :type access_token: str
+    :rtype: HubSpot
     """
+    apis = {}
+    lock = threading.Lock()
+
+    def api_factory(api_client_package, api_name, config):
+        # The access token is part of the key, so setting a new one on the client builds new APIs for it.
+        key = (api_client_package.__name__, api_name, config.get('access_token'))
+        with lock:
+            if key not in apis:
+                api = DiscoveryBase._default_api_factory(api_client_package, api_name, config)
+                api.api_client.set_default_header('Accept-Encoding', 'gzip')
+                apis[key] = api
+            return apis[key]
 
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            # Convert datetime objects to ISO 8601 string format
-            return obj.isoformat()
-        return super().default(obj)
+    return HubSpot(access_token=access_token, api_factory=api_factory)
+
+
+def _get_bool_env(name, default='false'):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes')
+
+
+# Define the custom properties we want to retrieve from HubSpot.
+# This list includes all the properties that are relevant to our integration.
+HUBSPOT_CONTACT_PROPERTIES = [
+    "_zap_search_was_found_status", "createdAt", "updatedAt", "archived",
+    "abandoned_cart_counter", "abandoned_cart_date", "abandoned_cart_products",
+    "abandoned_cart_products_categories", "abandoned_cart_products_skus",
+    "abandoned_cart_subtotal", "abandoned_cart_url", "address", "city",
+    "company", "country", "createdate", "current_abandoned_cart", "email",
+    "firstname", "hs_createdate", "hs_email_domain", "hs_language",
+    "hs_object_id", "hs_persona", "last_product_bought", "last_products_bought",
+    "last_products_bought_product_1_image_url", "last_products_bought_product_1_name",
+    "last_products_bought_product_1_price", "last_products_bought_product_1_url",
+    "last_products_bought_product_2_image_url", "last_products_bought_product_2_name",
+    "last_products_bought_product_2_price", "last_products_bought_product_2_url",
+    "last_products_bought_product_3_image_url", "last_products_bought_product_3_name",
+    "last_products_bought_product_3_price", "last_products_bought_product_3_url",
+    "last_total_number_of_products_bought", "lastmodifieddate", "lastname",
+    "lifecyclestage", "opportunity", "mobilephone", "numemployees", "phone",
+    "products_bought", "salutation", "state", "total_number_of_products_bought",
+    "website", "zip", "last_order_order_number"
+]
 
 
 # Get all the data from HubSpot and MailerLite.
-def get_all_data(hubspot_client, mailerlite_api_key):
+def get_all_data(hubspot_client, mailerlite_api_key, output_dir='output', contact_cache=None, include_groups=False):
     """
     Retrieves all contacts from HubSpot and subscribers from MailerLite.
     :param hubspot_client: The HubSpot client instance.
     :param mailerlite_api_key: The API key for MailerLite.
+    :param output_dir: The folder to save the subscribers snapshot in.
+    :param contact_cache: An optional dictionary kept between runs by a long-running process. Once it holds the
+                          contacts from a previous run, only the contacts modified since then are fetched from HubSpot.
+                          Clear it to fetch every contact again.
+    :type contact_cache: dict
+    :param include_groups: Whether to fetch each MailerLite subscriber's groups too.
+    :type include_groups: bool
     :return: A tuple containing a list of all HubSpot contacts and a dictionary of all MailerLite subscribers.
+    :raises RuntimeError: If the MailerLite subscribers couldn't all be read.
     """
 
-    # Define the custom properties we want to retrieve from HubSpot.
-    # This list includes all the properties that are relevant to our integration.
-    properties = [
-        "_zap_search_was_found_status", "createdAt", "updatedAt", "archived",
-        "abandoned_cart_counter", "abandoned_cart_date", "abandoned_cart_products",
-        "abandoned_cart_products_categories", "abandoned_cart_products_skus",
-        "abandoned_cart_subtotal", "abandoned_cart_url", "address", "city",
-        "company", "country", "createdate", "current_abandoned_cart", "email",
-        "firstname", "hs_createdate", "hs_email_domain", "hs_language",
-        "hs_object_id", "hs_persona", "last_product_bought", "last_products_bought",
-        "last_products_bought_product_1_image_url", "last_products_bought_product_1_name",
-        "last_products_bought_product_1_price", "last_products_bought_product_1_url",
-        "last_products_bought_product_2_image_url", "last_products_bought_product_2_name",
-        "last_products_bought_product_2_price", "last_products_bought_product_2_url",
-        "last_products_bought_product_3_image_url", "last_products_bought_product_3_name",
-        "last_products_bought_product_3_price", "last_products_bought_product_3_url",
-        "last_total_number_of_products_bought", "lastmodifieddate", "lastname",
-        "lifecyclestage", "opportunity", "mobilephone", "numemployees", "phone",
-        "products_bought", "salutation", "state", "total_number_of_products_bought",
-        "website", "zip", "last_order_order_number"
-    ]
-
     # Step 1: Retrieve all contacts from HubSpot with the specified properties.
     # This function should interact with the HubSpot API to fetch all contacts with the given properties.
-    all_hubspot_contacts: list[SimplePublicObjectWithAssociations] = get_all_hubspot_contacts(hubspot_client, properties)
+    with span("stage:get_all_hubspot_contacts"):
+        all_hubspot_contacts: list[SimplePublicObjectWithAssociations] = get_cached_hubspot_contacts(hubspot_client, HUBSPOT_CONTACT_PROPERTIES,
+                                                                                                     contact_cache)
 
     # Step 2: Retrieve subscribers from MailerLite.
     # Fetch the first page of subscribers from MailerLite using the provided API key.
-    ml_subscribers = get_all_mailerlite_subscribers(mailerlite_api_key)
+    with span("stage:get_all_mailerlite_subscribers"):
+        ml_subscribers = get_all_mailerlite_subscribers(mailerlite_api_key, include_groups=include_groups)
+    if ml_subscribers is None:
+        # Syncing against some of the subscribers would recreate or unsubscribe the rest, so stop the run here.
+        raise RuntimeError("Couldn't read every subscriber from MailerLite.")
     # Convert the list of subscribers to a dictionary for easier lookup by email.
-    ml_subscribers_dict = {subscriber['email']: subscriber for subscriber in ml_subscribers}
+    with span("stage:build_email_index", subscribers=len(ml_subscribers)):
+        ml_subscribers_dict = build_email_index(ml_subscribers)
 
-    # Save the retrieved MailerLite subscribers to a JSON file for reference.
-    with open('output/mailerliteSubscribers.json', 'w') as file:
-        json.dump(ml_subscribers, file, indent=4)
+    # Save the retrieved MailerLite subscribers to a snapshot file for reference.
+    # Use python -m src.snapshotFunctions to-json to convert it to JSON if needed.
+    with span("stage:write_snapshot"):
+        write_snapshot(ml_subscribers, os.path.join(output_dir, 'mailerliteSubscribers.snap'))
 
     return all_hubspot_contacts, ml_subscribers_dict
 
 
-# Process all the data from HubSpot to MailerLite
-def process_all_data(all_hubspot_contacts, ml_subscribers_dict, mailerlite_api_key):
+def build_email_index(subscribers):
     """
-    Takes all the data from HubSpot and updates or creates subscribers in MailerLite.
-    :param all_hubspot_contacts: A list of all contacts from HubSpot.
+    Indexes MailerLite subscribers by their email address for quick lookups.
+
+    :param subscribers: The MailerLite subscribers, as returned by get_all_mailerlite_subscribers.
+    :type subscribers: list[dict]
+    :return: A dictionary of email to subscriber.
+    :rtype: dict
+    """
+    return {subscriber['email']: subscriber for subscriber in subscribers}
+
+
+def get_cached_hubspot_contacts(hubspot_client, properties, contact_cache=None):
+    """
+    Retrieves all contacts from HubSpot, only fetching the contacts modified since the last run if they are cached.
+    Contacts archived since the last run are dropped from the cache.
+    Falls back to fetching every contact if there is no cache yet or either read fails.
+
+    :param hubspot_client: The HubSpot client instance.
+    :param properties: A list of properties to retrieve for the contacts.
+    :type properties: list
+    :param contact_cache: A dictionary kept between runs, holding the contacts by ID and when they were fetched.
+    :type contact_cache: dict
+    :return: A list of all contacts, or None if an error occurred.
+    :rtype: list
+    """
+    if contact_cache is None:
+        return get_all_hubspot_contacts(hubspot_client, properties)
+
+    run_started_at = datetime.now(timezone.utc)
+    checkpoint = contact_cache.get('checkpoint')
+    changed_contacts = None
+    archived_contacts = None
+    if checkpoint:
+        changed_contacts = search_hubspot_contacts_modified_since(hubspot_client, datetime.fromisoformat(checkpoint), properties)
+        if changed_contacts is not None:
+            # The search doesn't return archived contacts, so look them up separately to take them out of the cache.
+            archived_contacts = get_archived_hubspot_contacts(hubspot_client, datetime.fromisoformat(checkpoint))
+
+    if changed_contacts is None or archived_contacts is None:
+        contacts = get_all_hubspot_contacts(hubspot_client, properties)
+        if contacts is None:
+            return None
+        contact_cache['contacts'] = {contact.id: contact for contact in contacts}
+    else:
+        print(f"Fetched {len(changed_contacts)} HubSpot contacts modified since {checkpoint}, "
+              f"and {len(archived_contacts)} archived since.")
+        contact_cache['contacts'].update((contact.id, contact) for contact in changed_contacts)
+        for contact in archived_contacts:
+            contact_cache['contacts'].pop(contact.id, None)
+
+    contact_cache['checkpoint'] = run_started_at.isoformat()
+    return list(contact_cache['contacts'].values())
+
+
+# The HubSpot contact properties copied into MailerLite custom fields.
+SUBSCRIBER_FIELD_NAMES = [
+    "createdAt", "updatedAt", "archived",
+    "abandoned_cart_counter", "abandoned_cart_date", "abandoned_cart_products",
+    "abandoned_cart_products_categories", "abandoned_cart_products_skus",
+    "abandoned_cart_subtotal", "abandoned_cart_url", "address", "city",
+    "company", "country", "createdate", "current_abandoned_cart",
+    "firstname", "hs_createdate", "hs_email_domain", "hs_language",
+    "hs_object_id", "hs_persona", "last_product_bought", "last_products_bought",
+    "last_products_bought_product_1_image_url", "last_products_bought_product_1_name",
+    "last_products_bought_product_1_price", "last_products_bought_product_1_url",
+    "last_products_bought_product_2_image_url", "last_products_bought_product_2_name",
+    "last_products_bought_product_2_price", "last_products_bought_product_2_url",
+    "last_products_bought_product_3_image_url", "last_products_bought_product_3_name",
+    "last_products_bought_product_3_price", "last_products_bought_product_3_url",
+    "last_total_number_of_products_bought", "lastmodifieddate", "lastname",
+    "lifecyclestage", "opportunity", "mobilephone", "numemployees", "phone",
+    "products_bought", "salutation", "state", "total_number_of_products_bought",
+    "website", "zip", "last_order_order_number"
+]
+
+
+def build_subscriber_fields(contact, purchase_fields=None):
+    """
+    Maps a HubSpot contact's properties to MailerLite custom fields.
+
+    :param contact: The HubSpot contact.
+    :type contact: SimplePublicObjectWithAssociations
+    :param purchase_fields: A dictionary of contact ID to purchase fields worked out from deals, which replace
+        the contact's own purchase properties.
+    :type purchase_fields: dict
+    :return: A dictionary of MailerLite field names to values.
+    :rtype: dict
+    """
+    fields = {name: contact.properties.get(name) for name in SUBSCRIBER_FIELD_NAMES}
+    if purchase_fields and contact.id in purchase_fields:
+        fields.update(purchase_fields[contact.id])
+    return fields
+
+
+def build_subscriber_payloads(all_hubspot_contacts, ml_subscribers_dict, purchase_fields=None):
+    """
+    Maps HubSpot contacts to MailerLite payloads one contact at a time, so each can be written as soon as it is built.
+
+    :param all_hubspot_contacts: A list of contacts from HubSpot.
     :type all_hubspot_contacts: list[SimplePublicObjectWithAssociations]
-    :param ml_subscribers_dict: A dictionary of all subscribers from MailerLite.
+    :param ml_subscribers_dict: A dictionary of all subscribers from MailerLite, keyed by email.
     :type ml_subscribers_dict: dict
-    :param mailerlite_api_key: The API key for MailerLite.
-    :type mailerlite_api_key: str
-    :return: None
+    :param purchase_fields: A dictionary of contact ID to purchase fields from get_purchase_fields.
+    :type purchase_fields: dict
+    :return: Yields (email, subscriber ID, payload) for each contact, in the same order as the contacts.
+             The subscriber ID is None for contacts that aren't in MailerLite yet.
     """
     # Loop through all the contacts from HubSpot.
     for contact in all_hubspot_contacts:
@@ -112,141 +310,309 @@ def process_all_data(all_hubspot_contacts, ml_subscribers_dict, mailerlite_api_k
         if email in ml_subscribers_dict:
             # Create a new object with the updated data from the relevant contact.
             update_data = {
-                "fields": {
-                    "createdAt": contact.properties.get('createdAt'),
-                    "updatedAt": contact.properties.get('updatedAt'),
-                    "archived": contact.properties.get('archived'),
-                    "abandoned_cart_counter": contact.properties.get('abandoned_cart_counter'),
-                    "abandoned_cart_date": contact.properties.get('abandoned_cart_date'),
-                    "abandoned_cart_products": contact.properties.get('abandoned_cart_products'),
-                    "abandoned_cart_products_categories": contact.properties.get('abandoned_cart_products_categories'),
-                    "abandoned_cart_products_skus": contact.properties.get('abandoned_cart_products_skus'),
-                    "abandoned_cart_subtotal": contact.properties.get('abandoned_cart_subtotal'),
-                    "abandoned_cart_url": contact.properties.get('abandoned_cart_url'),
-                    "address": contact.properties.get('address'),
-                    "city": contact.properties.get('city'),
-                    "company": contact.properties.get('company'),
-                    "country": contact.properties.get('country'),
-                    "createdate": contact.properties.get('createdate'),
-                    "current_abandoned_cart": contact.properties.get('current_abandoned_cart'),
-                    "firstname": contact.properties.get('firstname'),
-                    "hs_createdate": contact.properties.get('hs_createdate'),
-                    "hs_email_domain": contact.properties.get('hs_email_domain'),
-                    "hs_language": contact.properties.get('hs_language'),
-                    "hs_object_id": contact.properties.get('hs_object_id'),
-                    "hs_persona": contact.properties.get('hs_persona'),
-                    "last_product_bought": contact.properties.get('last_product_bought'),
-                    "last_products_bought": contact.properties.get('last_products_bought'),
-                    "last_products_bought_product_1_image_url": contact.properties.get(
-                        'last_products_bought_product_1_image_url'),
-                    "last_products_bought_product_1_name": contact.properties.get(
-                        'last_products_bought_product_1_name'),
-                    "last_products_bought_product_1_price": contact.properties.get(
-                        'last_products_bought_product_1_price'),
-                    "last_products_bought_product_1_url": contact.properties.get('last_products_bought_product_1_url'),
-                    "last_products_bought_product_2_image_url": contact.properties.get(
-                        'last_products_bought_product_2_image_url'),
-                    "last_products_bought_product_2_name": contact.properties.get(
-                        'last_products_bought_product_2_name'),
-                    "last_products_bought_product_2_price": contact.properties.get(
-                        'last_products_bought_product_2_price'),
-                    "last_products_bought_product_2_url": contact.properties.get('last_products_bought_product_2_url'),
-                    "last_products_bought_product_3_image_url": contact.properties.get(
-                        'last_products_bought_product_3_image_url'),
-                    "last_products_bought_product_3_name": contact.properties.get(
-                        'last_products_bought_product_3_name'),
-                    "last_products_bought_product_3_price": contact.properties.get(
-                        'last_products_bought_product_3_price'),
-                    "last_products_bought_product_3_url": contact.properties.get('last_products_bought_product_3_url'),
-                    "last_total_number_of_products_bought": contact.properties.get(
-                        'last_total_number_of_products_bought'),
-                    "lastmodifieddate": contact.properties.get('lastmodifieddate'),
-                    "lastname": contact.properties.get('lastname'),
-                    "lifecyclestage": contact.properties.get('lifecyclestage'),
-                    "opportunity": contact.properties.get('opportunity'),
-                    "mobilephone": contact.properties.get('mobilephone'),
-                    "numemployees": contact.properties.get('numemployees'),
-                    "phone": contact.properties.get('phone'),
-                    "products_bought": contact.properties.get('products_bought'),
-                    "salutation": contact.properties.get('salutation'),
-                    "state": contact.properties.get('state'),
-                    "total_number_of_products_bought": contact.properties.get('total_number_of_products_bought'),
-                    "website": contact.properties.get('website'),
-                    "zip": contact.properties.get('zip'),
-                    "last_order_order_number": contact.properties.get('last_order_order_number')
-                }
+                "fields": build_subscriber_fields(contact, purchase_fields)
             }
-            # Call the function to update the subscriber in MailerLite with the new data.
-            update_mailerlite_subscriber(mailerlite_api_key, ml_subscribers_dict[email]['id'], update_data)
+            yield email, ml_subscribers_dict[email]['id'], update_data
 
         # If the email is not found in the MailerLite subscribers dictionary, create a new subscriber.
         elif email not in ml_subscribers_dict:
             # Prepare the data to create a new subscriber in MailerLite
             create_data = {
                 "email": email,
-                "fields": {
-                    "createdAt": contact.properties.get('createdAt'),
-                    "updatedAt": contact.properties.get('updatedAt'),
-                    "archived": contact.properties.get('archived'),
-                    "abandoned_cart_counter": contact.properties.get('abandoned_cart_counter'),
-                    "abandoned_cart_date": contact.properties.get('abandoned_cart_date'),
-                    "abandoned_cart_products": contact.properties.get('abandoned_cart_products'),
-                    "abandoned_cart_products_categories": contact.properties.get('abandoned_cart_products_categories'),
-                    "abandoned_cart_products_skus": contact.properties.get('abandoned_cart_products_skus'),
-                    "abandoned_cart_subtotal": contact.properties.get('abandoned_cart_subtotal'),
-                    "abandoned_cart_url": contact.properties.get('abandoned_cart_url'),
-                    "address": contact.properties.get('address'),
-                    "city": contact.properties.get('city'),
-                    "company": contact.properties.get('company'),
-                    "country": contact.properties.get('country'),
-                    "createdate": contact.properties.get('createdate'),
-                    "current_abandoned_cart": contact.properties.get('current_abandoned_cart'),
-                    "firstname": contact.properties.get('firstname'),
-                    "hs_createdate": contact.properties.get('hs_createdate'),
-                    "hs_email_domain": contact.properties.get('hs_email_domain'),
-                    "hs_language": contact.properties.get('hs_language'),
-                    "hs_object_id": contact.properties.get('hs_object_id'),
-                    "hs_persona": contact.properties.get('hs_persona'),
-                    "last_product_bought": contact.properties.get('last_product_bought'),
-                    "last_products_bought": contact.properties.get('last_products_bought'),
-                    "last_products_bought_product_1_image_url": contact.properties.get(
-                        'last_products_bought_product_1_image_url'),
-                    "last_products_bought_product_1_name": contact.properties.get(
-                        'last_products_bought_product_1_name'),
-                    "last_products_bought_product_1_price": contact.properties.get(
-                        'last_products_bought_product_1_price'),
-                    "last_products_bought_product_1_url": contact.properties.get('last_products_bought_product_1_url'),
-                    "last_products_bought_product_2_image_url": contact.properties.get(
-                        'last_products_bought_product_2_image_url'),
-                    "last_products_bought_product_2_name": contact.properties.get(
-                        'last_products_bought_product_2_name'),
-                    "last_products_bought_product_2_price": contact.properties.get(
-                        'last_products_bought_product_2_price'),
-                    "last_products_bought_product_2_url": contact.properties.get('last_products_bought_product_2_url'),
-                    "last_products_bought_product_3_image_url": contact.properties.get(
-                        'last_products_bought_product_3_image_url'),
-                    "last_products_bought_product_3_name": contact.properties.get(
-                        'last_products_bought_product_3_name'),
-                    "last_products_bought_product_3_price": contact.properties.get(
-                        'last_products_bought_product_3_price'),
-                    "last_products_bought_product_3_url": contact.properties.get('last_products_bought_product_3_url'),
-                    "last_total_number_of_products_bought": contact.properties.get(
-                        'last_total_number_of_products_bought'),
-                    "lastmodifieddate": contact.properties.get('lastmodifieddate'),
-                    "lastname": contact.properties.get('lastname'),
-                    "lifecyclestage": contact.properties.get('lifecyclestage'),
-                    "opportunity": contact.properties.get('opportunity'),
-                    "mobilephone": contact.properties.get('mobilephone'),
-                    "numemployees": contact.properties.get('numemployees'),
-                    "phone": contact.properties.get('phone'),
-                    "products_bought": contact.properties.get('products_bought'),
-                    "salutation": contact.properties.get('salutation'),
-                    "state": contact.properties.get('state'),
-                    "total_number_of_products_bought": contact.properties.get('total_number_of_products_bought'),
-                    "website": contact.properties.get('website'),
-                    "zip": contact.properties.get('zip'),
-                    "last_order_order_number": contact.properties.get('last_order_order_number')
-                }
+                "fields": build_subscriber_fields(contact, purchase_fields)
             }
-            # Call the function to create a new subscriber in MailerLite with the data.
-            create_mailerlite_subscriber(mailerlite_api_key, email, create_data)
+            yield email, None, create_data
+
+
+# Process all the data from HubSpot to MailerLite
+def process_all_data(all_hubspot_contacts, ml_subscribers_dict, mailerlite_api_key, retry_queue=None, purchase_fields=None,
+                     batch=False):
+    """
+    Takes all the data from HubSpot and updates or creates subscribers in MailerLite.
+    Each contact's payload is built just before it is written, so only a batch's worth of payloads is held at once.
+    :param all_hubspot_contacts: A list of all contacts from HubSpot.
+    :type all_hubspot_contacts: list[SimplePublicObjectWithAssociations]
+    :param ml_subscribers_dict: A dictionary of all subscribers from MailerLite.
+    :type ml_subscribers_dict: dict
+    :param mailerlite_api_key: The API key for MailerLite.
+    :type mailerlite_api_key: str
+    :param retry_queue: The queue to add failed writes to so they can be retried at the end of the run.
+    :type retry_queue: RetryQueue
+    :param purchase_fields: A dictionary of contact ID to purchase fields from get_purchase_fields.
+    :type purchase_fields: dict
+    :param batch: Whether to send the writes through the batch endpoint, upserting 50 subscribers per request,
+                  instead of one request per subscriber.
+    :type batch: bool
+    :return: The number of subscribers updated or created.
+    :rtype: int
+    """
+    payloads = build_subscriber_payloads(all_hubspot_contacts, ml_subscribers_dict, purchase_fields)
+    written = 0
+    # Building the payloads happens inside this stage, as each one is needed.
+    with span("stage:write_subscribers", contacts=len(all_hubspot_contacts), batch=batch):
+        if batch:
+            # Upserting matches subscribers by email, so updates and creates can go in the same batches.
+            subscribers = []
+            for email, _, payload in payloads:
+                subscribers.append(dict(payload, email=email))
+                if len(subscribers) >= MAILERLITE_BATCH_LIMIT:
+                    written += upsert_mailerlite_subscribers(mailerlite_api_key, subscribers, retry_queue)
+                    subscribers = []
+            if subscribers:
+                written += upsert_mailerlite_subscribers(mailerlite_api_key, subscribers, retry_queue)
+            return written
+
+        for email, subscriber_id, payload in payloads:
+            if subscriber_id is not None:
+                # Call the function to update the subscriber in MailerLite with the new data.
+                result = update_mailerlite_subscriber(mailerlite_api_key, subscriber_id, payload, retry_queue)
+            else:
+                # Call the function to create a new subscriber in MailerLite with the data.
+                result = create_mailerlite_subscriber(mailerlite_api_key, email, payload, retry_queue)
+            if result is not None:
+                written += 1
+    return written
+
+
+# Propagate contacts archived in HubSpot to MailerLite
+def propagate_archived_contacts(hubspot_client, mailerlite_api_key, ml_subscribers_dict, state, delete=False, retry_queue=None):
+    """
+    Unsubscribes or deletes the MailerLite subscribers whose HubSpot contacts were archived since the last run.
+    The checkpoint is read from and saved to the state under 'archived_contacts_checkpoint'.
+    The first run only sets the checkpoint to now, so contacts archived before the step was turned on are left alone.
+
+    :param hubspot_client: The HubSpot client instance.
+    :param mailerlite_api_key: The API key for MailerLite.
+    :type mailerlite_api_key: str
+    :param ml_subscribers_dict: A dictionary of all subscribers from MailerLite, keyed by email.
+    :type ml_subscribers_dict: dict
+    :param state: The state saved between runs. The checkpoint is updated in place.
+    :type state: dict
+    :param delete: Whether to delete the subscribers instead of unsubscribing them.
+    :type delete: bool
+    :param retry_queue: The queue to add failed writes to so they can be retried at the end of the run.
+    :type retry_queue: RetryQueue
+    :return: The number of subscribers removed.
+    :rtype: int
+    """
+    checkpoint = state.get('archived_contacts_checkpoint')
+    if not checkpoint:
+        # Without a checkpoint every contact ever archived would be removed in one go, so start from now instead.
+        state['archived_contacts_checkpoint'] = datetime.now(timezone.utc).isoformat()
+        print("No archived contacts checkpoint yet, only contacts archived from now on will be removed from MailerLite.")
+        return 0
+    since = datetime.fromisoformat(checkpoint)
+
+    # Get the contacts archived since the last run.
+    archived_contacts = get_archived_hubspot_contacts(hubspot_client, since)
+    if archived_contacts is None:
+        # Leave the checkpoint alone so the next run tries again.
+        return 0
+
+    # Find the matching subscribers through the email index, skipping any that have already been removed.
+    subscribers_to_remove = []
+    for contact in archived_contacts:
+        subscriber = ml_subscribers_dict.get(contact.properties.get('email'))
+        if subscriber is not None and (delete or subscriber.get('status') != 'unsubscribed'):
+            subscribers_to_remove.append(subscriber)
+
+    removed = 0
+    if subscribers_to_remove:
+        removed = unsubscribe_mailerlite_subscribers(mailerlite_api_key, subscribers_to_remove, delete, retry_queue)
+    print(f"{len(archived_contacts)} contacts archived in HubSpot since {checkpoint}, "
+          f"{'deleted' if delete else 'unsubscribed'} {removed} of {len(subscribers_to_remove)} matching subscribers.")
+
+    # Move the checkpoint up to the latest archive time we've seen. Failed removals are in the retry queue.
+    archived_times = [contact.archived_at for contact in archived_contacts if contact.archived_at is not None]
+    if archived_times:
+        state['archived_contacts_checkpoint'] = max(archived_times).isoformat()
+    return removed
+
+
+# Run the whole sync for one HubSpot portal and MailerLite account pair
+def sync_account(account, alerts=None):
+    """
+    Syncs one account from start to finish and reports what happened.
+    Errors are caught and reported so one failing account doesn't stop the others.
+    Everything runs inside the account's scope, so it gets its own rate limit controllers and circuit breakers.
+
+    :param account: The account to sync, as returned by init_accounts().
+    :type account: dict
+    :param alerts: The AlertDispatcher to send errors and dead-lettered writes to.
+    :type alerts: AlertDispatcher
+    :return: A report with the number of records handled, the duration and any error.
+    :rtype: dict
+    """
+    name = account['name']
+    label = name or 'default'
+    output_dir = account['output_dir']
+    report = {'account': label, 'started_at': datetime.now().isoformat(), 'hubspot_contacts': 0,
+              'mailerlite_subscribers': 0, 'groups_assigned': 0, 'groups_unassigned': 0, 'archived_removed': 0,
+              'engagement_pushed': 0, 'retried': 0, 'dead_letters': 0, 'error': None}
+    start = time.monotonic()
+
+    with account_scope(name), span("sync_account", account=label):
+        try:
+            hubspot_client = account['hubspot_client']
+            mailerlite_api_key = account['mailerlite_api_key']
+
+            # Step 1: Retrieve all HubSpot contacts and MailerLite subscribers.
+            with span("stage:get_all_data", account=label):
+                all_hubspot_contacts, all_mailerlite_subscribers = get_all_data(hubspot_client, mailerlite_api_key, output_dir,
+                                                                                account.get('contact_cache'),
+                                                                                account.get('sync_groups', False))
+            report['hubspot_contacts'] = len(all_hubspot_contacts)
+            report['mailerlite_subscribers'] = len(all_mailerlite_subscribers)
+
+            # Output the data to snapshot files for debugging purposes.
+            # Snapshots can be converted back to JSON with: python -m src.snapshotFunctions to-json <snapshot> <json>
+            with span("stage:write_snapshots", account=label):
+                write_snapshot([contact.to_dict() for contact in all_hubspot_contacts],
+                               os.path.join(output_dir, 'allHubSpotContacts.snap'), cls=CustomJSONEncoder)
+                write_snapshot(list(all_mailerlite_subscribers.values()), os.path.join(output_dir, 'allMailerLiteSubscribers.snap'))
+
+            state_path = os.path.join(output_dir, 'syncState.json')
+            sync_state = load_state(state_path)
+            # Failed writes are added to the retry queue, which also holds anything left over from the last run.
+            retry_queue = RetryQueue(os.path.join(output_dir, 'retryQueue.jsonl'),
+                                     os.path.join(output_dir, 'deadLetters.jsonl'), alerts=alerts)
+
+            if WRITE_SUBSCRIBERS:
+                # Step 2: Work out each contact's purchase fields from the deals modified since the last run.
+                # This is skipped while writing is turned off, since it moves the deals checkpoint on and the
+                # contacts on those deals wouldn't be recalculated again once writing is turned on.
+                with span("stage:get_purchase_fields", account=label):
+                    purchase_fields = get_purchase_fields(hubspot_client, sync_state, output_dir)
+
+                # Step 3: Update or create MailerLite subscribers with HubSpot data.
+                process_all_data(all_hubspot_contacts, all_mailerlite_subscribers, mailerlite_api_key, retry_queue, purchase_fields)
+
+            # Step 4: Move subscribers into the groups for their lifecycle stage and persona, if enabled.
+            if account.get('sync_groups'):
+                with span("stage:sync_group_memberships", account=label):
+                    report['groups_assigned'], report['groups_unassigned'] = sync_group_memberships(
+                        all_hubspot_contacts, all_mailerlite_subscribers, mailerlite_api_key, retry_queue)
+
+            # Step 5: Unsubscribe contacts archived in HubSpot since the last run, or delete them if configured to, if enabled.
+            if account.get('sync_archived'):
+                with span("stage:propagate_archived_contacts", account=label):
+                    report['archived_removed'] = propagate_archived_contacts(hubspot_client, mailerlite_api_key,
+                                                                             all_mailerlite_subscribers, sync_state,
+                                                                             account['delete_archived'], retry_queue)
+            save_state(sync_state, state_path)
+
+            # Step 6: Copy the MailerLite opens and clicks that changed since the last run back to HubSpot, if enabled.
+            if account.get('push_engagement'):
+                with span("stage:push_engagement_stats", account=label):
+                    report['engagement_pushed'] = push_engagement_stats(hubspot_client, list(all_mailerlite_subscribers.values()),
+                                                                        output_dir)
+
+            # Step 7: Retry any failed writes with backoff. Anything that keeps failing goes to the dead-letter file.
+            with span("stage:drain_retry_queue", account=label):
+                report['retried'] = retry_queue.drain(get_mailerlite_retry_handlers(mailerlite_api_key),
+                                                      get_circuit_breaker('mailerlite'))
+            report['dead_letters'] = retry_queue.dead_letter_count
+
+        except Exception as e:
+            # Define an error message to print and send in an email alert.
+            error_message = f"An uncaught exception occurred syncing the {label} account: {e}"
+            print(error_message)
+            report['error'] = str(e)
+            if alerts is not None:
+                alerts.alert(f"Script Error Alert ({label})", error_message)
+
+    report['duration'] = time.monotonic() - start
+    return report
+
+
+def read_emails_file(path):
+    """
+    Reads a list of email addresses from a file, one per line or separated by commas.
+    Blank lines and lines starting with # are ignored. HubSpot stores emails in lower case, so they are lower cased too.
+
+    :param path: The file to read.
+    :type path: str
+    :return: The email addresses in the order they first appear, without duplicates.
+    :rtype: list[str]
+    """
+    emails = {}
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            for email in line.split(','):
+                email = email.strip().lower()
+                if email:
+                    emails[email] = None
+    return list(emails)
+
+
+def sync_contacts_by_email(account, emails, alerts=None):
+    """
+    Syncs only the HubSpot contacts with the given email addresses to MailerLite, e.g. to fix a handful of people.
+    The contacts are read with the batch read API, 100 per request, rather than one search per email,
+    then mapped like a full sync and upserted to MailerLite in batches.
+    Purchase fields come from the snapshot saved by the last full sync, if there is one.
+
+    :param account: The account to sync, as returned by init_accounts().
+    :type account: dict
+    :param emails: The email addresses of the contacts to sync.
+    :type emails: list[str]
+    :param alerts: The AlertDispatcher to send errors and dead-lettered writes to.
+    :type alerts: AlertDispatcher
+    :return: A report with the number of contacts found and written, the emails not found, the duration and any error.
+    :rtype: dict
+    """
+    name = account['name']
+    label = name or 'default'
+    output_dir = account['output_dir']
+    report = {'account': label, 'started_at': datetime.now().isoformat(), 'requested': len(emails),
+              'hubspot_contacts': 0, 'written': 0, 'not_found': [], 'retried': 0, 'dead_letters': 0, 'error': None}
+    start = time.monotonic()
+
+    with account_scope(name), span("sync_contacts_by_email", account=label, emails=len(emails)):
+        try:
+            mailerlite_api_key = account['mailerlite_api_key']
+
+            # Step 1: Read the contacts from HubSpot, using the email as the ID.
+            with span("stage:batch_read_hubspot_contacts", account=label):
+                contacts = batch_read_hubspot_contacts_by_email(account['hubspot_client'], emails, HUBSPOT_CONTACT_PROPERTIES)
+            if contacts is None:
+                raise RuntimeError("Couldn't read the contacts from HubSpot.")
+            report['hubspot_contacts'] = len(contacts)
+            found = {(contact.properties.get('email') or '').lower() for contact in contacts}
+            report['not_found'] = [email for email in emails if email not in found]
+            if report['not_found']:
+                print(f"No HubSpot contact found for {len(report['not_found'])} emails: {', '.join(report['not_found'])}")
+
+            # Step 2: Use the purchase fields worked out by the last full sync, without moving its checkpoint.
+            purchase_fields = {}
+            purchase_fields_path = os.path.join(output_dir, 'purchaseFields.snap')
+            if os.path.exists(purchase_fields_path):
+                with SnapshotReader(purchase_fields_path) as snapshot:
+                    for contact in contacts:
+                        record = snapshot.get(contact.id)
+                        if record is not None:
+                            purchase_fields[contact.id] = record['fields']
+
+            # Step 3: Upsert the subscribers in batches. Upserting matches by email, so the MailerLite subscribers aren't needed.
+            retry_queue = RetryQueue(os.path.join(output_dir, 'retryQueue.jsonl'),
+                                     os.path.join(output_dir, 'deadLetters.jsonl'), alerts=alerts)
+            report['written'] = process_all_data(contacts, {}, mailerlite_api_key, retry_queue, purchase_fields, batch=True)
+
+            # Step 4: Retry any failed writes with backoff.
+            with span("stage:drain_retry_queue", account=label):
+                report['retried'] = retry_queue.drain(get_mailerlite_retry_handlers(mailerlite_api_key),
+                                                      get_circuit_breaker('mailerlite'))
+            report['dead_letters'] = retry_queue.dead_letter_count
+
+        except Exception as e:
+            error_message = f"An uncaught exception occurred syncing emails for the {label} account: {e}"
+            print(error_message)
+            report['error'] = str(e)
+            if alerts is not None:
+                alerts.alert(f"Script Error Alert ({label})", error_message)
+
+    report['duration'] = time.monotonic() - start
+    return report
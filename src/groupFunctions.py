@@ -0,0 +1,118 @@
+"""
+Keeps MailerLite group membership in line with each contact's HubSpot lifecycle stage and persona.
+
+Each mapped property gets a group per value, e.g. "Lifecycle stage: customer" or "Persona: persona_1", which is
+created the first time it is needed. The groups a subscriber should be in are worked out from their contact and
+compared with the groups they are in from the subscriber scan, and only the differences are sent, in batches.
+
+Only groups named with one of the prefixes are managed, so groups made by hand in MailerLite are never touched.
+Groups are named after the property's internal values rather than its labels, so renaming a label in HubSpot
+doesn't move everyone to a new group. New subscribers are added to their groups on the run after they are created.
+"""
+from src.mailerliteFunctions import get_all_mailerlite_groups, create_mailerlite_group, set_mailerlite_group_memberships
+
+# The HubSpot contact properties that decide group membership, and the prefix of the groups made for their values.
+GROUP_PROPERTIES = {
+    "lifecyclestage": "Lifecycle stage",
+    "hs_persona": "Persona",
+}
+
+
+def get_group_names(contact):
+    """
+    Works out the names of the groups a contact's subscriber should be in.
+
+    :param contact: The HubSpot contact.
+    :type contact: SimplePublicObjectWithAssociations
+    :return: The group names.
+    :rtype: set[str]
+    """
+    group_names = set()
+    for property_name, prefix in GROUP_PROPERTIES.items():
+        value = contact.properties.get(property_name)
+        if not value:
+            continue
+        # Multiple checkbox properties use semicolons between values, so give each value its own group.
+        for part in value.split(';'):
+            if part.strip():
+                group_names.add(f"{prefix}: {part.strip()}")
+    return group_names
+
+
+def is_managed_group(group_name):
+    """
+    :param group_name: The name of a MailerLite group.
+    :type group_name: str
+    :return: Whether the group is managed by the group sync.
+    :rtype: bool
+    """
+    return any(group_name.startswith(f"{prefix}: ") for prefix in GROUP_PROPERTIES.values())
+
+
+def diff_group_memberships(all_hubspot_contacts, ml_subscribers_dict, group_ids_by_name):
+    """
+    Compares the groups each subscriber should be in with the groups they are in.
+
+    :param all_hubspot_contacts: A list of contacts from HubSpot.
+    :type all_hubspot_contacts: list[SimplePublicObjectWithAssociations]
+    :param ml_subscribers_dict: A dictionary of MailerLite subscribers keyed by email, scanned with their groups.
+    :type ml_subscribers_dict: dict
+    :param group_ids_by_name: A dictionary of the managed group names to their IDs.
+    :type group_ids_by_name: dict
+    :return: A tuple of the memberships to add and the memberships to remove, each as (subscriber ID, group ID) pairs.
+    :rtype: tuple[list, list]
+    """
+    managed_group_ids = set(group_ids_by_name.values())
+    assignments = []
+    unassignments = []
+    for contact in all_hubspot_contacts:
+        subscriber = ml_subscribers_dict.get(contact.properties.get('email'))
+        if subscriber is None:
+            continue
+        desired = {group_ids_by_name[name] for name in get_group_names(contact) if name in group_ids_by_name}
+        current = {str(group['id']) for group in subscriber.get('groups') or [] if str(group['id']) in managed_group_ids}
+        assignments.extend((subscriber['id'], group_id) for group_id in sorted(desired - current))
+        unassignments.extend((subscriber['id'], group_id) for group_id in sorted(current - desired))
+    return assignments, unassignments
+
+
+def sync_group_memberships(all_hubspot_contacts, ml_subscribers_dict, mailerlite_api_key, retry_queue=None):
+    """
+    Adds and removes subscribers from the managed groups so they match their contacts' properties,
+    creating any groups that don't exist yet.
+
+    :param all_hubspot_contacts: A list of contacts from HubSpot.
+    :type all_hubspot_contacts: list[SimplePublicObjectWithAssociations]
+    :param ml_subscribers_dict: A dictionary of MailerLite subscribers keyed by email, scanned with their groups.
+    :type ml_subscribers_dict: dict
+    :param mailerlite_api_key: The API key for MailerLite.
+    :type mailerlite_api_key: str
+    :param retry_queue: The queue to add failed requests to.
+    :type retry_queue: RetryQueue
+    :return: A tuple of the number of memberships added and removed.
+    :rtype: tuple[int, int]
+    """
+    groups = get_all_mailerlite_groups(mailerlite_api_key)
+    if groups is None:
+        return 0, 0
+    group_ids_by_name = {group['name']: str(group['id']) for group in groups if is_managed_group(group['name'])}
+
+    # Create the groups for any new property values.
+    needed_names = set()
+    for contact in all_hubspot_contacts:
+        if contact.properties.get('email') in ml_subscribers_dict:
+            needed_names.update(get_group_names(contact))
+    for name in sorted(needed_names - set(group_ids_by_name)):
+        group = create_mailerlite_group(mailerlite_api_key, name)
+        if group is not None:
+            print(f"Created MailerLite group {name}")
+            group_ids_by_name[name] = str(group['id'])
+
+    assignments, unassignments = diff_group_memberships(all_hubspot_contacts, ml_subscribers_dict, group_ids_by_name)
+    if not assignments and not unassignments:
+        print("Every subscriber is already in the right groups.")
+        return 0, 0
+
+    assigned, unassigned = set_mailerlite_group_memberships(mailerlite_api_key, assignments, unassignments, retry_queue)
+    print(f"Added {assigned} of {len(assignments)} group memberships and removed {unassigned} of {len(unassignments)}.")
+    return assigned, unassigned
@@ -0,0 +1,206 @@
+"""
+Shared HTTP session with compressed transfer and byte counting for the MailerLite API calls.
+
+Every request goes through one requests Session, so connections are kept open and reused between calls.
+Responses are always requested with gzip (Accept-Encoding) and decompressed automatically.
+Request bodies above a size threshold can also be gzipped (Content-Encoding) by setting HTTP_GZIP_REQUESTS=true.
+If a host rejects a compressed body (a 415, or a 400 that mentions the encoding), the request is sent again uncompressed,
+and if that works the host isn't sent compressed bodies again.
+
+Bytes are counted per host both before and after compression, so log_transfer_summaries() shows what actually went over the wire.
+"""
+import gzip
+import json
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Request bodies smaller than this aren't worth compressing, since gzip adds its own header and CPU time.
+DEFAULT_GZIP_MIN_BYTES = 1024
+# How long to wait to connect and then for each read from the server, in seconds, so a stalled connection can't
+# hold up a scan or a write forever. A timeout raises requests.Timeout, which callers treat as a retryable error.
+DEFAULT_TIMEOUT = (10, 60)
+# Words in a 400 response that mean the server couldn't read the compressed body, rather than the request itself being bad.
+COMPRESSION_REJECTED_WORDS = ('encoding', 'gzip', 'compress')
+
+_session = None
+_session_lock = threading.Lock()
+# Hosts that have rejected a compressed request body.
+_gzip_rejected_hosts = set()
+# The last HTTP_GZIP_MIN_BYTES setting read and the number it parsed to, so it is only parsed again when it changes.
+_gzip_min_bytes = (None, DEFAULT_GZIP_MIN_BYTES)
+# Bytes sent and received per host.
+_transfer_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Gets the shared session, creating it the first time it is asked for.
+    The connection pool is large enough for every controller's peak concurrency across a few accounts.
+
+    :rtype: requests.Session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            # Requests already asks for gzip by default, but say so explicitly since the byte counts depend on it.
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            _session = session
+        return _session
+
+
+def _get_gzip_settings():
+    # Read from the environment on every request so a reloaded .env takes effect straight away.
+    enabled = os.getenv('HTTP_GZIP_REQUESTS', 'false').lower() in ('1', 'true', 'yes')
+    return enabled, _get_gzip_min_bytes()
+
+
+def _get_gzip_min_bytes():
+    # Only parse the setting when it has changed, and fall back to the default if it isn't a number
+    # rather than failing every request.
+    global _gzip_min_bytes
+    value = os.getenv('HTTP_GZIP_MIN_BYTES')
+    if value != _gzip_min_bytes[0]:
+        try:
+            min_bytes = int(value) if value else DEFAULT_GZIP_MIN_BYTES
+        except ValueError:
+            print(f"HTTP_GZIP_MIN_BYTES must be a number, not {value!r}. Using {DEFAULT_GZIP_MIN_BYTES} bytes.")
+            min_bytes = DEFAULT_GZIP_MIN_BYTES
+        _gzip_min_bytes = (value, min_bytes)
+    return _gzip_min_bytes[1]
+
+
+def _is_compression_rejected(response):
+    # A 415 always means the server doesn't accept the encoding. A 400 only does if it says so,
+    # otherwise it's a problem with the request itself and sending it uncompressed won't help.
+    if response.status_code == 415:
+        return True
+    if response.status_code == 400:
+        text = response.text.lower()
+        return any(word in text for word in COMPRESSION_REJECTED_WORDS)
+    return False
+
+
+def send_request(method, url, headers=None, params=None, json_body=None, compress=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Sends a request with the shared session, compressing the JSON body if it is large enough.
+
+    :param method: The HTTP method, e.g. "GET" or "POST".
+    :type method: str
+    :param url: The URL to send the request to.
+    :type url: str
+    :param headers: The request headers.
+    :type headers: dict
+    :param params: The query parameters.
+    :type params: dict
+    :param json_body: The JSON body to send, if any.
+    :param compress: Whether to gzip a large body. Defaults to the HTTP_GZIP_REQUESTS setting.
+    :type compress: bool
+    :param timeout: The connect and read timeouts in seconds, as for requests.
+    :type timeout: tuple
+    :return: The response. Raises requests' exceptions the same way requests.request does.
+    :rtype: requests.Response
+    """
+    host = urlsplit(url).netloc
+    headers = dict(headers or {})
+    enabled, min_bytes = _get_gzip_settings()
+    if compress is None:
+        compress = enabled
+
+    body = None
+    if json_body is not None:
+        body = json.dumps(json_body).encode('utf-8')
+        headers.setdefault('Content-Type', 'application/json')
+
+    wire_body = body
+    if body is not None and compress and len(body) >= min_bytes and host not in _gzip_rejected_hosts:
+        wire_body = gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = 'gzip'
+
+    response = get_session().request(method, url, headers=headers, params=params, data=wire_body,
+                                    timeout=timeout)
+
+    if wire_body is not body and _is_compression_rejected(response):
+        # The host may not understand compressed bodies, so send the body again as it was.
+        _record_transfer(host, body, wire_body, response)
+        rejected_status = response.status_code
+        headers.pop('Content-Encoding')
+        wire_body = body
+        response = get_session().request(method, url, headers=headers, params=params, data=wire_body,
+                                        timeout=timeout)
+        # Only stop compressing for the host if the uncompressed body got through,
+        # so one bad request can't turn compression off for the rest of the run.
+        if response.status_code < 400:
+            print(f"{host} rejected a gzipped request body ({rejected_status}), sending uncompressed from now on.")
+            _gzip_rejected_hosts.add(host)
+
+    _record_transfer(host, body, wire_body, response)
+    return response
+
+
+def _record_transfer(host, body, wire_body, response):
+    # Reading the content decompresses it, and afterwards the raw stream knows how many compressed bytes were read.
+    received = len(response.content)
+    try:
+        received_on_wire = response.raw.tell()
+    except (AttributeError, ValueError):
+        received_on_wire = received
+    if not received_on_wire:
+        received_on_wire = received
+
+    with _stats_lock:
+        stats = _transfer_stats.setdefault(host, {'requests': 0, 'sent': 0, 'sent_on_wire': 0,
+                                                  'received': 0, 'received_on_wire': 0})
+        stats['requests'] += 1
+        stats['sent'] += len(body) if body else 0
+        stats['sent_on_wire'] += len(wire_body) if wire_body else 0
+        stats['received'] += received
+        stats['received_on_wire'] += received_on_wire
+
+
+def get_transfer_stats():
+    """
+    :return: A dictionary of host to its request count and bytes sent and received, before and after compression.
+    :rtype: dict
+    """
+    with _stats_lock:
+        return {host: dict(stats) for host, stats in _transfer_stats.items()}
+
+
+def reset_transfer_stats():
+    """
+    Clears the byte counts, so the next run's summaries only cover that run.
+    """
+    with _stats_lock:
+        _transfer_stats.clear()
+
+
+def log_transfer_summaries():
+    """
+    Prints the bytes sent and received for every host, before and after compression.
+
+    :return: The transfer stats printed.
+    :rtype: dict
+    """
+    transfer_stats = get_transfer_stats()
+    for host, stats in transfer_stats.items():
+        print(f"[{host}] {stats['requests']} requests, "
+              f"sent {_format_bytes(stats['sent_on_wire'])} on the wire ({_format_bytes(stats['sent'])} uncompressed), "
+              f"received {_format_bytes(stats['received_on_wire'])} on the wire ({_format_bytes(stats['received'])} uncompressed)")
+    return transfer_stats
+
+
+def _format_bytes(count):
+    for unit in ('B', 'KB', 'MB'):
+        if count < 1024:
+            return f"{count:.0f}{unit}" if unit == 'B' else f"{count:.1f}{unit}"
+        count /= 1024
+    return f"{count:.1f}GB"
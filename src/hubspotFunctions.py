@@ -1,15 +1,88 @@
 import json
+import time
+
 from hubspot.crm.contacts import ApiException as ContactsApiException
 from hubspot.crm.deals import ApiException as DealsApiException
 from hubspot.crm.quotes import ApiException as QuotesApiException
-from hubspot.crm.contacts import PublicObjectSearchRequest, Filter, FilterGroup
+from hubspot.crm.contacts import PublicObjectSearchRequest, Filter, FilterGroup, BatchInputSimplePublicObjectBatchInput, \
+    SimplePublicObjectBatchInput
 from hubspot.crm.properties import ApiException as PropertiesApiException
-from src.generalFunctions import CustomJSONEncoder
+from hubspot.crm.deals import PublicObjectSearchRequest as DealsPublicObjectSearchRequest, Filter as DealsFilter, \
+    FilterGroup as DealsFilterGroup, BatchReadInputSimplePublicObjectId, SimplePublicObjectId
+from hubspot.crm.line_items import ApiException as LineItemsApiException
+from hubspot.crm.associations.v4 import ApiException as AssociationsApiException
+from hubspot.crm.associations.v4.models import BatchInputPublicFetchAssociationsBatchRequest, PublicFetchAssociationsBatchRequest
+from src.coalesceFunctions import get_coalescer
+from src.jsonFunctions import CustomJSONEncoder
+from src.rateControlFunctions import get_controller, MAX_RATE_LIMIT_RETRIES
+from src.traceFunctions import span
+
+# Every API exception type raised by the HubSpot clients we use.
+HUBSPOT_API_EXCEPTIONS = (ContactsApiException, DealsApiException, LineItemsApiException, AssociationsApiException,
+                          QuotesApiException, PropertiesApiException)
+# The deal and line item properties used to work out what each contact has bought.
+DEAL_PROPERTIES = ["dealname", "dealstage", "amount", "closedate", "createdate", "hs_lastmodifieddate"]
+LINE_ITEM_PROPERTIES = ["name", "price", "quantity", "hs_url", "hs_images", "hs_sku"]
+# The properties HubSpot returns when none are asked for. The batch reads need them listed,
+# so lookups that used to search or read one object at a time still return the same properties.
+DEFAULT_CONTACT_PROPERTIES = ["email", "firstname", "lastname", "createdate", "lastmodifieddate", "hs_object_id"]
+DEFAULT_DEAL_PROPERTIES = ["dealname", "dealstage", "pipeline", "amount", "closedate", "createdate",
+                           "hs_lastmodifieddate", "hs_object_id"]
+# Limits of the HubSpot batch and search APIs.
+BATCH_READ_LIMIT = 100
+BATCH_UPDATE_LIMIT = 100
+ASSOCIATIONS_BATCH_LIMIT = 1000
+SEARCH_PAGE_LIMIT = 100
+SEARCH_RESULT_LIMIT = 10000
+
+
+def get_all_hubspot_deals(hubspot_client, properties=None):
+    """
+    Retrieves every HubSpot deal using pagination.
 
+    :param hubspot_client: The HubSpot client instance.
+    :param properties: A list of properties to retrieve for the deals.
+    :type properties: list
+    :return: A list of all deals, or None if an error occurred.
+    :rtype: list
+    """
+    controller = get_controller('hubspot_deals', max_page_size=100)
+    all_deals = []
+    after = None
 
-def get_all_hubspot_contacts(hubspot_client, properties):
+    try:
+        while True:
+            page = _call_hubspot(controller, lambda: hubspot_client.crm.deals.basic_api.get_page(
+                limit=controller.page_size, after=after, properties=properties or DEAL_PROPERTIES))
+            all_deals.extend(page.results)
+            print(f"Retrieved {len(page.results)} deals")
+
+            # Get the next cursor, or stop if this was the last page.
+            if page.paging is None or page.paging.next is None:
+                break
+            after = page.paging.next.after
+    except HUBSPOT_API_EXCEPTIONS as e:
+        print("Error:", e)
+        return None
+
+    return all_deals
+
+
+def get_all_hubspot_contacts(hubspot_client, properties, controller=None, archived=False):
     """
     Retrieves all HubSpot contacts using the HubSpot Python client library using pagination.
+    The page size is tuned by an adaptive controller based on latency, errors and rate limit headroom.
+
+    :param hubspot_client: The HubSpot client instance.
+    :type hubspot_client: HubSpot
+    :param properties: A list of properties to retrieve for the contacts.
+    :type properties: list
+    :param controller: The controller to use for page size and concurrency. Defaults to the shared contacts controller.
+    :type controller: AdaptiveController
+    :param archived: Whether to retrieve archived contacts instead of active ones.
+    :type archived: bool
+    :return: A list of all contacts, or None if an error occurred.
+    :rtype: list
 
     Context:
     List
@@ -293,61 +366,89 @@ Copy all
 101
 }
     """
-    try:
-        # For each page of contacts, retrieve the contacts and add them to the list of all contacts. Then get the next page. Finally, return the list of all contacts.
-        # Initialise an empty list to store all contacts.
-        all_contacts = []
-
-    except ContactsApiException as e:
-        print("Error:", e)
-        return None
+    # For each page of contacts, retrieve the contacts and add them to the list of all contacts. Then get the next page. Finally, return the list of all contacts.
+    # Initialise an empty list to store all contacts.
+    all_contacts = []
+    # The controller picks the number of contacts per request. Maximum is 100.
+    controller = controller or get_controller('hubspot_contacts', max_page_size=100)
+    # Initialise the paging cursor to None for the first request.
+    after = None
+
+    while True:
+        try:
+            # Fetch the page in a controller slot, waiting and trying again if we are rate limited.
+            page = _call_hubspot(controller, lambda: hubspot_client.crm.contacts.basic_api.get_page(
+                limit=controller.page_size, after=after, properties=properties, archived=archived))
+        except ContactsApiException as e:
+            print("Error:", e)
+            return None
+
+        all_contacts.extend(page.results)
+        print(f"Retrieved {len(page.results)} contacts")
+
+        # Get the next cursor, or stop if this was the last page.
+        if page.paging is None or page.paging.next is None:
+            break
+        after = page.paging.next.after
+
+    return all_contacts
 
 
 # Contact endpoints
-def get_hubspot_contacts_with_http(hubspot_client, properties=None, limit=10):
+def get_hubspot_contacts_with_http(hubspot_client, properties=None, limit=None):
     """
     Retrieves all HubSpot contacts using the HubSpot Python client library.
     :param hubspot_client: The HubSpot client instance.
     :type hubspot_client: HubSpot
     :param properties: A list of properties to retrieve for the contacts.
     :type properties: list
-    :param limit: The maximum number of contacts to retrieve.
+    :param limit: The maximum number of contacts to retrieve. Defaults to the contacts controller's current page size.
     :type limit: int
     """
+    controller = get_controller('hubspot_contacts', max_page_size=100)
     try:
         # Fetch the first page of contacts
-        hubspot_contacts = hubspot_client.crm.contacts.basic_api.get_page(properties=properties, limit=limit)
+        hubspot_contacts = _call_hubspot(controller, lambda: hubspot_client.crm.contacts.basic_api.get_page(
+            properties=properties, limit=limit or controller.page_size))
         return hubspot_contacts.results
     except ContactsApiException as e:
         print("Error:", e)
         return None
 
 
-def search_hubspot_contact_by_email(hubspot_client, email):
+def get_archived_hubspot_contacts(hubspot_client, since=None, properties=None):
     """
-    Searches for a HubSpot contact by email and retrieves specific properties.
+    Retrieves the HubSpot contacts that have been archived since a checkpoint.
+    HubSpot can't filter archived contacts by date, so every archived contact is paged through and filtered here.
+    This still only costs as much as the number of archived contacts, rather than the whole contact list.
+
+    :param hubspot_client: The HubSpot client instance.
+    :type hubspot_client: HubSpot
+    :param since: Only return contacts archived after this time. Returns every archived contact if None.
+    :type since: datetime
+    :param properties: A list of properties to retrieve for the contacts. Defaults to just the email.
+    :type properties: list
+    :return: A list of archived contacts, or None if an error occurred.
+    :rtype: list
     """
-    try:
-        # Define the filter for the search
-        email_filter = Filter(property_name="email", operator="EQ", value=email)
-        filter_group = FilterGroup(filters=[email_filter])
+    archived_contacts = get_all_hubspot_contacts(hubspot_client, properties or ["email"], archived=True)
+    if archived_contacts is None or since is None:
+        return archived_contacts
+    return [contact for contact in archived_contacts if contact.archived_at is not None and contact.archived_at > since]
 
-        # Define the search request with the filter and specific properties
-        search_request = PublicObjectSearchRequest(
-            filter_groups=[filter_group]
-        )
 
-        # Execute the search
-        search_results = hubspot_client.crm.contacts.search_api.do_search(search_request)
-        return search_results.results
-    except ContactsApiException as e:
-        print("Error:", e)
-        return None
+def search_hubspot_contact_by_email(hubspot_client, email):
+    """
+    Looks up a HubSpot contact by email with HubSpot's default contact properties, DEFAULT_CONTACT_PROPERTIES.
+    Lookups made at the same time are coalesced into batch reads, see _get_contacts_by_email.
+    """
+    return _get_contacts_by_email(hubspot_client, email, DEFAULT_CONTACT_PROPERTIES)
 
 
 def search_hubspot_contact_by_email_with_properties(hubspot_client, email, properties):
     """
-    Searches for a HubSpot contact by email and retrieves specific properties.
+    Looks up a HubSpot contact by email and retrieves specific properties.
+    Lookups made at the same time are coalesced into batch reads, see _get_contacts_by_email.
 
     :param hubspot_client: The HubSpot client instance.
     :type hubspot_client: HubSpot
@@ -355,26 +456,31 @@ def search_hubspot_contact_by_email_with_properties(hubspot_client, email, prope
     :type email: str
     :param properties: A list of properties to retrieve for the contact.
     :type properties: list
-    :return: A list of contacts matching the email with specified properties.
+    :return: A list of contacts matching the email with the specified properties, plus email, hs_object_id,
+        createdate and lastmodifieddate, which HubSpot always returns.
     :rtype: list
     """
-    try:
-        # Define the filter for the search
-        email_filter = Filter(property_name="email", operator="EQ", value=email)
-        filter_group = FilterGroup(filters=[email_filter])
-
-        # Define the search request with the filter and specific properties
-        search_request = PublicObjectSearchRequest(
-            filter_groups=[filter_group],
-            properties=properties
-        )
+    return _get_contacts_by_email(hubspot_client, email, properties)
 
-        # Execute the search
-        search_results = hubspot_client.crm.contacts.search_api.do_search(search_request)
-        return search_results.results
-    except ContactsApiException as e:
-        print("Error:", e)
-        return None
+
+def _get_contacts_by_email(hubspot_client, email, properties):
+    # Rather than one search per email, which uses up the search API's lower rate limit, lookups for the same
+    # properties are gathered into batch reads by email. Each email maps to a list of matches, like a search.
+    properties = list(properties)
+
+    def read_batch(emails):
+        contacts = batch_read_hubspot_contacts_by_email(hubspot_client, emails, properties)
+        if contacts is None:
+            # Leave every email out so each caller gets None, as they would from a failed search.
+            return {}
+        contacts_by_email = {email: [] for email in emails}
+        for contact in contacts:
+            contacts_by_email.setdefault((contact.properties.get('email') or '').lower(), []).append(contact)
+        return contacts_by_email
+
+    coalescer = get_coalescer(f"hubspot_contacts_by_email:{','.join(properties) or 'default'}", read_batch, owner=hubspot_client,
+                              max_batch=BATCH_READ_LIMIT)
+    return coalescer.get(email.strip().lower())
 
 
 def get_all_contact_properties(hubspot_client):
@@ -396,42 +502,364 @@ def get_all_contact_properties(hubspot_client):
 def get_contacts_and_deals(hubspot_client):
     """
     Retrieves all contacts and their associated deals from HubSpot.
+    The associations and deals are read in batches rather than one request per contact.
     """
     # Get all contacts using the HubSpot client
     contacts = get_hubspot_contacts_with_http(hubspot_client)
     if contacts is None:
         return None
 
-    # Iterate over each contact to get their associated deals
+    # Get the deal IDs for every contact in one batch, then read all of those deals in batches of 100.
+    deal_ids_by_contact = batch_read_hubspot_associations(hubspot_client, 'contacts', 'deals', [contact.id for contact in contacts])
+    if deal_ids_by_contact is None:
+        return None
+    all_deal_ids = {deal_id for deal_ids in deal_ids_by_contact.values() for deal_id in deal_ids}
+    deals_by_id = batch_read_hubspot_objects(hubspot_client, 'deals', all_deal_ids, DEAL_PROPERTIES)
+    if deals_by_id is None:
+        return None
+
+    # Attach the deals to each contact
     for contact in contacts:
-        contact_id = contact.id
-        deal_ids = get_hubspot_deals_with_http(hubspot_client)
+        contact.deals = [deals_by_id[deal_id] for deal_id in deal_ids_by_contact.get(contact.id, []) if deal_id in deals_by_id]
 
-        deals = []
-        for deal_id in deal_ids:
-            deal_details = get_deal_details_by_id(hubspot_client, deal_id)
-            if deal_details is not None:
-                deals.append(deal_details)
+    return contacts
 
-        # Attach the deals to the contact
-        contact.deals = deals
 
-    return contacts
+def _call_hubspot(controller, api_call):
+    # Run a HubSpot client call in a controller slot, trying again when it is rate limited.
+    # Once it has been rate limited too many times in a row, e.g. because the daily limit has run out, the 429 is raised
+    # like any other API error, for the caller to handle, rather than waiting forever.
+    # Each call is traced under the controller's name. The span includes the SDK deserialising the response.
+    rate_limited_attempts = 0
+    while True:
+        start = time.monotonic()
+        try:
+            with controller.slot():
+                start = time.monotonic()
+                with span(f"hubspot:{controller.name}"):
+                    result = api_call()
+        except HUBSPOT_API_EXCEPTIONS as e:
+            controller.record(time.monotonic() - start, e.status, e.headers)
+            if e.status == 429:
+                rate_limited_attempts += 1
+                if rate_limited_attempts > MAX_RATE_LIMIT_RETRIES:
+                    print(f"Still rate limited after {MAX_RATE_LIMIT_RETRIES} retries, giving up.")
+                    raise
+                print("Rate limit exceeded. Waiting for the rate limit to reset...")
+                continue
+            raise
+        controller.record(time.monotonic() - start, 200)
+        return result
+
+
+def batch_read_hubspot_associations(hubspot_client, from_object_type, to_object_type, object_ids):
+    """
+    Retrieves the associated object IDs for many objects at once using the v4 associations batch API.
+    Up to 1000 objects are read per request. Objects with more associations than fit in one response
+    are read again from where their last response left off, until every association has been read.
+
+    :param hubspot_client: The HubSpot client instance.
+    :param from_object_type: The object type to read associations from, e.g. 'contacts'.
+    :type from_object_type: str
+    :param to_object_type: The associated object type, e.g. 'deals'.
+    :type to_object_type: str
+    :param object_ids: The IDs of the objects to read associations for.
+    :type object_ids: list[str]
+    :return: A dictionary of object ID to a list of associated object IDs, or None if an error occurred.
+    :rtype: dict
+    """
+    controller = get_controller('hubspot_associations', page_size=ASSOCIATIONS_BATCH_LIMIT, min_page_size=100,
+                                max_page_size=ASSOCIATIONS_BATCH_LIMIT, page_size_step=100)
+    # Each input is an object ID and the cursor to read its associations from, which is None for the first page.
+    pending = [(str(object_id), None) for object_id in object_ids]
+    associated_ids = {}
+    try:
+        while pending:
+            chunk = pending[:controller.page_size]
+            pending = pending[len(chunk):]
+            request = BatchInputPublicFetchAssociationsBatchRequest(
+                inputs=[PublicFetchAssociationsBatchRequest(id=object_id, after=after) for object_id, after in chunk])
+            response = _call_hubspot(controller, lambda: hubspot_client.crm.associations.v4.batch_api.get_page(
+                from_object_type, to_object_type, batch_input_public_fetch_associations_batch_request=request))
+            for result in response.results:
+                associated_ids.setdefault(result._from.id, []).extend(str(association.to_object_id) for association in result.to)
+                # Each object only gets up to 500 associations per response, so queue the rest to be read with a later chunk.
+                paging = getattr(result, 'paging', None)
+                if paging is not None and paging.next is not None:
+                    pending.append((result._from.id, paging.next.after))
+    except HUBSPOT_API_EXCEPTIONS as e:
+        print("Error:", e)
+        return None
+    return associated_ids
+
+
+def batch_read_hubspot_objects(hubspot_client, object_type, object_ids, properties, id_property=None):
+    """
+    Retrieves many CRM objects at once using the batch read API, 100 per request.
+
+    :param hubspot_client: The HubSpot client instance.
+    :param object_type: The object type to read, e.g. 'deals' or 'line_items'.
+    :type object_type: str
+    :param object_ids: The IDs of the objects to read.
+    :type object_ids: list[str]
+    :param properties: A list of properties to retrieve for the objects.
+    :type properties: list
+    :param id_property: A unique property to look the objects up by instead of their ID, e.g. 'email'.
+    :type id_property: str
+    :return: A dictionary of ID (or id_property value) to the object's properties, or None if an error occurred.
+    :rtype: dict
+    """
+    results = _batch_read_hubspot_objects(hubspot_client, object_type, object_ids, properties, id_property)
+    if results is None:
+        return None
+    return {(result.properties.get(id_property) if id_property else result.id): result.properties for result in results}
+
+
+def batch_read_hubspot_contacts_by_email(hubspot_client, emails, properties):
+    """
+    Retrieves the HubSpot contacts with the given email addresses using the batch read API, 100 per request.
+    Unlike searching by email, this doesn't use up the search API's much lower rate limit.
+    Emails without a contact are left out of the results.
+
+    :param hubspot_client: The HubSpot client instance.
+    :param emails: The email addresses to look up.
+    :type emails: list[str]
+    :param properties: A list of properties to retrieve for the contacts.
+    :type properties: list
+    :return: A list of contacts, or None if an error occurred.
+    :rtype: list
+    """
+    properties = list(properties)
+    if 'email' not in properties:
+        properties.append('email')
+    return _batch_read_hubspot_objects(hubspot_client, 'contacts', emails, properties, id_property='email')
+
+
+def _batch_read_hubspot_objects(hubspot_client, object_type, object_ids, properties, id_property=None):
+    # Read the objects in chunks sized by the controller, returning the objects themselves.
+    controller = get_controller(f'hubspot_{object_type}_batch', page_size=BATCH_READ_LIMIT, max_page_size=BATCH_READ_LIMIT)
+    api = getattr(hubspot_client.crm, object_type).batch_api
+    object_ids = list(object_ids)
+    results = []
+    position = 0
+    try:
+        while position < len(object_ids):
+            chunk = object_ids[position:position + controller.page_size]
+            request = BatchReadInputSimplePublicObjectId(
+                properties=properties, id_property=id_property,
+                inputs=[SimplePublicObjectId(id=str(object_id)) for object_id in chunk])
+            response = _call_hubspot(controller, lambda: api.read(batch_read_input_simple_public_object_id=request))
+            results.extend(response.results)
+            position += len(chunk)
+    except HUBSPOT_API_EXCEPTIONS as e:
+        print("Error:", e)
+        return None
+    return results
+
+
+def batch_update_hubspot_objects(hubspot_client, object_type, updates):
+    """
+    Updates many CRM objects at once using the batch update API, 100 per request.
+    A failed request doesn't stop the rest, so the caller can try the objects that weren't updated again later.
+    If HubSpot rejects a request because of a bad object, the request is split in half until the bad object is found,
+    so the rest are still updated.
+
+    :param hubspot_client: The HubSpot client instance.
+    :param object_type: The object type to update, e.g. 'contacts'.
+    :type object_type: str
+    :param updates: A dictionary of object ID to the properties to set on it.
+    :type updates: dict
+    :return: The IDs of the objects that were updated.
+    :rtype: list[str]
+    """
+    controller = get_controller(f'hubspot_{object_type}_batch_update', page_size=BATCH_UPDATE_LIMIT,
+                                max_page_size=BATCH_UPDATE_LIMIT)
+    api = getattr(hubspot_client.crm, object_type).batch_api
+    object_ids = list(updates)
+    updated_ids = []
+    # Halves of failed requests, sent before moving on to the next chunk.
+    split_chunks = []
+    position = 0
+    while position < len(object_ids) or split_chunks:
+        if split_chunks:
+            chunk = split_chunks.pop()
+        else:
+            chunk = object_ids[position:position + controller.page_size]
+            position += len(chunk)
+        request = BatchInputSimplePublicObjectBatchInput(
+            inputs=[SimplePublicObjectBatchInput(id=str(object_id), properties=updates[object_id]) for object_id in chunk])
+        try:
+            response = _call_hubspot(controller, lambda: api.update(batch_input_simple_public_object_batch_input=request))
+        except HUBSPOT_API_EXCEPTIONS as e:
+            # A client error can be caused by a single object, e.g. a value HubSpot won't accept.
+            # Authentication errors, rate limits and server errors would fail every half too, so those aren't split.
+            if len(chunk) > 1 and e.status is not None and 400 <= e.status < 500 and e.status not in (401, 403, 429):
+                middle = len(chunk) // 2
+                split_chunks.extend([chunk[middle:], chunk[:middle]])
+            else:
+                print(f"Error updating {len(chunk)} {object_type}:", e)
+            continue
+        failed_ids = _get_failed_batch_ids(response, chunk)
+        if failed_ids:
+            print(f"Error updating {len(failed_ids)} of {len(chunk)} {object_type}:",
+                  "; ".join(error.message for error in response.errors))
+        updated_ids.extend(object_id for object_id in chunk if str(object_id) not in failed_ids)
+    return updated_ids
+
+
+def _get_failed_batch_ids(response, chunk):
+    # A batch response with a 207 status lists the objects that failed in its errors, each naming their IDs in its context.
+    errors = getattr(response, 'errors', None) or []
+    if not errors:
+        return set()
+    failed_ids = set()
+    for error in errors:
+        error_ids = (getattr(error, 'context', None) or {}).get('ids')
+        if not error_ids:
+            # The error doesn't say which objects it was for, so only count the objects in the results as updated.
+            updated_ids = {str(result.id) for result in getattr(response, 'results', None) or []}
+            return {str(object_id) for object_id in chunk if str(object_id) not in updated_ids}
+        failed_ids.update(str(object_id) for object_id in error_ids)
+    return failed_ids
 
 
 # Deal endpoints
 def get_deal_details_by_id(hubspot_client, deal_id):
     """
-    Fetches HubSpot deal details by deal ID.
+    Fetches HubSpot deal details by deal ID, with HubSpot's default deal properties, DEFAULT_DEAL_PROPERTIES.
+    Deals requested at the same time, or again within a few seconds, are coalesced into batch reads.
+    Returns None if the deal doesn't exist or an error occurred.
     """
     try:
-        # Get deal details by deal ID
-        deal_details = hubspot_client.crm.deals.basic_api.get_by_id(deal_id)
-        return deal_details
-    except DealsApiException as e:
+        return _get_deal_coalescer(hubspot_client).get(str(deal_id))
+    except RuntimeError:
+        return None
+
+
+def _get_deal_coalescer(hubspot_client):
+    # Share deal lookups between every caller using this client, reading them in batches of up to 100.
+    def read_batch(deal_ids):
+        results = _batch_read_hubspot_objects(hubspot_client, 'deals', deal_ids, DEFAULT_DEAL_PROPERTIES)
+        if results is None:
+            # Raise rather than leave the deals out, so callers can tell a failed read from a deal that doesn't exist.
+            raise RuntimeError("Couldn't read the deals from HubSpot.")
+        return {deal.id: deal for deal in results}
+
+    return get_coalescer('hubspot_deals', read_batch, owner=hubspot_client, max_batch=BATCH_READ_LIMIT)
+
+
+def search_hubspot_deals_modified_since(hubspot_client, since, properties=None):
+    """
+    Retrieves the HubSpot deals modified since a checkpoint using the search API.
+    The search API only returns the first 10,000 results of a search, so the search is restarted from the
+    last modified date seen whenever that limit is reached.
+
+    :param hubspot_client: The HubSpot client instance.
+    :param since: Only return deals modified at or after this time.
+    :type since: datetime
+    :param properties: A list of properties to retrieve for the deals.
+    :type properties: list
+    :return: A list of deals, or None if an error occurred.
+    :rtype: list
+    """
+    return _search_modified_since(hubspot_client.crm.deals.search_api,
+                                  (DealsPublicObjectSearchRequest, DealsFilterGroup, DealsFilter),
+                                  "hs_lastmodifieddate", since, properties or DEAL_PROPERTIES)
+
+
+def search_hubspot_contacts_modified_since(hubspot_client, since, properties):
+    """
+    Retrieves the HubSpot contacts modified since a checkpoint using the search API.
+    Used for incremental syncs, where only the contacts changed since the last run need to be fetched.
+
+    :param hubspot_client: The HubSpot client instance.
+    :param since: Only return contacts modified at or after this time.
+    :type since: datetime
+    :param properties: A list of properties to retrieve for the contacts.
+    :type properties: list
+    :return: A list of contacts, or None if an error occurred.
+    :rtype: list
+    """
+    return _search_modified_since(hubspot_client.crm.contacts.search_api, (PublicObjectSearchRequest, FilterGroup, Filter),
+                                  "lastmodifieddate", since, properties)
+
+
+def _search_modified_since(search_api, models, property_name, since, properties):
+    # Page through a search for objects modified since a checkpoint, oldest first.
+    # The search API has its own, lower rate limit, so only send one search at a time.
+    controller = get_controller('hubspot_search', max_page_size=SEARCH_PAGE_LIMIT, concurrency=1, max_concurrency=1)
+    search_request_class, filter_group_class, filter_class = models
+    properties = list(properties)
+    if property_name not in properties:
+        properties.append(property_name)
+    since_value = str(int(since.timestamp() * 1000))
+    since_operator = "GTE"
+    objects_by_id = {}
+    after = None
+
+    try:
+        while True:
+            search_request = search_request_class(
+                filter_groups=[filter_group_class(filters=[filter_class(property_name=property_name, operator=since_operator,
+                                                                        value=since_value)])],
+                sorts=[{"propertyName": property_name, "direction": "ASCENDING"}],
+                properties=properties,
+                limit=controller.page_size,
+                after=after
+            )
+            page = _call_hubspot(controller, lambda: search_api.do_search(search_request))
+            for result in page.results:
+                objects_by_id[result.id] = result
+
+            if page.paging is None or page.paging.next is None:
+                break
+            after = page.paging.next.after
+            if int(after) + controller.page_size > SEARCH_RESULT_LIMIT and page.results:
+                # Start a new search from the last modified date seen to get past the 10,000 result limit.
+                last_value = str(int(page.results[-1].updated_at.timestamp() * 1000))
+                if last_value == since_value:
+                    # Over 10,000 objects were modified at the same moment, e.g. by a bulk import, so restarting from it
+                    # would return the same results forever. Read everything modified at that moment by ID instead,
+                    # then carry on from just after it.
+                    for result in _search_modified_at(search_api, models, property_name, last_value, properties, controller):
+                        objects_by_id[result.id] = result
+                    since_operator = "GT"
+                else:
+                    since_operator = "GTE"
+                since_value = last_value
+                after = None
+    except HUBSPOT_API_EXCEPTIONS as e:
         print("Error:", e)
         return None
 
+    return list(objects_by_id.values())
+
+
+def _search_modified_at(search_api, models, property_name, value, properties, controller):
+    # Page through every object modified at exactly one moment, in ID order, restarting from the last ID seen
+    # to get past the 10,000 result limit. API errors are left for the caller to handle.
+    search_request_class, filter_group_class, filter_class = models
+    last_id = "0"
+    after = None
+    while True:
+        search_request = search_request_class(
+            filter_groups=[filter_group_class(filters=[filter_class(property_name=property_name, operator="EQ", value=value),
+                                                       filter_class(property_name="hs_object_id", operator="GT", value=last_id)])],
+            sorts=[{"propertyName": "hs_object_id", "direction": "ASCENDING"}],
+            properties=properties,
+            limit=controller.page_size,
+            after=after
+        )
+        page = _call_hubspot(controller, lambda: search_api.do_search(search_request))
+        yield from page.results
+
+        if page.paging is None or page.paging.next is None:
+            return
+        after = page.paging.next.after
+        if int(after) + controller.page_size > SEARCH_RESULT_LIMIT and page.results:
+            last_id = page.results[-1].id
+            after = None
+
 
 def get_hubspot_deals_with_http(hubspot_client):
     """
@@ -464,24 +892,30 @@ def get_associated_deals(client, contact_id):
     Retrieves deals associated with a HubSpot contact by contact ID.
     The contact ID is the unique identifier for a contact in HubSpot and can be obtained by searching for a contact by email then extracting the ID.
     The contact ID can then be used to retrieve other associated objects like deals.
+    The associations and deals are read through coalescers, so lookups for several contacts at once share batch reads.
+    Returns None if an error occurred, so a failed lookup isn't mistaken for a contact without deals.
     """
-    try:
-        # Get associations for the contact
-        associations = client.crm.associations.v4.basic_api.get_page('contacts', contact_id, 'deals')
-
-        # Extract deal IDs from the associations using the to_object_id property to convert the association to an id
-        deal_ids = [association.to_object_id for association in associations.results]
-
-        deals = []
-        for deal_id in deal_ids:
-            # Get deal details by deal ID
-            deal = client.crm.deals.basic_api.get_by_id(deal_id)
-            deals.append(deal.to_dict())
+    def read_batch(contact_ids):
+        deal_ids_by_contact = batch_read_hubspot_associations(client, 'contacts', 'deals', contact_ids)
+        if deal_ids_by_contact is None:
+            return {}
+        # Contacts without any deals aren't in the response, so give them an empty list.
+        return {contact_id: deal_ids_by_contact.get(contact_id, []) for contact_id in contact_ids}
+
+    # Get associations for the contact
+    association_coalescer = get_coalescer('hubspot_contact_deal_associations', read_batch, owner=client,
+                                          max_batch=ASSOCIATIONS_BATCH_LIMIT)
+    deal_ids = association_coalescer.get(str(contact_id))
+    if deal_ids is None:
+        return None
 
-        return deals
-    except DealsApiException as e:
-        print(f"Error: {e}")
+    # Get the deal details for every deal at once.
+    # Deals that no longer exist are left out, but if the deals couldn't be read at all there is no answer to give.
+    try:
+        deals = _get_deal_coalescer(client).get_many(deal_ids)
+    except RuntimeError:
         return None
+    return [deal.to_dict() for deal in deals if deal is not None]
 
 
 # Quote endpoints
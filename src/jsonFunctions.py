@@ -0,0 +1,16 @@
+import json
+from datetime import datetime
+
+
+# Custom JSON encoder to handle datetime objects
+class CustomJSONEncoder(json.JSONEncoder):
+    """
+    Custom JSON encoder to handle datetime objects.
+    Datetime objects are converted to ISO 8601 string format which is compatible with JSON serialization.
+    """
+
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            # Convert datetime objects to ISO 8601 string format
+            return obj.isoformat()
+        return super().default(obj)
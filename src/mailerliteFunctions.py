@@ -1,25 +1,88 @@
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
+from src.httpFunctions import send_request
+from src.rateControlFunctions import get_controller, MAX_RATE_LIMIT_RETRIES
+from src.retryFunctions import get_circuit_breaker, is_retryable_error, is_retryable_status
+from src.traceFunctions import span, traced
+
+
+# The subscriber statuses in MailerLite. Each status is fetched as its own cursor chain.
+MAILERLITE_SUBSCRIBER_STATUSES = ["active", "unsubscribed", "unconfirmed", "bounced", "junk"]
+# Maximum number of requests MailerLite accepts in a single batch.
+MAILERLITE_BATCH_LIMIT = 50
+
 
 # Function to retrieve Mailerlite subscribers using direct API calls
-def get_all_mailerlite_subscribers(api_key):
+def get_all_mailerlite_subscribers(api_key, controller=None, statuses=None, include_groups=False):
     """
     Retrieves all subscribers from Mailerlite using direct API calls.
-    Uses cursor-based pagination to fetch all subscribers.
+    The scan is split into one cursor chain per subscriber status, and the chains are fetched at the same time.
+    Every chain shares the same adaptive controller, so together they stay within the rate limit.
     :param api_key: The Mailerlite API key.
     :type api_key: str
-    :return: A list of all subscribers as JSON objects.
+    :param controller: The controller to use for page size and concurrency. Defaults to the shared subscribers controller.
+    :type controller: AdaptiveController
+    :param statuses: The subscriber statuses to fetch. Defaults to every status.
+    :type statuses: list[str]
+    :param include_groups: Whether to include each subscriber's groups, under 'groups'.
+    :type include_groups: bool
+    :return: A list of all subscribers as JSON objects, or None if any status couldn't be fetched in full.
     :rtype: list
     """
 
-    # Initialise an empty list to store all subscribers.
-    all_subscribers = []
-    # Number of subscribers per request. Maximum is 100.
-    per_page = 100
+    # The controller picks the number of subscribers per request and how many chains can have a request in flight.
+    controller = controller or get_controller('mailerlite_subscribers', max_page_size=100)
+    statuses = statuses or MAILERLITE_SUBSCRIBER_STATUSES
+
+    # Start one cursor chain per status. The controller's slots decide how many of them are actually requesting at once.
+    with ThreadPoolExecutor(max_workers=len(statuses), thread_name_prefix='mailerlite-scan') as executor:
+        chains = [executor.submit(get_mailerlite_subscribers_by_status, api_key, status, controller, include_groups)
+                  for status in statuses]
+        # Merge the chains in status order. Skip any subscriber already seen in case one changed status mid-scan.
+        all_subscribers = []
+        seen_ids = set()
+        chain_results = [chain.result() for chain in chains]
+        # A partial list would make missing subscribers look new or removed, so fail the whole scan instead.
+        if any(subscribers is None for subscribers in chain_results):
+            return None
+        for subscribers in chain_results:
+            for subscriber in subscribers:
+                if subscriber.get('id') not in seen_ids:
+                    seen_ids.add(subscriber.get('id'))
+                    all_subscribers.append(subscriber)
+
+    # Finally, return the list of all subscribers.
+    return all_subscribers
+
+
+def get_mailerlite_subscribers_by_status(api_key, status, controller=None, include_groups=False):
+    """
+    Retrieves all subscribers with a single status from Mailerlite.
+    Uses cursor-based pagination to fetch every page of the status.
+    The page size is tuned by an adaptive controller based on latency, errors and rate limit headroom.
+    :param api_key: The Mailerlite API key.
+    :type api_key: str
+    :param status: The subscriber status to fetch, e.g. "active".
+    :type status: str
+    :param controller: The controller to use for page size and concurrency. Defaults to the shared subscribers controller.
+    :type controller: AdaptiveController
+    :param include_groups: Whether to include each subscriber's groups, under 'groups'.
+    :type include_groups: bool
+    :return: A list of the subscribers with the status as JSON objects, or None if any page couldn't be fetched.
+    :rtype: list
+    """
+
+    # Initialise an empty list to store the subscribers.
+    subscribers_with_status = []
+    # The controller picks the number of subscribers per request. Maximum is 100.
+    controller = controller or get_controller('mailerlite_subscribers', max_page_size=100)
     # Initialise the cursor to None for the first request.
     cursor = None
+    # Count how many times in a row the current page has been rate limited.
+    rate_limited_attempts = 0
     # Base URL for the Mailerlite subscribers API
     base_url = "https://connect.mailerlite.com/api/subscribers"
 
@@ -29,63 +92,458 @@ def get_all_mailerlite_subscribers(api_key):
     }
 
     while True:
-        # Initialise the query parameters for the request. Create a dictionary with the limit key set to the per_page value.
-        params = {'limit': per_page}
+        # Initialise the query parameters for the request with the current page size and the status to filter by.
+        params = {'limit': controller.page_size, 'filter[status]': status}
+        if include_groups:
+            params['include'] = 'groups'
         # If the cursor is not None, also add the cursor key to the dictionary.
         if cursor:
             params['cursor'] = cursor
 
-        # Make a GET request to the Mailerlite API using the requests library.
+        # Make a GET request to the Mailerlite API using the shared HTTP session.
         # Pass in the base URL, headers, and query parameters.
-        response = requests.get(base_url, headers=headers, params=params)
-        # Get the response data as a JSON object for easier processing.
-        response_data = response.json()
+        # Hold a controller slot while the request is in flight and record how it went afterwards.
+        start = time.monotonic()
+        try:
+            with controller.slot():
+                start = time.monotonic()
+                with span("mailerlite:subscribers.get_page", status=status):
+                    response = send_request('GET', base_url, headers=headers, params=params)
+        except requests.exceptions.RequestException as err:
+            # A timeout or dropped connection. Stopping partway through would leave the status incomplete, so fail the chain.
+            controller.record(time.monotonic() - start, None)
+            print(f"An error occurred getting {status} subscribers: {err}")
+            return None
+        controller.record(time.monotonic() - start, response.status_code, response.headers)
 
         # Check for rate limiting and handle it.
-        # If the status code is 429, it means the rate limit has been exceeded and we should wait for 60 seconds.
+        # If the status code is 429, the controller pauses requests until the rate limit resets, so try again
+        # unless the page has been rate limited too many times in a row.
         if response.status_code == 429:
-            print("Rate limit exceeded. Waiting for 60 seconds...")
-            time.sleep(60)
+            rate_limited_attempts += 1
+            if rate_limited_attempts > MAX_RATE_LIMIT_RETRIES:
+                print(f"Still rate limited after {MAX_RATE_LIMIT_RETRIES} retries, giving up on the {status} subscribers.")
+                return None
+            print("Rate limit exceeded. Waiting for the rate limit to reset...")
             continue
+        rate_limited_attempts = 0
 
         # If the status code is 401, it means unauthorized access. Check the API key is correct and being passed correctly.
+        # Stopping partway through would leave the status incomplete, so fail the whole chain.
         if response.status_code == 401:
             print("Unauthorized access. Please check your API key.")
-            break
+            return None
 
-        # If the status code is not 200, there was some other error. Print the error message and break the loop.
+        # If the status code is not 200, there was some other error. Print the error message and fail the chain.
         if response.status_code != 200:
-            print(f"Error: {response_data.get('message', 'Unknown error')}")
-            break
+            print(f"Error getting {status} subscribers: {response.status_code} {response.text}")
+            return None
+
+        # Get the response data as a JSON object for easier processing.
+        response_data = response.json()
 
         # Add the current page of subscribers to the list by extracting the 'data' key from the response.
         subscribers = response_data.get("data", [])
-        # Then add the subscribers to the all_subscribers list using the extend method.
-        all_subscribers.extend(subscribers)
+        subscribers_with_status.extend(subscribers)
 
         # Print the number of subscribers retrieved on this page for debugging purposes.
-        print(f"Retrieved {len(subscribers)} subscribers")
+        print(f"Retrieved {len(subscribers)} {status} subscribers")
 
         # Get the next cursor value from the 'meta' key in the response data.
         cursor = response_data.get("meta", {}).get("next_cursor")
 
-        # If there is no next cursor, we have reached the end of the subscribers list so we can break the loop.
+        # If there is no next cursor, we have reached the end of this status so we can break the loop.
         if not cursor:
             break
 
-    # Finally, return the list of all subscribers.
-    return all_subscribers
+    return subscribers_with_status
+
+
+def send_mailerlite_batch(api_key, batch_requests, controller=None):
+    """
+    Sends many MailerLite API requests using the batch endpoint, up to 50 requests per call.
+    The number of requests per call is tuned by an adaptive controller.
+    Batches go through the MailerLite circuit breaker like single writes. Once it opens, the requests not yet sent
+    get a code of None, so they are queued for a retry.
+
+    :param api_key: The Mailerlite API key.
+    :type api_key: str
+    :param batch_requests: The requests to send, e.g. {"method": "DELETE", "path": "api/subscribers/123"}.
+    :type batch_requests: list[dict]
+    :param controller: The controller to use for batch size and concurrency. Defaults to the shared batch controller.
+    :type controller: AdaptiveController
+    :return: One response per request in the same order, each with a "code" and "body". The code is None if the batch failed without a response.
+    :rtype: list[dict]
+    """
+    controller = controller or get_controller('mailerlite_batch', page_size=MAILERLITE_BATCH_LIMIT, min_page_size=5,
+                                              max_page_size=MAILERLITE_BATCH_LIMIT, page_size_step=5)
+    url = "https://connect.mailerlite.com/api/batch"
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+
+    circuit_breaker = get_circuit_breaker('mailerlite')
+    responses = []
+    position = 0
+    rate_limited_attempts = 0
+    while position < len(batch_requests):
+        if not circuit_breaker.allow():
+            # MailerLite looks to be down, so don't send anything else until the circuit closes.
+            print(f"Circuit open, not sending the last {len(batch_requests) - position} batch requests.")
+            responses.extend({'code': None, 'body': {'message': "Circuit open, MailerLite is not responding"}}
+                             for _ in batch_requests[position:])
+            break
+        chunk = batch_requests[position:position + controller.page_size]
+
+        # Hold a controller slot while the request is in flight and record how it went afterwards.
+        start = time.monotonic()
+        try:
+            with controller.slot():
+                start = time.monotonic()
+                with span("mailerlite:batch", requests=len(chunk)):
+                    response = send_request('POST', url, headers=headers, json_body={'requests': chunk})
+        except requests.exceptions.RequestException as err:
+            controller.record(time.monotonic() - start, None)
+            print(f"An error occurred sending a batch: {err}")
+            if is_retryable_error(err):
+                circuit_breaker.record_failure()
+            else:
+                circuit_breaker.record_success()
+            responses.extend({'code': None, 'body': {'message': str(err)}} for _ in chunk)
+            position += len(chunk)
+            continue
+        controller.record(time.monotonic() - start, response.status_code, response.headers)
+
+        # If the status code is 429, the controller pauses requests until the rate limit resets, so try again
+        # unless the chunk has been rate limited too many times in a row. Then it fails like any other error,
+        # and its requests can be queued for a retry.
+        if response.status_code == 429:
+            rate_limited_attempts += 1
+            if rate_limited_attempts <= MAX_RATE_LIMIT_RETRIES:
+                print("Rate limit exceeded. Waiting for the rate limit to reset...")
+                continue
+            print(f"Still rate limited after {MAX_RATE_LIMIT_RETRIES} retries, giving up on this batch.")
+        rate_limited_attempts = 0
+
+        # Like a single write, only rate limits and server errors count towards opening the circuit.
+        if is_retryable_status(response.status_code):
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+
+        # If the whole batch failed, give every request in it the batch's status code.
+        if response.status_code != 200:
+            print(f"Batch error: {response.status_code} {response.text}")
+            responses.extend({'code': response.status_code, 'body': {'message': response.text}} for _ in chunk)
+        else:
+            chunk_responses = response.json().get('responses', [])[:len(chunk)]
+            if len(chunk_responses) < len(chunk):
+                # Keep the responses lined up with the requests, so a short list doesn't shift every later chunk's results.
+                print(f"Only {len(chunk_responses)} responses for a batch of {len(chunk)} requests, treating the rest as failed.")
+                chunk_responses += [{'code': None, 'body': {'message': "No response in the batch"}}
+                                    for _ in range(len(chunk) - len(chunk_responses))]
+            responses.extend(chunk_responses)
+        position += len(chunk)
+
+    return responses
+
+
+def get_all_mailerlite_groups(api_key):
+    """
+    Retrieves every group from MailerLite, using page-based pagination.
+
+    :param api_key: The Mailerlite API key.
+    :type api_key: str
+    :return: A list of all groups as JSON objects, or None if an error occurred.
+    :rtype: list
+    """
+    controller = get_controller('mailerlite_groups', max_page_size=100)
+    url = "https://connect.mailerlite.com/api/groups"
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    groups = []
+    page = 1
+    rate_limited_attempts = 0
+
+    while True:
+        start = time.monotonic()
+        try:
+            with controller.slot():
+                start = time.monotonic()
+                with span("mailerlite:groups.get_page"):
+                    response = send_request('GET', url, headers=headers, params={'limit': controller.page_size, 'page': page})
+        except requests.exceptions.RequestException as err:
+            controller.record(time.monotonic() - start, None)
+            print(f"An error occurred getting groups: {err}")
+            return None
+        controller.record(time.monotonic() - start, response.status_code, response.headers)
+
+        # If the status code is 429, the controller pauses requests until the rate limit resets, so try again
+        # unless the page has been rate limited too many times in a row.
+        if response.status_code == 429:
+            rate_limited_attempts += 1
+            if rate_limited_attempts > MAX_RATE_LIMIT_RETRIES:
+                print(f"Still rate limited after {MAX_RATE_LIMIT_RETRIES} retries, giving up on the groups.")
+                return None
+            print("Rate limit exceeded. Waiting for the rate limit to reset...")
+            continue
+        rate_limited_attempts = 0
+        if response.status_code != 200:
+            print(f"Error getting groups: {response.status_code} {response.text}")
+            return None
+
+        response_data = response.json()
+        groups.extend(response_data.get('data', []))
+        # Stop once we've read the last page.
+        meta = response_data.get('meta', {})
+        if not response_data.get('data') or page >= meta.get('last_page', page):
+            break
+        page += 1
+
+    return groups
+
+
+def create_mailerlite_group(api_key, name):
+    """
+    Creates a new group in MailerLite.
+
+    :param api_key: The Mailerlite API key.
+    :type api_key: str
+    :param name: The name of the new group.
+    :type name: str
+    :return: The new group as a JSON object, or None if an error occurred.
+    :rtype: dict
+    """
+    # Share the groups controller with the group scan, so creating groups counts towards the same rate limit.
+    controller = get_controller('mailerlite_groups', max_page_size=100)
+    rate_limited_attempts = 0
+    while True:
+        start = time.monotonic()
+        try:
+            with controller.slot():
+                start = time.monotonic()
+                with span("mailerlite:groups.create"):
+                    response = send_request('POST', "https://connect.mailerlite.com/api/groups",
+                                            headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
+                                            json_body={'name': name})
+        except requests.exceptions.RequestException as err:
+            controller.record(time.monotonic() - start, None)
+            print(f"An error occurred creating group {name}: {err}")
+            return None
+        controller.record(time.monotonic() - start, response.status_code, response.headers)
+
+        # If the status code is 429, the controller pauses requests until the rate limit resets, so try again
+        # unless the group has been rate limited too many times in a row.
+        if response.status_code == 429:
+            rate_limited_attempts += 1
+            if rate_limited_attempts > MAX_RATE_LIMIT_RETRIES:
+                print(f"Still rate limited after {MAX_RATE_LIMIT_RETRIES} retries, giving up on creating group {name}.")
+                return None
+            print("Rate limit exceeded. Waiting for the rate limit to reset...")
+            continue
+        break
+
+    if response.status_code not in (200, 201):
+        print(f"Error creating group {name}: {response.status_code} {response.text}")
+        return None
+    return response.json().get('data')
+
+
+def set_mailerlite_group_memberships(api_key, assignments, unassignments, retry_queue=None):
+    """
+    Adds subscribers to and removes them from groups in batches, rather than one request per subscriber per group.
+
+    :param api_key: The Mailerlite API key.
+    :type api_key: str
+    :param assignments: The memberships to add, as (subscriber ID, group ID) pairs.
+    :type assignments: list[tuple]
+    :param unassignments: The memberships to remove, as (subscriber ID, group ID) pairs.
+    :type unassignments: list[tuple]
+    :param retry_queue: The queue to add failed requests to.
+    :type retry_queue: RetryQueue
+    :return: A tuple of the number of memberships added and removed.
+    :rtype: tuple[int, int]
+    """
+    batch_requests = [{'method': 'POST', 'path': f"api/subscribers/{subscriber_id}/groups/{group_id}"}
+                      for subscriber_id, group_id in assignments] + \
+                     [{'method': 'DELETE', 'path': f"api/subscribers/{subscriber_id}/groups/{group_id}"}
+                      for subscriber_id, group_id in unassignments]
+    responses = send_mailerlite_batch(api_key, batch_requests)
+    if len(responses) < len(batch_requests):
+        # Don't let a short list of responses shift the unassignments' results onto the assignments.
+        print(f"Only {len(responses)} responses for {len(batch_requests)} group membership changes, treating the rest as failed.")
+        responses = responses + [{'code': None, 'body': {'message': "No response in the batch"}}
+                                 for _ in range(len(batch_requests) - len(responses))]
+
+    # The responses come back in the same order, so split them back into assignments and unassignments.
+    assigned = handle_mailerlite_batch_failures(
+        'assign_mailerlite_group', [{'subscriber_id': subscriber_id, 'group_id': group_id} for subscriber_id, group_id in assignments],
+        responses[:len(assignments)], retry_queue)
+    # A 404 when removing means the subscriber is already out of the group.
+    unassigned = handle_mailerlite_batch_failures(
+        'unassign_mailerlite_group', [{'subscriber_id': subscriber_id, 'group_id': group_id} for subscriber_id, group_id in unassignments],
+        responses[len(assignments):len(batch_requests)], retry_queue, ignored_codes=(404,))
+    return assigned, unassigned
+
+
+@traced("mailerlite:assign_group")
+def _assign_mailerlite_group(api_key, subscriber_id, group_id):
+    response = send_request('POST', f"https://connect.mailerlite.com/api/subscribers/{subscriber_id}/groups/{group_id}",
+                            headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'})
+    response.raise_for_status()  # Raise an exception for HTTP errors
+    return response.json()
+
+
+@traced("mailerlite:unassign_group")
+def _unassign_mailerlite_group(api_key, subscriber_id, group_id):
+    response = send_request('DELETE', f"https://connect.mailerlite.com/api/subscribers/{subscriber_id}/groups/{group_id}",
+                            headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'})
+    # A 404 means the subscriber is already out of the group.
+    if response.status_code != 404:
+        response.raise_for_status()  # Raise an exception for HTTP errors
+    return None
+
+
+def handle_mailerlite_batch_failures(operation, args_list, responses, retry_queue=None, ignored_codes=()):
+    """
+    Queues or dead-letters the requests in a batch that failed.
+
+    :param operation: The retry handler name for the requests, e.g. 'unsubscribe_mailerlite_subscriber'.
+    :type operation: str
+    :param args_list: The retry handler's keyword arguments for each request, in the same order as the responses.
+    :type args_list: list[dict]
+    :param responses: The responses returned by send_mailerlite_batch. Requests without a response count as failures.
+    :type responses: list[dict]
+    :param retry_queue: The queue to add retryable failures to.
+    :type retry_queue: RetryQueue
+    :param ignored_codes: Error codes that don't count as failures, e.g. 404 when deleting.
+    :return: The number of requests that succeeded.
+    :rtype: int
+    """
+    succeeded = 0
+    # Every request should have a response. Any without one failed as far as we know, so queue them like a timeout.
+    if len(responses) < len(args_list):
+        print(f"Only {len(responses)} responses for {len(args_list)} requests in batch {operation}, "
+              f"treating the other {len(args_list) - len(responses)} as failed.")
+        responses = list(responses) + [{'code': None, 'body': {'message': "No response in the batch"}}
+                                       for _ in range(len(args_list) - len(responses))]
+    for args, response in zip(args_list, responses):
+        code = response.get('code')
+        if code is not None and (code < 400 or code in ignored_codes):
+            succeeded += 1
+            continue
+
+        reason = f"{code}: {(response.get('body') or {}).get('message', 'Unknown error')}"
+        print(f"Error in batch {operation}: {reason}")
+        if retry_queue is None:
+            continue
+        if is_retryable_status(code):
+            retry_queue.add(operation, args, reason)
+        else:
+            retry_queue.dead_letter(operation, args, reason)
+    return succeeded
+
+
+def unsubscribe_mailerlite_subscribers(api_key, subscribers, delete=False, retry_queue=None):
+    """
+    Unsubscribes or deletes MailerLite subscribers in batches.
+
+    :param api_key: The Mailerlite API key.
+    :type api_key: str
+    :param subscribers: The subscribers to remove, as returned by get_all_mailerlite_subscribers.
+    :type subscribers: list[dict]
+    :param delete: Whether to delete the subscribers instead of unsubscribing them.
+    :type delete: bool
+    :param retry_queue: The queue to add failed requests to.
+    :type retry_queue: RetryQueue
+    :return: The number of subscribers removed.
+    :rtype: int
+    """
+    if delete:
+        operation = 'delete_mailerlite_subscriber'
+        args_list = [{'subscriber_id': subscriber['id']} for subscriber in subscribers]
+        batch_requests = [{'method': 'DELETE', 'path': f"api/subscribers/{subscriber['id']}"} for subscriber in subscribers]
+    else:
+        # Upserting with an unsubscribed status unsubscribes an existing subscriber.
+        operation = 'unsubscribe_mailerlite_subscriber'
+        args_list = [{'email': subscriber['email']} for subscriber in subscribers]
+        batch_requests = [{'method': 'POST', 'path': 'api/subscribers', 'body': {'email': subscriber['email'], 'status': 'unsubscribed'}}
+                          for subscriber in subscribers]
+
+    responses = send_mailerlite_batch(api_key, batch_requests)
+    # A 404 when deleting means the subscriber is already gone.
+    return handle_mailerlite_batch_failures(operation, args_list, responses, retry_queue,
+                                            ignored_codes=(404,) if delete else ())
+
+
+def upsert_mailerlite_subscribers(api_key, subscribers, retry_queue=None):
+    """
+    Creates or updates MailerLite subscribers in batches, matching existing subscribers by email.
+
+    :param api_key: The Mailerlite API key.
+    :type api_key: str
+    :param subscribers: The subscribers to create or update, e.g. {"email": "someone@example.com", "fields": {...}}.
+    :type subscribers: list[dict]
+    :param retry_queue: The queue to add failed requests to.
+    :type retry_queue: RetryQueue
+    :return: The number of subscribers created or updated.
+    :rtype: int
+    """
+    args_list = [{'subscriber': subscriber} for subscriber in subscribers]
+    batch_requests = [{'method': 'POST', 'path': 'api/subscribers', 'body': subscriber} for subscriber in subscribers]
+    responses = send_mailerlite_batch(api_key, batch_requests)
+    return handle_mailerlite_batch_failures('upsert_mailerlite_subscriber', args_list, responses, retry_queue)
 
 
-def create_mailerlite_subscriber(api_key, email, name):
+@traced("mailerlite:upsert_subscriber")
+def _upsert_mailerlite_subscriber(api_key, subscriber):
+    response = send_request('POST', "https://connect.mailerlite.com/api/subscribers",
+                            headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
+                            json_body=subscriber)
+    response.raise_for_status()  # Raise an exception for HTTP errors
+    return response.json()
+
+
+@traced("mailerlite:unsubscribe_subscriber")
+def _unsubscribe_mailerlite_subscriber(api_key, email):
+    response = send_request('POST', "https://connect.mailerlite.com/api/subscribers",
+                            headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
+                            json_body={'email': email, 'status': 'unsubscribed'})
+    response.raise_for_status()  # Raise an exception for HTTP errors
+    return response.json()
+
+
+@traced("mailerlite:delete_subscriber")
+def _delete_mailerlite_subscriber(api_key, subscriber_id):
+    response = send_request('DELETE', f"https://connect.mailerlite.com/api/subscribers/{subscriber_id}",
+                            headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'})
+    # A 404 means the subscriber is already gone.
+    if response.status_code != 404:
+        response.raise_for_status()  # Raise an exception for HTTP errors
+    return None
+
+
+def create_mailerlite_subscriber(api_key, email, name, retry_queue=None):
     """
     Creates a new subscriber in MailerLite.
+    If the request fails with a transient error and a retry queue is given, the operation is queued to be retried.
 
     :param api_key: The API key for MailerLite.
     :param email: The email address of the new subscriber.
     :param name: The name of the new subscriber.
+    :param retry_queue: The queue to add the operation to if it fails.
+    :type retry_queue: RetryQueue
     :return: The new subscriber as a JSON object, or None if an error occurred.
     """
+    return _send_mailerlite_write(_create_mailerlite_subscriber, 'create_mailerlite_subscriber',
+                                  {'email': email, 'name': name}, api_key, retry_queue)
+
+
+@traced("mailerlite:create_subscriber")
+def _create_mailerlite_subscriber(api_key, email, name):
     url = "https://api.mailerlite.com/api/v2/subscribers"
     headers = {
         "Content-Type": "application/json",
@@ -96,30 +554,32 @@ def create_mailerlite_subscriber(api_key, email, name):
         "name": name
     }
 
-    try:
-        # Make a POST request to the MailerLite API
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()  # Raise an exception for HTTP errors
+    # Make a POST request to the MailerLite API
+    response = send_request('POST', url, headers=headers, json_body=payload)
+    response.raise_for_status()  # Raise an exception for HTTP errors
 
-        # Return the new subscriber
-        return response.json()
-    except requests.exceptions.HTTPError as http_err:
-        print(f"HTTP error occurred: {http_err}")
-    except Exception as err:
-        print(f"An error occurred: {err}")
-
-    return None
+    # Return the new subscriber
+    return response.json()
 
 
-def update_mailerlite_subscriber(api_key, subscriber_id, email):
+def update_mailerlite_subscriber(api_key, subscriber_id, email, retry_queue=None):
     """
     Updates an existing subscriber in MailerLite.
+    If the request fails with a transient error and a retry queue is given, the operation is queued to be retried.
 
     :param api_key: The API key for MailerLite.
     :param subscriber_id: The ID of the subscriber to update.
     :param email: The new email address for the subscriber.
+    :param retry_queue: The queue to add the operation to if it fails.
+    :type retry_queue: RetryQueue
     :return: The updated subscriber as a JSON object, or None if an error occurred.
     """
+    return _send_mailerlite_write(_update_mailerlite_subscriber, 'update_mailerlite_subscriber',
+                                  {'subscriber_id': subscriber_id, 'email': email}, api_key, retry_queue)
+
+
+@traced("mailerlite:update_subscriber")
+def _update_mailerlite_subscriber(api_key, subscriber_id, email):
     url = f"https://api.mailerlite.com/api/v2/subscribers/{subscriber_id}"
     headers = {
         "Content-Type": "application/json",
@@ -129,16 +589,64 @@ def update_mailerlite_subscriber(api_key, subscriber_id, email):
         "email": email
     }
 
+    # Make a PUT request to the MailerLite API
+    response = send_request('PUT', url, headers=headers, json_body=payload)
+    response.raise_for_status()  # Raise an exception for HTTP errors
+
+    # Return the updated subscriber as a JSON object
+    return response.json()
+
+
+def _send_mailerlite_write(write_function, operation, args, api_key, retry_queue):
+    # Send a write through the MailerLite circuit breaker, queueing it for a retry if it fails with a transient error.
+    circuit_breaker = get_circuit_breaker('mailerlite')
+    if not circuit_breaker.allow():
+        # MailerLite looks to be down, so don't send anything else until the circuit closes.
+        if retry_queue is not None:
+            retry_queue.add(operation, args, "Circuit open, MailerLite is not responding")
+        return None
+
     try:
-        # Make a PUT request to the MailerLite API
-        response = requests.put(url, headers=headers, json=payload)
-        response.raise_for_status()  # Raise an exception for HTTP errors
+        result = write_function(api_key, **args)
+    except requests.exceptions.RequestException as err:
+        if isinstance(err, requests.exceptions.HTTPError):
+            print(f"HTTP error occurred: {err}")
+        else:
+            print(f"An error occurred: {err}")
 
-        # Return the updated subscriber as a JSON object
-        return response.json()
-    except requests.exceptions.HTTPError as http_err:
-        print(f"HTTP error occurred: {http_err}")
+        if is_retryable_error(err):
+            # Rate limits, server errors and timeouts count towards opening the circuit and are worth retrying.
+            circuit_breaker.record_failure()
+            if retry_queue is not None:
+                retry_queue.add(operation, args, str(err))
+        else:
+            # Any other client error means MailerLite is up but rejected the request, so retrying won't help.
+            circuit_breaker.record_success()
+            if retry_queue is not None:
+                retry_queue.dead_letter(operation, args, str(err))
+        return None
     except Exception as err:
-        print(f"Other error occurred: {err}")
+        print(f"An error occurred: {err}")
+        return None
 
-    return None
+    circuit_breaker.record_success()
+    return result
+
+
+def get_mailerlite_retry_handlers(api_key):
+    """
+    Gets the handlers used to replay queued MailerLite operations.
+
+    :param api_key: The API key for MailerLite.
+    :return: A dictionary of operation names to functions for RetryQueue.drain().
+    :rtype: dict
+    """
+    return {
+        'create_mailerlite_subscriber': lambda **args: _create_mailerlite_subscriber(api_key, **args),
+        'update_mailerlite_subscriber': lambda **args: _update_mailerlite_subscriber(api_key, **args),
+        'unsubscribe_mailerlite_subscriber': lambda **args: _unsubscribe_mailerlite_subscriber(api_key, **args),
+        'delete_mailerlite_subscriber': lambda **args: _delete_mailerlite_subscriber(api_key, **args),
+        'upsert_mailerlite_subscriber': lambda **args: _upsert_mailerlite_subscriber(api_key, **args),
+        'assign_mailerlite_group': lambda **args: _assign_mailerlite_group(api_key, **args),
+        'unassign_mailerlite_group': lambda **args: _unassign_mailerlite_group(api_key, **args),
+    }
@@ -0,0 +1,192 @@
+"""
+Works out each contact's purchase fields from their HubSpot deals and line items.
+
+Fields like last_products_bought_product_1_name and total_number_of_products_bought are normally filled in by
+HubSpot workflows and are often out of date. Instead, the deals and line items are exported in bulk with batch
+reads and aggregated per contact locally, and the results are used directly in the MailerLite payload.
+
+Only the contacts with deals modified since the last run are recalculated. Their results are merged into a
+snapshot of every contact's purchase fields, so the fields for every other contact carry over between runs.
+"""
+import os
+from datetime import datetime, timezone
+
+from src.hubspotFunctions import search_hubspot_deals_modified_since, get_all_hubspot_deals, batch_read_hubspot_associations, \
+    batch_read_hubspot_objects, DEAL_PROPERTIES, LINE_ITEM_PROPERTIES
+from src.snapshotFunctions import SnapshotReader, write_snapshot
+
+# The number of products from the last order that get their own fields.
+LAST_PRODUCTS_COUNT = 3
+# The deal stages that count as a purchase, unless HUBSPOT_WON_DEAL_STAGES lists others, separated by commas.
+DEFAULT_WON_STAGES = ('closedwon',)
+# The fields produced for each contact.
+PURCHASE_FIELD_NAMES = [
+    "last_product_bought", "last_products_bought", "last_total_number_of_products_bought",
+    "total_number_of_products_bought", "products_bought",
+] + [
+    f"last_products_bought_product_{number}_{suffix}"
+    for number in range(1, LAST_PRODUCTS_COUNT + 1)
+    for suffix in ("name", "price", "url", "image_url")
+]
+
+
+def _to_number(value):
+    # HubSpot returns every property as a string, so convert quantities safely.
+    try:
+        return float(value) if value not in (None, "") else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _format_number(value):
+    # Show whole numbers without a decimal point, e.g. 3 rather than 3.0.
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def get_won_stages():
+    """
+    Reads the deal stages that count as a purchase from HUBSPOT_WON_DEAL_STAGES, e.g. "closedwon,contractsigned".
+    Pipelines with their own stages have their own won stage IDs, so list every one of them.
+
+    :return: The internal names of the won deal stages.
+    :rtype: set[str]
+    """
+    stages = {stage.strip() for stage in os.getenv('HUBSPOT_WON_DEAL_STAGES', '').split(',') if stage.strip()}
+    return stages or set(DEFAULT_WON_STAGES)
+
+
+def aggregate_purchases(deal_ids_by_contact, deals_by_id, line_item_ids_by_deal, line_items_by_id, won_stages=None):
+    """
+    Aggregates the deals and line items for each contact into their purchase fields, in a single pass per contact.
+
+    :param deal_ids_by_contact: A dictionary of contact ID to the IDs of the contact's deals.
+    :type deal_ids_by_contact: dict
+    :param deals_by_id: A dictionary of deal ID to the deal's properties.
+    :type deals_by_id: dict
+    :param line_item_ids_by_deal: A dictionary of deal ID to the IDs of the deal's line items.
+    :type line_item_ids_by_deal: dict
+    :param line_items_by_id: A dictionary of line item ID to the line item's properties.
+    :type line_items_by_id: dict
+    :param won_stages: Only count deals in these deal stages, e.g. {'closedwon'}. Counts every deal if None.
+    :type won_stages: set
+    :return: A dictionary of contact ID to a dictionary of purchase fields.
+    :rtype: dict
+    """
+    purchase_fields = {}
+    for contact_id, deal_ids in deal_ids_by_contact.items():
+        # Sort the contact's orders from newest to oldest, using the close date and falling back to the create date.
+        deals = []
+        for deal_id in deal_ids:
+            deal = deals_by_id.get(deal_id)
+            if deal is None or (won_stages is not None and deal.get('dealstage') not in won_stages):
+                continue
+            deals.append((deal.get('closedate') or deal.get('createdate') or '', deal_id))
+        deals.sort(reverse=True)
+
+        fields = {name: None for name in PURCHASE_FIELD_NAMES}
+        total_quantity = 0.0
+        products_bought = []
+        for position, (_, deal_id) in enumerate(deals):
+            line_items = [line_items_by_id[line_item_id] for line_item_id in line_item_ids_by_deal.get(deal_id, [])
+                          if line_item_id in line_items_by_id]
+            deal_quantity = sum(_to_number(line_item.get('quantity')) for line_item in line_items)
+            total_quantity += deal_quantity
+            for line_item in line_items:
+                if line_item.get('name') and line_item['name'] not in products_bought:
+                    products_bought.append(line_item['name'])
+
+            if position == 0:
+                # The newest order fills in the "last products bought" fields.
+                names = [line_item.get('name') for line_item in line_items if line_item.get('name')]
+                fields['last_product_bought'] = names[0] if names else None
+                fields['last_products_bought'] = ", ".join(names) or None
+                fields['last_total_number_of_products_bought'] = _format_number(deal_quantity)
+                for number, line_item in enumerate(line_items[:LAST_PRODUCTS_COUNT], start=1):
+                    prefix = f"last_products_bought_product_{number}"
+                    fields[f"{prefix}_name"] = line_item.get('name')
+                    fields[f"{prefix}_price"] = line_item.get('price')
+                    fields[f"{prefix}_url"] = line_item.get('hs_url')
+                    fields[f"{prefix}_image_url"] = line_item.get('hs_images')
+
+        if deals:
+            fields['total_number_of_products_bought'] = _format_number(total_quantity)
+            # Multiple checkbox properties in HubSpot use semicolons between values.
+            fields['products_bought'] = ";".join(products_bought) or None
+        purchase_fields[contact_id] = fields
+
+    return purchase_fields
+
+
+def get_purchase_fields(hubspot_client, state, output_dir='output', won_stages=None):
+    """
+    Gets the purchase fields for every contact, recalculating only the contacts with deals modified since the last run.
+    The checkpoint is read from and saved to the state under 'deals_checkpoint', and the fields for every contact are
+    kept in output_dir/purchaseFields.snap. Without a checkpoint, every deal is exported.
+
+    :param hubspot_client: The HubSpot client instance.
+    :param state: The state saved between runs. The checkpoint is updated in place.
+    :type state: dict
+    :param output_dir: The folder to keep the purchase fields snapshot in.
+    :type output_dir: str
+    :param won_stages: Only count deals in these deal stages. Defaults to get_won_stages().
+    :type won_stages: set
+    :return: A dictionary of contact ID to a dictionary of purchase fields, or None if an error occurred.
+    :rtype: dict
+    """
+    if won_stages is None:
+        won_stages = get_won_stages()
+    snapshot_path = os.path.join(output_dir, 'purchaseFields.snap')
+    checkpoint = state.get('deals_checkpoint')
+    run_started_at = datetime.now(timezone.utc)
+
+    # Without the saved fields from previous runs, start again from every deal.
+    if not os.path.exists(snapshot_path):
+        checkpoint = None
+
+    # Load the purchase fields worked out on previous runs.
+    purchase_fields = {}
+    if checkpoint:
+        with SnapshotReader(snapshot_path) as snapshot:
+            purchase_fields = {record['contact_id']: record['fields'] for record in snapshot}
+
+    # Step 1: Find the deals modified since the last run, or every deal on the first run.
+    if checkpoint:
+        changed_deals = search_hubspot_deals_modified_since(hubspot_client, datetime.fromisoformat(checkpoint), ["dealname"])
+    else:
+        changed_deals = get_all_hubspot_deals(hubspot_client, ["dealname"])
+    if changed_deals is None:
+        return purchase_fields or None
+
+    if changed_deals:
+        # Step 2: Find the contacts on those deals, then every deal those contacts have, so their totals are complete.
+        contact_ids_by_deal = batch_read_hubspot_associations(hubspot_client, 'deals', 'contacts', [deal.id for deal in changed_deals])
+        if contact_ids_by_deal is None:
+            return purchase_fields or None
+        contact_ids = {contact_id for contact_ids in contact_ids_by_deal.values() for contact_id in contact_ids}
+        deal_ids_by_contact = batch_read_hubspot_associations(hubspot_client, 'contacts', 'deals', contact_ids)
+        if deal_ids_by_contact is None:
+            return purchase_fields or None
+
+        # Step 3: Read those deals and their line items in batches.
+        deal_ids = {deal_id for deal_ids in deal_ids_by_contact.values() for deal_id in deal_ids}
+        deals_by_id = batch_read_hubspot_objects(hubspot_client, 'deals', deal_ids, DEAL_PROPERTIES)
+        line_item_ids_by_deal = batch_read_hubspot_associations(hubspot_client, 'deals', 'line_items', deal_ids)
+        if deals_by_id is None or line_item_ids_by_deal is None:
+            return purchase_fields or None
+        line_item_ids = {line_item_id for line_item_ids in line_item_ids_by_deal.values() for line_item_id in line_item_ids}
+        line_items_by_id = batch_read_hubspot_objects(hubspot_client, 'line_items', line_item_ids, LINE_ITEM_PROPERTIES)
+        if line_items_by_id is None:
+            return purchase_fields or None
+
+        # Step 4: Aggregate everything per contact and merge it into the saved fields.
+        purchase_fields.update(aggregate_purchases(deal_ids_by_contact, deals_by_id, line_item_ids_by_deal, line_items_by_id, won_stages))
+        write_snapshot([{'contact_id': contact_id, 'fields': fields} for contact_id, fields in purchase_fields.items()],
+                       snapshot_path, email_getter=lambda record: record['contact_id'])
+        print(f"Recalculated purchase fields for {len(contact_ids)} contacts from {len(changed_deals)} changed deals.")
+    elif checkpoint is None:
+        # Save an empty snapshot on the first run so the next run can start from the checkpoint.
+        write_snapshot([], snapshot_path)
+
+    # Only move the checkpoint once everything has been saved.
+    state['deals_checkpoint'] = run_started_at.isoformat()
+    return purchase_fields
@@ -0,0 +1,343 @@
+"""
+Adaptive page size and concurrency control for the HubSpot and MailerLite API clients.
+
+Each endpoint gets its own AdaptiveController which uses AIMD (additive increase, multiplicative decrease):
+- When the API throttles us (429) the number of requests in flight is halved straight away and every
+  caller waits until the rate limit window resets.
+- When the API errors or times out, both the concurrency and the page size are halved.
+- When responses are slower than the target latency, the page size is reduced by a quarter.
+- After a run of fast, successful responses with plenty of rate limit headroom left, the page size and
+  concurrency are increased a step at a time.
+
+Every decision is printed and kept on the controller so a run's summary shows what each endpoint ran at.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Header pairs used by the APIs to report rate limit headroom, as (remaining, limit).
+RATE_LIMIT_HEADERS = [
+    ('X-RateLimit-Remaining', 'X-RateLimit-Limit'),
+    ('X-HubSpot-RateLimit-Remaining', 'X-HubSpot-RateLimit-Max'),
+]
+# Default pause when a 429 response doesn't say how long to wait.
+DEFAULT_THROTTLE_SECONDS = 60
+# Number of times a request is retried after being rate limited before giving up on it.
+MAX_RATE_LIMIT_RETRIES = 5
+
+
+class AdaptiveController:
+    """
+    Tunes the page size and number of in-flight requests for a single API endpoint.
+
+    Usage:
+        controller = get_controller('mailerlite_subscribers', max_page_size=100)
+        with controller.slot():
+            start = time.monotonic()
+            response = requests.get(url, params={'limit': controller.page_size})
+        controller.record(time.monotonic() - start, response.status_code, response.headers)
+    """
+
+    def __init__(self, name, page_size=100, min_page_size=10, max_page_size=100, page_size_step=10,
+                 concurrency=2, min_concurrency=1, max_concurrency=8, target_latency=2.0,
+                 headroom_threshold=0.2, increase_after=3):
+        """
+        :param name: The endpoint name used in log messages.
+        :param page_size: The starting page size.
+        :param min_page_size: The smallest page size to back off to.
+        :param max_page_size: The largest page size the API allows.
+        :param page_size_step: How much to grow the page size by after a run of good responses.
+        :param concurrency: The starting number of requests allowed in flight.
+        :param min_concurrency: The smallest number of requests allowed in flight.
+        :param max_concurrency: The largest number of requests allowed in flight.
+        :param target_latency: Responses slower than this many seconds shrink the page size.
+        :param headroom_threshold: The fraction of the rate limit that must be left before concurrency is increased.
+        :param increase_after: The number of consecutive good responses needed before increasing.
+        """
+        self.name = name
+        self.min_page_size = min_page_size
+        self.max_page_size = max_page_size
+        self.page_size_step = page_size_step
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.headroom_threshold = headroom_threshold
+        self.increase_after = increase_after
+
+        self.page_size = max(min_page_size, min(page_size, max_page_size))
+        self.concurrency = max(min_concurrency, min(concurrency, max_concurrency))
+        # Keep a list of every change so the run summary can show what happened.
+        self.decisions = []
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._good_responses = 0
+        self._requests = 0
+        self._errors = 0
+        self._throttled = 0
+        self._total_latency = 0.0
+        self._peak_concurrency = self.concurrency
+        self._peak_page_size = self.page_size
+        self._low_page_size = self.page_size
+
+    @contextmanager
+    def slot(self):
+        """
+        Waits until a request is allowed to start, then holds one in-flight slot until the block exits.
+        Requests wait while the endpoint is paused after being throttled.
+        """
+        with self._condition:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self._in_flight >= self.concurrency:
+                    self._condition.wait()
+                else:
+                    break
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def record(self, latency, status_code, headers=None):
+        """
+        Records the outcome of a request and adjusts the page size and concurrency.
+
+        :param latency: How long the request took in seconds.
+        :type latency: float
+        :param status_code: The HTTP status code, or None if the request failed without a response (e.g. a timeout).
+        :type status_code: int
+        :param headers: The response headers, used to read rate limit headroom.
+        :type headers: dict
+        """
+        headers = headers or {}
+        with self._condition:
+            self._requests += 1
+            self._total_latency += latency
+
+            if status_code == 429:
+                # Throttled, so back off quickly and make every caller wait for the window to reset.
+                self._throttled += 1
+                self._good_responses = 0
+                delay = _get_retry_delay(headers)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                self._change(self.page_size, self.concurrency // 2, f"rate limited, pausing for {delay:.0f}s")
+            elif status_code is None or status_code >= 500:
+                # The API is struggling, so ask for less at a time as well as less often.
+                self._errors += 1
+                self._good_responses = 0
+                self._change(self.page_size // 2, self.concurrency // 2, f"error response ({status_code or 'no response'})")
+            elif latency > self.target_latency:
+                self._good_responses = 0
+                self._change(int(self.page_size * 0.75), self.concurrency,
+                             f"slow response ({latency:.2f}s > {self.target_latency:.2f}s)")
+            else:
+                self._good_responses += 1
+                headroom = _get_headroom(headers)
+                if headroom is not None and headroom < self.headroom_threshold / 4:
+                    # Almost out of requests for this window, so ease off before we get throttled.
+                    self._good_responses = 0
+                    self._change(self.page_size, self.concurrency - 1, f"low rate limit headroom ({headroom:.0%})")
+                elif self._good_responses >= self.increase_after:
+                    self._good_responses = 0
+                    concurrency = self.concurrency
+                    if headroom is None or headroom >= self.headroom_threshold:
+                        concurrency += 1
+                    self._change(self.page_size + self.page_size_step, concurrency,
+                                 f"{self.increase_after} fast responses" +
+                                 (f", {headroom:.0%} headroom" if headroom is not None else ""))
+            self._condition.notify_all()
+
+    def throttle(self, delay=DEFAULT_THROTTLE_SECONDS):
+        """
+        Pauses all requests for this endpoint, e.g. when a caller sees a rate limit error without a status code.
+
+        :param delay: The number of seconds to pause for.
+        """
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._condition.notify_all()
+
+    def _change(self, page_size, concurrency, reason):
+        # Clamp the new values and only log something if they actually changed.
+        page_size = max(self.min_page_size, min(page_size, self.max_page_size))
+        concurrency = max(self.min_concurrency, min(concurrency, self.max_concurrency))
+        if page_size == self.page_size and concurrency == self.concurrency:
+            return
+        message = (f"[{self.name}] concurrency {self.concurrency} -> {concurrency}, "
+                   f"page size {self.page_size} -> {page_size}: {reason}")
+        print(message)
+        self.decisions.append({
+            'time': time.time(),
+            'page_size': page_size,
+            'concurrency': concurrency,
+            'reason': reason,
+        })
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self._peak_concurrency = max(self._peak_concurrency, concurrency)
+        self._peak_page_size = max(self._peak_page_size, page_size)
+        self._low_page_size = min(self._low_page_size, page_size)
+
+    def summary(self):
+        """
+        Summarises what the endpoint ran at during this run.
+
+        :return: A dictionary of request counts, latency and the page size and concurrency ranges used.
+        :rtype: dict
+        """
+        with self._condition:
+            return {
+                'name': self.name,
+                'requests': self._requests,
+                'errors': self._errors,
+                'throttled': self._throttled,
+                'average_latency': self._total_latency / self._requests if self._requests else 0.0,
+                'page_size': self.page_size,
+                'page_size_range': (self._low_page_size, self._peak_page_size),
+                'concurrency': self.concurrency,
+                'peak_concurrency': self._peak_concurrency,
+                'decisions': len(self.decisions),
+            }
+
+    def reset_summary(self):
+        """
+        Starts the counts in summary() again, e.g. between runs of a long-running process.
+        The page size and concurrency it has tuned itself to are kept.
+        """
+        with self._condition:
+            self.decisions = []
+            self._requests = 0
+            self._errors = 0
+            self._throttled = 0
+            self._total_latency = 0.0
+            self._peak_concurrency = self.concurrency
+            self._peak_page_size = self.page_size
+            self._low_page_size = self.page_size
+
+
+def _get_retry_delay(headers):
+    # Prefer Retry-After, then the MailerLite reset header, then fall back to the default pause.
+    for header in ('Retry-After', 'X-RateLimit-Reset'):
+        value = headers.get(header)
+        if value is not None:
+            try:
+                return max(1.0, float(value))
+            except ValueError:
+                pass
+    return DEFAULT_THROTTLE_SECONDS
+
+
+def _get_headroom(headers):
+    # Work out the fraction of the rate limit that is left, if the API told us.
+    for remaining_header, limit_header in RATE_LIMIT_HEADERS:
+        remaining = headers.get(remaining_header)
+        limit = headers.get(limit_header)
+        if remaining is not None and limit:
+            try:
+                return float(remaining) / float(limit)
+            except ValueError:
+                return None
+    return None
+
+
+# The account the current thread is syncing, used to give each account its own rate limit budget.
+_current_account = contextvars.ContextVar('current_account', default=None)
+
+
+@contextmanager
+def account_scope(name):
+    """
+    Marks the code inside the block as working for one account, so controllers and circuit breakers
+    fetched inside it belong to that account. New threads don't inherit the scope, so resolve the
+    controller before handing work to another thread.
+
+    :param name: The account name, or None for the default account.
+    :type name: str
+    """
+    token = _current_account.set(name)
+    try:
+        yield
+    finally:
+        _current_account.reset(token)
+
+
+def get_account_name():
+    """
+    :return: The name of the account the current code is running for, or None for the default account.
+    :rtype: str
+    """
+    return _current_account.get()
+
+
+def get_scoped_name(name):
+    """
+    Prefixes a name with the current account, e.g. 'brand_a:mailerlite_subscribers'.
+
+    :param name: The name to prefix.
+    :type name: str
+    :rtype: str
+    """
+    account = get_account_name()
+    return f"{account}:{name}" if account else name
+
+
+# Controllers are shared per endpoint name so every caller of the same endpoint shares one budget.
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def get_controller(name, **settings):
+    """
+    Gets the shared controller for an endpoint, creating it the first time it is asked for.
+    Each account has its own controllers, since each account has its own rate limits.
+
+    :param name: The endpoint name, e.g. 'mailerlite_subscribers'.
+    :type name: str
+    :param settings: Settings passed to AdaptiveController when it is created.
+    :return: The controller for the endpoint.
+    :rtype: AdaptiveController
+    """
+    name = get_scoped_name(name)
+    with _controllers_lock:
+        if name not in _controllers:
+            _controllers[name] = AdaptiveController(name, **settings)
+        return _controllers[name]
+
+
+def log_controller_summaries(account=None):
+    """
+    Prints a summary line for every controller used during the run.
+
+    :param account: Only summarise the controllers for this account. Summarises every controller if None.
+    :type account: str
+    :return: A list of the summaries printed.
+    :rtype: list[dict]
+    """
+    with _controllers_lock:
+        controllers = [controller for name, controller in _controllers.items()
+                       if account is None or name.startswith(f"{account}:")]
+    summaries = [controller.summary() for controller in controllers]
+    for summary in summaries:
+        print(f"[{summary['name']}] {summary['requests']} requests, {summary['errors']} errors, "
+              f"{summary['throttled']} throttled, {summary['average_latency']:.2f}s average latency, "
+              f"page size {summary['page_size_range'][0]}-{summary['page_size_range'][1]} (ended at {summary['page_size']}), "
+              f"concurrency peaked at {summary['peak_concurrency']} (ended at {summary['concurrency']}), "
+              f"{summary['decisions']} adjustments")
+    return summaries
+
+
+def reset_controller_summaries():
+    """
+    Starts every controller's summary counts again, so the next run's summaries only cover that run.
+    """
+    with _controllers_lock:
+        controllers = list(_controllers.values())
+    for controller in controllers:
+        controller.reset_summary()
@@ -0,0 +1,352 @@
+"""
+Retry queue, circuit breaker and dead-letter file for failed API writes.
+
+Writes that fail with a transient error (a 429, a 5xx or a timeout) are added to a persistent retry queue instead of being dropped.
+At the end of a run the queue is drained in rounds with jittered exponential backoff between them.
+A circuit breaker per API stops new requests once too many fail in a row, so a run doesn't keep hammering an API that is down;
+anything still queued when the circuit opens is kept for the next run.
+Operations that fail permanently, or keep failing after every attempt, are written to a dead-letter file with the reason.
+"""
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from src.rateControlFunctions import get_scoped_name
+
+# Default locations of the persistent retry queue and the dead-letter file.
+RETRY_QUEUE_PATH = 'output/retryQueue.jsonl'
+DEAD_LETTER_PATH = 'output/deadLetters.jsonl'
+# The operation arguments included in dead-letter alerts. Everything else, like the fields being written,
+# can hold a subscriber's personal details, so it is only kept in the dead-letter file.
+ALERT_ARGUMENT_NAMES = ('email', 'subscriber_id', 'group_id', 'contact_id')
+
+
+def get_error_status(error):
+    """
+    Gets the HTTP status code from an exception raised by requests or the HubSpot client, if there is one.
+
+    :param error: The exception raised by the API call.
+    :type error: Exception
+    :return: The status code, or None if the error didn't come with a response.
+    :rtype: int
+    """
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        status = getattr(error, 'status', None)
+    return status
+
+
+def is_retryable_error(error):
+    """
+    Decides whether a failed request is worth retrying.
+    Rate limits, server errors, timeouts and connection errors are retryable. Other client errors (4xx) are not.
+
+    :param error: The exception raised by the API call.
+    :type error: Exception
+    :rtype: bool
+    """
+    status = get_error_status(error)
+    if status is not None:
+        return is_retryable_status(status)
+    # Requests' timeouts and connection errors are all IOError (OSError) subclasses.
+    # Requests' JSONDecodeError is one too, but it also subclasses ValueError. It means the API answered with
+    # a body we couldn't parse, which sending the same request again won't fix.
+    return isinstance(error, OSError) and not isinstance(error, ValueError)
+
+
+def is_retryable_status(status):
+    """
+    Decides whether a request that finished with a status code is worth retrying, e.g. for one request in a batch.
+
+    :param status: The HTTP status code, or None if there was no response.
+    :type status: int
+    :rtype: bool
+    """
+    return status is None or status == 429 or status >= 500
+
+
+class CircuitBreaker:
+    """
+    Stops calling an API after a run of consecutive failures.
+
+    The circuit starts closed. After failure_threshold failures in a row it opens and allow() returns False.
+    Once reset_timeout seconds have passed a single trial request is allowed (half open);
+    if it succeeds the circuit closes again, otherwise it stays open for another reset_timeout.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self):
+        """
+        Checks whether a request may be sent.
+
+        :return: True if the circuit is closed, or if it is time for a trial request.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._trial_in_progress and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print(f"[{self.name}] Circuit closed, the API is responding again.")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_progress or (self._opened_at is None and self._failures >= self.failure_threshold):
+                if self._opened_at is None:
+                    print(f"[{self.name}] Circuit opened after {self._failures} consecutive failures.")
+                self._opened_at = time.monotonic()
+                self._trial_in_progress = False
+
+
+# Circuit breakers are shared per API so every caller stops once the API is down.
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name, **settings):
+    """
+    Gets the shared circuit breaker for an API, creating it the first time it is asked for.
+    Each account has its own circuit breakers.
+
+    :param name: The API name, e.g. 'mailerlite'.
+    :type name: str
+    :param settings: Settings passed to CircuitBreaker when it is created.
+    :rtype: CircuitBreaker
+    """
+    name = get_scoped_name(name)
+    with _circuit_breakers_lock:
+        if name not in _circuit_breakers:
+            _circuit_breakers[name] = CircuitBreaker(name, **settings)
+        return _circuit_breakers[name]
+
+
+class RetryQueue:
+    """
+    A persistent queue of failed operations.
+
+    Each operation is stored as its name and keyword arguments, e.g.
+    {"operation": "update_mailerlite_subscriber", "args": {"subscriber_id": "123", "email": {...}}}.
+    Credentials are never stored; the handlers passed to drain() supply them.
+    Operations left over from a previous run are loaded when the queue is created.
+    """
+
+    def __init__(self, path=RETRY_QUEUE_PATH, dead_letter_path=DEAD_LETTER_PATH, max_attempts=5, base_delay=1.0,
+                 max_delay=60.0, alerts=None):
+        """
+        :param path: The JSON lines file the queue is saved to.
+        :param dead_letter_path: The JSON lines file that permanently failed operations are appended to.
+        :param max_attempts: The number of failed attempts before an operation is dead-lettered.
+        :param base_delay: The backoff before the second round of retries, in seconds. Doubles every round.
+        :param max_delay: The longest backoff between rounds, in seconds.
+        :param alerts: An optional AlertDispatcher to send an alert to for every dead-lettered operation.
+        """
+        self.path = path
+        self.dead_letter_path = dead_letter_path
+        self.alerts = alerts
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.dead_letter_count = 0
+        self._lock = threading.Lock()
+        self._items = []
+
+        # Load anything a previous run couldn't finish.
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self._items = [json.loads(line) for line in file if line.strip()]
+            if self._items:
+                print(f"Loaded {len(self._items)} operations from the retry queue.")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def add(self, operation, args, reason):
+        """
+        Adds a failed operation to the queue and appends it to the queue file.
+
+        :param operation: The name of the operation, matching a key in the handlers passed to drain().
+        :type operation: str
+        :param args: The keyword arguments to call the handler with. Must be JSON serialisable.
+        :type args: dict
+        :param reason: Why the operation failed.
+        :type reason: str
+        """
+        item = {
+            'operation': operation,
+            'args': args,
+            'attempts': 1,
+            'reason': reason,
+            'queued_at': datetime.now(timezone.utc).isoformat(),
+        }
+        with self._lock:
+            self._items.append(item)
+            # Append just this operation rather than rewriting the file. While the circuit is open every write is queued,
+            # so rewriting on every add would be quadratic. drain() rewrites the file at the end of each round.
+            self._append(item)
+
+    def dead_letter(self, operation, args, reason, attempts=1):
+        """
+        Writes an operation straight to the dead-letter file, e.g. for errors that retrying won't fix.
+
+        :param operation: The name of the operation.
+        :param args: The operation's keyword arguments.
+        :param reason: Why the operation failed.
+        :param attempts: The number of times the operation was attempted.
+        """
+        with self._lock:
+            self._write_dead_letter({'operation': operation, 'args': args, 'attempts': attempts, 'reason': reason})
+
+    def drain(self, handlers, circuit_breaker=None):
+        """
+        Retries every queued operation, in rounds with jittered exponential backoff between them.
+        A handler succeeds by returning and fails by raising an exception.
+        Stops early and keeps the rest of the queue for the next run if the circuit breaker opens.
+
+        :param handlers: A dictionary of operation names to functions taking the operation's keyword arguments.
+        :type handlers: dict
+        :param circuit_breaker: The circuit breaker for the API the operations are sent to.
+        :type circuit_breaker: CircuitBreaker
+        :return: The number of operations that succeeded.
+        :rtype: int
+        """
+        succeeded = 0
+        round_number = 0
+        while True:
+            with self._lock:
+                pending = self._items
+                self._items = []
+            if not pending:
+                break
+
+            if round_number > 0:
+                # Full jitter: wait a random time up to the exponential backoff so retries don't line up.
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** round_number))
+                print(f"Retrying {len(pending)} failed operations in {delay:.1f}s...")
+                time.sleep(delay)
+
+            still_failing = []
+            for position, item in enumerate(pending):
+                if circuit_breaker is not None and not circuit_breaker.allow():
+                    # The API is down, so keep everything that's left for the next run.
+                    print(f"[{circuit_breaker.name}] Circuit open, keeping {len(pending) - position} operations for the next run.")
+                    still_failing.extend(pending[position:])
+                    with self._lock:
+                        self._items = still_failing + self._items
+                        self._save()
+                    return succeeded
+
+                handler = handlers.get(item['operation'])
+                if handler is None:
+                    with self._lock:
+                        self._write_dead_letter(dict(item, reason=f"No handler for operation {item['operation']}"))
+                    continue
+
+                try:
+                    handler(**item['args'])
+                except Exception as error:
+                    retryable = is_retryable_error(error)
+                    if circuit_breaker is not None:
+                        # Like a live write, only transient errors count towards opening the circuit.
+                        # Any other error means the API is up but rejected this request.
+                        if retryable:
+                            circuit_breaker.record_failure()
+                        else:
+                            circuit_breaker.record_success()
+                    item = dict(item, attempts=item['attempts'] + 1, reason=str(error))
+                    if not retryable or item['attempts'] >= self.max_attempts:
+                        with self._lock:
+                            self._write_dead_letter(item)
+                    else:
+                        still_failing.append(item)
+                else:
+                    if circuit_breaker is not None:
+                        circuit_breaker.record_success()
+                    succeeded += 1
+
+            with self._lock:
+                self._items = still_failing + self._items
+                self._save()
+            round_number += 1
+
+        if succeeded:
+            print(f"Retried {succeeded} failed operations successfully.")
+        return succeeded
+
+    def _save(self):
+        # Rewrite the queue file with what's left, at the end of each round of drain(). Callers must hold the lock.
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'w') as file:
+            for item in self._items:
+                file.write(json.dumps(item) + '\n')
+
+    def _append(self, item):
+        # Append a single operation to the queue file. Callers must hold the lock.
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(item) + '\n')
+
+    def _write_dead_letter(self, item):
+        # Append a failed operation to the dead-letter file. Callers must hold the lock.
+        directory = os.path.dirname(self.dead_letter_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        item = dict(item, dead_lettered_at=datetime.now(timezone.utc).isoformat())
+        with open(self.dead_letter_path, 'a') as file:
+            file.write(json.dumps(item) + '\n')
+        self.dead_letter_count += 1
+        message = f"Dead-lettered {item['operation']} after {item['attempts']} attempts: {item['reason']}"
+        print(message)
+        if self.alerts is not None:
+            self.alerts.alert(f"{item['operation']} failed", f"{message}\nSubscriber: {json.dumps(get_alert_arguments(item['args']))}")
+
+
+def get_alert_arguments(args):
+    """
+    Picks out the arguments that identify who an operation was for, so they can be sent in an alert email.
+
+    :param args: The operation's keyword arguments.
+    :type args: dict
+    :return: The email address and IDs in the arguments, including the email of a subscriber payload.
+    :rtype: dict
+    """
+    alert_arguments = {}
+    for name, value in args.items():
+        if isinstance(value, dict):
+            # Payloads like upsert_mailerlite_subscriber's subscriber only contribute their email address.
+            if isinstance(value.get('email'), str):
+                alert_arguments['email'] = value['email']
+        elif name in ALERT_ARGUMENT_NAMES:
+            alert_arguments[name] = value
+    return alert_arguments
@@ -0,0 +1,151 @@
+"""
+Runs the sync on a schedule from a single long-running process, instead of starting a new process from cron every time.
+
+Staying resident keeps the HubSpot clients, the HTTP connection pool, the tuned rate limit controllers and the cached
+HubSpot contacts warm between runs. Runs start every interval, give or take a random jitter so several
+instances don't all hit the APIs at the same moment. The jitter is applied to a fixed grid of start times, so it never
+adds up and runs don't drift. If a run is still going when the next one is due, that tick is skipped.
+
+Signals:
+- SIGTERM or SIGINT (Ctrl+C) stops the scheduler once the current run has finished.
+- SIGHUP reloads the settings before the next run. Windows doesn't have SIGHUP, so restart the process there instead.
+"""
+import random
+import signal
+import threading
+import time
+
+
+class SyncScheduler:
+    """
+    Calls a sync function every interval seconds from a background thread, never running two syncs at once.
+
+    Usage:
+        scheduler = SyncScheduler(run_sync, interval=3600, jitter=300, reload_function=reload_settings)
+        scheduler.run_forever()
+    """
+
+    def __init__(self, sync_function, interval, jitter=0, reload_function=None, run_immediately=True):
+        """
+        :param sync_function: The function to call for each run. Takes no arguments.
+        :param interval: The number of seconds between the start of each run.
+        :param jitter: The most a run's start time is moved earlier or later by, in seconds.
+        :param reload_function: The function to call before the next run after a SIGHUP. Takes no arguments.
+        :param run_immediately: Whether to start the first run straight away rather than after one interval.
+        """
+        self.sync_function = sync_function
+        self.interval = interval
+        self.jitter = jitter
+        self.reload_function = reload_function
+        self.run_immediately = run_immediately
+        self.completed_runs = 0
+        self.skipped_runs = 0
+        # Runs are due at start + ticks * interval, plus jitter.
+        self._start = None
+        self._ticks = 0
+        self._schedule_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reload_requested = threading.Event()
+        self._run_thread = None
+
+    @property
+    def is_running(self):
+        # Whether a sync is in progress right now.
+        return self._run_thread is not None and self._run_thread.is_alive()
+
+    def run_forever(self):
+        """
+        Runs the sync on schedule until stop() is called or a SIGTERM or SIGINT is received.
+        Must be called from the main thread so the signal handlers can be installed.
+        """
+        self._install_signal_handlers()
+        with self._schedule_lock:
+            self._start = time.monotonic()
+            self._ticks = 0
+        next_run = self._start if self.run_immediately else self._get_next_run()
+        print(f"Scheduler started, syncing every {self.interval}s (+/- {self.jitter}s).")
+
+        while not self._stop.is_set():
+            # Wait for the next run, waking up early if we're asked to stop.
+            if self._stop.wait(max(0.0, next_run - time.monotonic())):
+                break
+            # Schedule from the grid rather than from when this run started, so a slow run or the jitter
+            # doesn't push every later run back.
+            next_run = self._get_next_run()
+
+            if self.is_running:
+                self.skipped_runs += 1
+                print("The previous sync is still running, skipping this one.")
+                continue
+
+            self._run_thread = threading.Thread(target=self._run, name='scheduled-sync')
+            self._run_thread.start()
+
+        # Let the current run finish so nothing is left half written.
+        if self.is_running:
+            print("Waiting for the current sync to finish before stopping...")
+            self._run_thread.join()
+        print(f"Scheduler stopped after {self.completed_runs} runs ({self.skipped_runs} skipped).")
+
+    def stop(self):
+        """
+        Stops the scheduler once the current run has finished.
+        """
+        self._stop.set()
+
+    def set_schedule(self, interval, jitter=0):
+        """
+        Changes the interval and jitter, e.g. after the settings are reloaded.
+        Takes effect from the run after the next one, which has already been scheduled.
+
+        :param interval: The number of seconds between the start of each run.
+        :param jitter: The most a run's start time is moved earlier or later by, in seconds.
+        """
+        with self._schedule_lock:
+            if self._start is not None:
+                # Start a new grid from the last run that was scheduled, so the runs before it don't move.
+                self._start += self._ticks * self.interval
+                self._ticks = 0
+            self.interval = interval
+            self.jitter = jitter
+
+    def request_reload(self):
+        """
+        Reloads the settings before the next run.
+        """
+        self._reload_requested.set()
+
+    def _run(self):
+        if self._reload_requested.is_set() and self.reload_function is not None:
+            self._reload_requested.clear()
+            print("Reloading settings...")
+            try:
+                self.reload_function()
+            except Exception as e:
+                # Keep running with the settings we already have rather than stopping the daemon.
+                print(f"Failed to reload settings, keeping the current ones: {e}")
+        try:
+            self.sync_function()
+        except Exception as e:
+            print(f"Scheduled sync failed: {e}")
+        self.completed_runs += 1
+
+    def _get_next_run(self):
+        with self._schedule_lock:
+            self._ticks += 1
+            return self._start + self._ticks * self.interval + random.uniform(-self.jitter, self.jitter)
+
+    def _install_signal_handlers(self):
+        def handle_stop(signal_number, frame):
+            print(f"Received {signal.Signals(signal_number).name}, stopping after the current sync.")
+            self.stop()
+
+        def handle_reload(signal_number, frame):
+            print("Received SIGHUP, the settings will be reloaded before the next sync.")
+            self.request_reload()
+
+        signal.signal(signal.SIGTERM, handle_stop)
+        signal.signal(signal.SIGINT, handle_stop)
+        # SIGHUP doesn't exist on Windows.
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, handle_reload)
@@ -0,0 +1,325 @@
+"""
+Compact binary snapshots of HubSpot contacts and MailerLite subscribers.
+
+A snapshot stores each record as its own zlib-compressed JSON blob, prefixed with its length.
+Every record is compressed against a shared preset dictionary built from the first few records,
+so the repeated property names compress well even though each record can be read on its own.
+An email to offset index is written after the records so a single contact can be found by
+memory-mapping the file and binary searching the index, without loading the whole snapshot.
+
+File layout (all integers are little-endian):
+    header:  MAGIC (8 bytes) | u32 dictionary length | dictionary bytes
+    records: u32 compressed length | compressed record JSON, repeated once per record
+    keys:    UTF-8 email addresses, concatenated in sorted order
+    index:   (u64 key offset, u32 key length, u64 record offset), one entry per email, sorted by email
+    footer:  u64 record count | u64 keys offset | u64 index offset | u64 index count | MAGIC
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import zlib
+
+# Marker written at the start and end of every snapshot file.
+MAGIC = b"HMLSNAP1"
+# Struct layouts used in the file.
+LENGTH_STRUCT = struct.Struct("<I")
+INDEX_ENTRY_STRUCT = struct.Struct("<QIQ")
+FOOTER_STRUCT = struct.Struct("<QQQQ8s")
+# Number of records used to build the shared compression dictionary. zlib only uses the last 32KB.
+DICTIONARY_SAMPLE_RECORDS = 20
+DICTIONARY_MAX_BYTES = 32 * 1024
+
+
+def get_record_email(record):
+    """
+    Gets the email address used to index a record.
+    MailerLite subscribers keep the email at the top level while HubSpot contacts keep it in their properties.
+
+    :param record: A subscriber or contact as a dictionary.
+    :type record: dict
+    :return: The email address, or None if the record doesn't have one.
+    :rtype: str
+    """
+    email = record.get('email')
+    if email is None:
+        email = (record.get('properties') or {}).get('email')
+    return email
+
+
+def write_snapshot(records, path, cls=None, email_getter=get_record_email):
+    """
+    Writes a list of records to a binary snapshot file.
+
+    :param records: The records to save. Each record must be a dictionary that can be serialised to JSON.
+    :type records: list[dict]
+    :param path: The path of the snapshot file to write.
+    :type path: str
+    :param cls: An optional JSON encoder class, e.g. CustomJSONEncoder for records containing datetimes.
+    :type cls: type
+    :param email_getter: A function returning the email address used to index a record.
+    :return: The number of records written.
+    :rtype: int
+    """
+    encoder = (cls or json.JSONEncoder)(separators=(',', ':'))
+    # Serialise every record once up front so the dictionary can be sampled from the real data.
+    encoded_records = [encoder.encode(record).encode('utf-8') for record in records]
+    dictionary = b"".join(encoded_records[:DICTIONARY_SAMPLE_RECORDS])[-DICTIONARY_MAX_BYTES:]
+
+    # Create the output folder if the path includes one, e.g. output/.
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # Map each email to the offset of its record. Later records win, the same as building a dictionary by email.
+    offsets_by_email = {}
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(LENGTH_STRUCT.pack(len(dictionary)))
+        file.write(dictionary)
+
+        for record, encoded in zip(records, encoded_records):
+            compressor = zlib.compressobj(level=9, zdict=dictionary) if dictionary else zlib.compressobj(level=9)
+            compressed = compressor.compress(encoded) + compressor.flush()
+            email = email_getter(record)
+            if email is not None:
+                offsets_by_email[email] = file.tell()
+            file.write(LENGTH_STRUCT.pack(len(compressed)))
+            file.write(compressed)
+
+        # Write the sorted email keys followed by the fixed size index entries that point into them.
+        keys_offset = file.tell()
+        index_entries = []
+        key_offset = 0
+        for email in sorted(offsets_by_email):
+            key = email.encode('utf-8')
+            file.write(key)
+            index_entries.append(INDEX_ENTRY_STRUCT.pack(key_offset, len(key), offsets_by_email[email]))
+            key_offset += len(key)
+
+        index_offset = file.tell()
+        file.write(b"".join(index_entries))
+        file.write(FOOTER_STRUCT.pack(len(encoded_records), keys_offset, index_offset, len(index_entries), MAGIC))
+
+    return len(encoded_records)
+
+
+class SnapshotReader:
+    """
+    Reads a binary snapshot through a memory map.
+    Records are only decompressed when they are looked up or iterated over.
+
+    Usage:
+        with SnapshotReader('output/mailerliteSubscribers.snap') as snapshot:
+            subscriber = snapshot.get('someone@example.com')
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Check the file starts and ends with the snapshot marker before trusting any offsets.
+        if self._map[:len(MAGIC)] != MAGIC or len(self._map) < len(MAGIC) + LENGTH_STRUCT.size + FOOTER_STRUCT.size:
+            self.close()
+            raise ValueError(f"{path} is not a snapshot file.")
+        (self.record_count, self._keys_offset, self._index_offset,
+         self._index_count, end_magic) = FOOTER_STRUCT.unpack_from(self._map, len(self._map) - FOOTER_STRUCT.size)
+        if end_magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is truncated or corrupted.")
+
+        (dictionary_length,) = LENGTH_STRUCT.unpack_from(self._map, len(MAGIC))
+        self._dictionary_start = len(MAGIC) + LENGTH_STRUCT.size
+        self._records_start = self._dictionary_start + dictionary_length
+        self._dictionary = bytes(self._map[self._dictionary_start:self._records_start])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Closes the memory map and the underlying file.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return self.record_count
+
+    def _read_record(self, offset):
+        # Read the length prefix, then decompress the record that follows it.
+        (length,) = LENGTH_STRUCT.unpack_from(self._map, offset)
+        start = offset + LENGTH_STRUCT.size
+        decompressor = zlib.decompressobj(zdict=self._dictionary) if self._dictionary else zlib.decompressobj()
+        data = decompressor.decompress(self._map[start:start + length]) + decompressor.flush()
+        return json.loads(data), start + length
+
+    def _read_key(self, position):
+        key_offset, key_length, record_offset = INDEX_ENTRY_STRUCT.unpack_from(
+            self._map, self._index_offset + position * INDEX_ENTRY_STRUCT.size)
+        start = self._keys_offset + key_offset
+        return self._map[start:start + key_length], record_offset
+
+    def _find(self, email):
+        # Binary search the sorted index for the email's record offset.
+        key = email.encode('utf-8')
+        low, high = 0, self._index_count
+        while low < high:
+            middle = (low + high) // 2
+            middle_key, record_offset = self._read_key(middle)
+            if middle_key < key:
+                low = middle + 1
+            elif middle_key > key:
+                high = middle
+            else:
+                return record_offset
+        return None
+
+    def __contains__(self, email):
+        return self._find(email) is not None
+
+    def get(self, email, default=None):
+        """
+        Looks up a single record by email address.
+
+        :param email: The email address to find.
+        :type email: str
+        :param default: The value to return if the email isn't in the snapshot.
+        :return: The record as a dictionary, or the default.
+        """
+        record_offset = self._find(email)
+        if record_offset is None:
+            return default
+        record, _ = self._read_record(record_offset)
+        return record
+
+    def emails(self):
+        """
+        Yields every indexed email address in sorted order without decompressing any records.
+        """
+        for position in range(self._index_count):
+            key, _ = self._read_key(position)
+            yield key.decode('utf-8')
+
+    def __iter__(self):
+        # Scan the records in the order they were written.
+        offset = self._records_start
+        while offset < self._keys_offset:
+            record, offset = self._read_record(offset)
+            yield record
+
+    def items(self):
+        """
+        Yields (email, record) pairs in sorted email order.
+        """
+        for position in range(self._index_count):
+            key, record_offset = self._read_key(position)
+            record, _ = self._read_record(record_offset)
+            yield key.decode('utf-8'), record
+
+
+def diff_snapshots(old_path, new_path):
+    """
+    Compares two snapshots by email, e.g. the subscribers saved by yesterday's run and today's.
+    Both indexes are sorted, so they are walked side by side and only one record from each file is decompressed at a time.
+
+    :param old_path: The earlier snapshot.
+    :type old_path: str
+    :param new_path: The later snapshot.
+    :type new_path: str
+    :return: Yields (change, email, old record, new record) tuples, where change is 'added', 'removed' or 'changed'.
+             The old record is None for added emails and the new record is None for removed emails.
+    """
+    with SnapshotReader(old_path) as old_snapshot, SnapshotReader(new_path) as new_snapshot:
+        old_items = old_snapshot.items()
+        new_items = new_snapshot.items()
+        old_item = next(old_items, None)
+        new_item = next(new_items, None)
+        while old_item is not None or new_item is not None:
+            if new_item is None or (old_item is not None and old_item[0] < new_item[0]):
+                yield 'removed', old_item[0], old_item[1], None
+                old_item = next(old_items, None)
+            elif old_item is None or new_item[0] < old_item[0]:
+                yield 'added', new_item[0], None, new_item[1]
+                new_item = next(new_items, None)
+            else:
+                if old_item[1] != new_item[1]:
+                    yield 'changed', old_item[0], old_item[1], new_item[1]
+                old_item = next(old_items, None)
+                new_item = next(new_items, None)
+
+
+def json_to_snapshot(json_path, snapshot_path):
+    """
+    Converts one of the JSON outputs into a snapshot.
+    Accepts either a list of records or a dictionary of records keyed by email.
+
+    :param json_path: The JSON file to read.
+    :param snapshot_path: The snapshot file to write.
+    :return: The number of records written.
+    :rtype: int
+    """
+    with open(json_path, 'r') as file:
+        data = json.load(file)
+    records = list(data.values()) if isinstance(data, dict) else data
+    return write_snapshot(records, snapshot_path)
+
+
+def snapshot_to_json(snapshot_path, json_path, indent=4):
+    """
+    Converts a snapshot back into the pretty-printed JSON list format.
+
+    :param snapshot_path: The snapshot file to read.
+    :param json_path: The JSON file to write.
+    :param indent: The indentation to use, or None for compact JSON.
+    :return: The number of records written.
+    :rtype: int
+    """
+    with SnapshotReader(snapshot_path) as snapshot:
+        records = list(snapshot)
+    with open(json_path, 'w') as file:
+        json.dump(records, file, indent=indent)
+    return len(records)
+
+
+if __name__ == '__main__':
+    # Command line tools for converting and inspecting snapshots, e.g.
+    # python -m src.snapshotFunctions to-json output/mailerliteSubscribers.snap output/mailerliteSubscribers.json
+    parser = argparse.ArgumentParser(description="Convert and inspect HubSpot/MailerLite snapshot files.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    to_snapshot_parser = subparsers.add_parser('to-snapshot', help="Convert a JSON output into a snapshot.")
+    to_snapshot_parser.add_argument('json_path')
+    to_snapshot_parser.add_argument('snapshot_path')
+    to_json_parser = subparsers.add_parser('to-json', help="Convert a snapshot into a JSON output.")
+    to_json_parser.add_argument('snapshot_path')
+    to_json_parser.add_argument('json_path')
+    get_parser = subparsers.add_parser('get', help="Print the record for an email address.")
+    get_parser.add_argument('snapshot_path')
+    get_parser.add_argument('email')
+    diff_parser = subparsers.add_parser('diff', help="List the emails added, removed or changed between two snapshots.")
+    diff_parser.add_argument('old_snapshot_path')
+    diff_parser.add_argument('new_snapshot_path')
+    args = parser.parse_args()
+
+    if args.command == 'to-snapshot':
+        print(f"Wrote {json_to_snapshot(args.json_path, args.snapshot_path)} records to {args.snapshot_path}")
+    elif args.command == 'to-json':
+        print(f"Wrote {snapshot_to_json(args.snapshot_path, args.json_path)} records to {args.json_path}")
+    elif args.command == 'get':
+        with SnapshotReader(args.snapshot_path) as snapshot_reader:
+            print(json.dumps(snapshot_reader.get(args.email), indent=4))
+    elif args.command == 'diff':
+        counts = {'added': 0, 'removed': 0, 'changed': 0}
+        for change, changed_email, _, _ in diff_snapshots(args.old_snapshot_path, args.new_snapshot_path):
+            counts[change] += 1
+            print(f"{change:<8} {changed_email}")
+        print(f"{counts['added']} added, {counts['removed']} removed, {counts['changed']} changed")
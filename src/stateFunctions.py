@@ -0,0 +1,39 @@
+import json
+import os
+
+# Default location of the state saved between runs, e.g. checkpoints for incremental syncs.
+SYNC_STATE_PATH = 'output/syncState.json'
+
+
+def load_state(path=SYNC_STATE_PATH):
+    """
+    Loads the state saved by the previous run.
+
+    :param path: The JSON file the state is saved in.
+    :type path: str
+    :return: The saved state, or an empty dictionary if there isn't one yet.
+    :rtype: dict
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_state(state, path=SYNC_STATE_PATH):
+    """
+    Saves the state for the next run.
+    The state is written to a temporary file first so a crash mid-write can't corrupt the saved checkpoints.
+
+    :param state: The state to save. Must be JSON serialisable.
+    :type state: dict
+    :param path: The JSON file to save the state in.
+    :type path: str
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as file:
+        json.dump(state, file, indent=4)
+    os.replace(temporary_path, path)
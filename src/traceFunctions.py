@@ -0,0 +1,144 @@
+"""
+Lightweight span tracing for sync runs.
+
+Wrap a stage or API call in span() to record how long it took. Spans opened inside another span on the same
+thread are recorded as its children. The trace is written in the Chrome trace event format, so it can be opened
+in chrome://tracing or https://ui.perfetto.dev, where each thread gets its own track.
+
+Usage:
+    with span("get_all_data", account="brand_a"):
+        ...
+    write_trace("output/trace.json")
+"""
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+# Stop recording new spans past this many, so a long-running process can't grow without limit between writes.
+MAX_EVENTS = 1_000_000
+
+_events = []
+_thread_names = {}
+_events_lock = threading.Lock()
+_span_ids = itertools.count(1)
+_local = threading.local()
+_enabled = True
+
+
+def enable_tracing(enabled=True):
+    """
+    Turns span recording on or off. Spans cost almost nothing while tracing is off.
+
+    :param enabled: Whether to record spans.
+    :type enabled: bool
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def span(name, **args):
+    """
+    Records the time spent inside a with block as a span, as a child of the span already open on this thread.
+    Any keyword arguments are saved with the span, e.g. span("mailerlite:get_page", status="active").
+
+    :param name: The span name. The part before the first colon is used as its category.
+    :type name: str
+    :return: A context manager for the span.
+    """
+    return _Span(name, args)
+
+
+class _Span:
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        if not _enabled:
+            return self
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.span_id = next(_span_ids)
+        self.parent_id = stack[-1] if stack else None
+        stack.append(self.span_id)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not _enabled or not hasattr(self, 'start'):
+            return False
+        duration = time.perf_counter_ns() - self.start
+        _local.stack.pop()
+
+        args = dict(self.args, span_id=self.span_id, parent_id=self.parent_id)
+        if exc_type is not None:
+            args['error'] = repr(exc_value)
+        event = {
+            'name': self.name,
+            'cat': self.name.split(':', 1)[0],
+            'ph': 'X',
+            # The trace format uses microseconds.
+            'ts': self.start / 1000,
+            'dur': duration / 1000,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+        with _events_lock:
+            if len(_events) < MAX_EVENTS:
+                _events.append(event)
+                _thread_names[event['tid']] = threading.current_thread().name
+        # Never swallow the exception.
+        return False
+
+
+def traced(name=None):
+    """
+    Decorator that records every call to a function as a span.
+
+    :param name: The span name. Defaults to the function's name.
+    :type name: str
+    """
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write_trace(path='output/trace.json'):
+    """
+    Writes every span recorded so far to a trace file and clears them, ready for the next run.
+
+    :param path: The JSON file to write.
+    :type path: str
+    :return: The number of spans written.
+    :rtype: int
+    """
+    with _events_lock:
+        events = list(_events)
+        thread_names = dict(_thread_names)
+        _events.clear()
+        _thread_names.clear()
+
+    # Name each thread's track after the thread, e.g. sync_0 or mailerlite-scan_2.
+    metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread_id,
+                 'args': {'name': thread_names.get(thread_id, str(thread_id))}}
+                for thread_id in {event['tid'] for event in events}]
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, file)
+    print(f"Wrote {len(events)} spans to {path}")
+    return len(events)
@@ -0,0 +1,105 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from src import coalesceFunctions
+from src.coalesceFunctions import RequestCoalescer, get_coalescer, reset_coalescers
+
+
+class RequestCoalescerTests(unittest.TestCase):
+    def test_concurrent_lookups_share_batches_and_in_flight_requests(self):
+        batches = []
+        first_batch_started = threading.Event()
+        release_first_batch = threading.Event()
+
+        def batch_function(keys):
+            batches.append(sorted(keys))
+            if len(batches) == 1:
+                first_batch_started.set()
+                release_first_batch.wait(5)
+            return {key: key.upper() for key in keys}
+
+        coalescer = RequestCoalescer('test', batch_function, window=0.3)
+        results = {}
+
+        def look_up(name, key):
+            results[name] = coalescer.get(key)
+
+        # The first caller is on its own, so it sends straight away and is still waiting for its answer below.
+        first = threading.Thread(target=look_up, args=('first', 'a'))
+        first.start()
+        self.assertTrue(first_batch_started.wait(5))
+        # These arrive together, so 'b' and 'c' share one batch and the second 'a' waits for the request already sent.
+        others = [threading.Thread(target=look_up, args=(name, key)) for name, key in (('b', 'b'), ('c', 'c'), ('a_again', 'a'))]
+        for thread in others:
+            thread.start()
+        time.sleep(0.05)
+        release_first_batch.set()
+        for thread in [first] + others:
+            thread.join(5)
+
+        self.assertEqual(batches, [['a'], ['b', 'c']])
+        self.assertEqual(results, {'first': 'A', 'b': 'B', 'c': 'C', 'a_again': 'A'})
+        summary = coalescer.summary()
+        self.assertEqual((summary['calls'], summary['requests'], summary['joined']), (4, 2, 1))
+
+    def test_lookups_one_after_another_do_not_wait_for_the_window(self):
+        coalescer = RequestCoalescer('test', lambda keys: {key: key for key in keys}, window=1.0)
+        start = time.monotonic()
+        self.assertEqual([coalescer.get('a'), coalescer.get('b')], ['a', 'b'])
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_recent_results_are_reused(self):
+        batch_function = mock.Mock(side_effect=lambda keys: {key: key for key in keys})
+        coalescer = RequestCoalescer('test', batch_function)
+        coalescer.get('a')
+        coalescer.get('a')
+        self.assertEqual(batch_function.call_count, 1)
+        self.assertEqual(coalescer.summary()['cache_hits'], 1)
+
+    def test_every_caller_gets_the_batch_error(self):
+        batch_started = threading.Event()
+        release_batch = threading.Event()
+
+        def batch_function(keys):
+            batch_started.set()
+            release_batch.wait(5)
+            raise RuntimeError("The API is down")
+
+        coalescer = RequestCoalescer('test', batch_function)
+        errors = []
+
+        def look_up():
+            try:
+                coalescer.get('a')
+            except RuntimeError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=look_up) for _ in range(2)]
+        threads[0].start()
+        self.assertTrue(batch_started.wait(5))
+        threads[1].start()
+        time.sleep(0.05)
+        release_batch.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(errors), 2)
+
+    def test_a_batch_function_returning_the_wrong_type_fails_the_callers(self):
+        coalescer = RequestCoalescer('test', lambda keys: list(keys))
+        with self.assertRaises(TypeError):
+            coalescer.get('a')
+        # Nothing is left in flight, so the next lookup sends its own request rather than waiting forever.
+        self.assertFalse(coalescer._in_flight)
+
+    def test_reset_drops_the_coalescers(self):
+        with mock.patch.object(coalesceFunctions, '_coalescers', {}):
+            coalescer = get_coalescer('test', lambda keys: {})
+            self.assertIs(get_coalescer('test', lambda keys: {}), coalescer)
+            reset_coalescers()
+            self.assertIsNot(get_coalescer('test', lambda keys: {}), coalescer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import unittest
+from unittest import mock
+
+from src import emailFunctions
+from src.emailFunctions import AlertDispatcher, get_smtp_settings
+
+
+class SmtpSettingsTests(unittest.TestCase):
+    def test_bad_port_falls_back_to_the_default(self):
+        with mock.patch.dict(os.environ, {'SMTP_PORT': 'not-a-port'}):
+            self.assertEqual(get_smtp_settings()['smtp_port'], 587)
+
+    def test_reads_the_port(self):
+        with mock.patch.dict(os.environ, {'SMTP_PORT': '1025'}):
+            self.assertEqual(get_smtp_settings()['smtp_port'], 1025)
+
+
+class AlertDispatcherTests(unittest.TestCase):
+    def test_sends_one_digest_when_closed(self):
+        server = mock.Mock()
+        settings = dict(get_smtp_settings(), from_email='sync@example.com')
+        with mock.patch.object(emailFunctions, '_connect', return_value=server) as connect:
+            alerts = AlertDispatcher(to_email='ops@example.com', settings=settings)
+            alerts.alert("First", "Something failed")
+            alerts.alert("Second", "Something else failed")
+            alerts.close()
+        connect.assert_called_once()
+        server.sendmail.assert_called_once()
+        message = server.sendmail.call_args[0][2]
+        self.assertIn("First", message)
+        self.assertIn("Second", message)
+        self.assertEqual(alerts.sent_digests, 1)
+
+    def test_drops_alerts_after_closing(self):
+        with mock.patch.object(emailFunctions, '_connect') as connect:
+            alerts = AlertDispatcher(to_email='ops@example.com', settings=get_smtp_settings())
+            alerts.close()
+            alerts.alert("Late", "Too late")
+        connect.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from datetime import datetime, timezone
+
+from src.engagementFunctions import LAST_ACTIVITY_PROPERTY, diff_engagement_stats
+
+DETECTED_AT = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+
+def make_subscriber(contact_id, opens=0, clicks=0, open_rate=0.0, click_rate=0.0):
+    return {'fields': {'hs_object_id': contact_id}, 'opens_count': opens, 'clicks_count': clicks,
+            'open_rate': open_rate, 'click_rate': click_rate}
+
+
+def make_record(contact_id, opens=0, clicks=0, open_rate=0.0, click_rate=0.0, last_activity=None):
+    stats = {'opens_count': opens, 'clicks_count': clicks, 'open_rate': open_rate, 'click_rate': click_rate}
+    return {'contact_id': contact_id, 'stats': stats, 'last_activity': last_activity}
+
+
+class DiffEngagementStatsTests(unittest.TestCase):
+    def test_unchanged_stats_are_skipped(self):
+        updates, records = diff_engagement_stats([make_subscriber('1', opens=2)], {'1': make_record('1', opens=2)}, DETECTED_AT)
+        self.assertEqual((updates, records), ({}, {}))
+
+    def test_new_contacts_are_pushed_without_a_last_activity(self):
+        updates, records = diff_engagement_stats([make_subscriber('1', opens=2, open_rate=0.5)], {}, DETECTED_AT)
+        self.assertEqual(updates['1']['mailerlite_opens_count'], '2')
+        self.assertEqual(updates['1']['mailerlite_open_rate'], '0.5')
+        self.assertNotIn(LAST_ACTIVITY_PROPERTY, updates['1'])
+        self.assertIsNone(records['1']['last_activity'])
+
+    def test_more_opens_or_clicks_set_the_last_activity(self):
+        pushed = {'1': make_record('1', opens=2), '2': make_record('2', opens=2, last_activity='2024-01-01T00:00:00+00:00')}
+        subscribers = [make_subscriber('1', opens=2, clicks=1), make_subscriber('2', opens=2, open_rate=0.4)]
+        updates, records = diff_engagement_stats(subscribers, pushed, DETECTED_AT)
+        self.assertEqual(updates['1'][LAST_ACTIVITY_PROPERTY], DETECTED_AT.isoformat())
+        # Only the rate changed, so the previous last activity is kept.
+        self.assertEqual(updates['2'][LAST_ACTIVITY_PROPERTY], '2024-01-01T00:00:00+00:00')
+        self.assertEqual(records['1']['stats']['clicks_count'], 1)
+
+    def test_missing_stats_clear_the_property_and_unlinked_subscribers_are_skipped(self):
+        subscriber = make_subscriber('1')
+        subscriber['open_rate'] = None
+        updates, records = diff_engagement_stats([subscriber, {'fields': {}, 'opens_count': 3}], {}, DETECTED_AT)
+        self.assertEqual(list(updates), ['1'])
+        self.assertEqual(updates['1']['mailerlite_open_rate'], '')
+
+
+if __name__ == '__main__':
+    unittest.main()
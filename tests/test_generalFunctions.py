@@ -0,0 +1,127 @@
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest import mock
+
+from src import generalFunctions
+
+
+def _contact(number):
+    return SimpleNamespace(id=str(number), properties={'email': f"person{number}@example.com", 'firstname': f"Person {number}"})
+
+
+class ProcessAllDataTests(unittest.TestCase):
+    def setUp(self):
+        self.contacts = [_contact(number) for number in range(4)]
+        # Every other contact is already a subscriber.
+        self.subscribers = {f"person{number}@example.com": {'id': f"sub{number}"} for number in (0, 2)}
+
+    def test_payloads_follow_the_contacts(self):
+        payloads = generalFunctions.build_subscriber_payloads(self.contacts, self.subscribers, {'1': {'products_bought': 'Widget'}})
+        self.assertEqual([(email, subscriber_id) for email, subscriber_id, _ in payloads],
+                         [('person0@example.com', 'sub0'), ('person1@example.com', None),
+                          ('person2@example.com', 'sub2'), ('person3@example.com', None)])
+
+        _, _, create_payload = list(generalFunctions.build_subscriber_payloads(self.contacts[1:2], {}, {'1': {'products_bought': 'Widget'}}))[0]
+        self.assertEqual(create_payload['email'], 'person1@example.com')
+        self.assertEqual(create_payload['fields']['firstname'], 'Person 1')
+        self.assertEqual(create_payload['fields']['products_bought'], 'Widget')
+
+    def test_writes_each_contact_as_its_payload_is_built(self):
+        writes = []
+        built = []
+        build_subscriber_fields = generalFunctions.build_subscriber_fields
+
+        def build_fields(contact, purchase_fields=None):
+            built.append(contact.id)
+            return build_subscriber_fields(contact, purchase_fields)
+
+        def update(api_key, subscriber_id, payload, retry_queue=None):
+            writes.append(('update', subscriber_id, list(built)))
+            return {}
+
+        def create(api_key, email, payload, retry_queue=None):
+            writes.append(('create', email, list(built)))
+            return {}
+
+        with mock.patch.object(generalFunctions, 'build_subscriber_fields', side_effect=build_fields), \
+                mock.patch.object(generalFunctions, 'update_mailerlite_subscriber', side_effect=update), \
+                mock.patch.object(generalFunctions, 'create_mailerlite_subscriber', side_effect=create):
+            written = generalFunctions.process_all_data(self.contacts, self.subscribers, 'key')
+
+        self.assertEqual(written, 4)
+        self.assertEqual(writes, [('update', 'sub0', ['0']), ('create', 'person1@example.com', ['0', '1']),
+                                  ('update', 'sub2', ['0', '1', '2']), ('create', 'person3@example.com', ['0', '1', '2', '3'])])
+
+    def test_batch_mode_upserts_in_chunks(self):
+        contacts = [_contact(number) for number in range(generalFunctions.MAILERLITE_BATCH_LIMIT + 5)]
+        with mock.patch.object(generalFunctions, 'upsert_mailerlite_subscribers',
+                               side_effect=lambda api_key, subscribers, retry_queue=None: len(subscribers)) as upsert:
+            written = generalFunctions.process_all_data(contacts, self.subscribers, 'key', batch=True)
+        self.assertEqual(written, len(contacts))
+        self.assertEqual([len(call[0][1]) for call in upsert.call_args_list], [generalFunctions.MAILERLITE_BATCH_LIMIT, 5])
+        self.assertTrue(all('email' in subscriber for call in upsert.call_args_list for subscriber in call[0][1]))
+
+
+
+class PropagateArchivedContactsTests(unittest.TestCase):
+    def test_first_run_only_sets_the_checkpoint(self):
+        state = {}
+        with mock.patch.object(generalFunctions, 'get_archived_hubspot_contacts') as get_archived:
+            removed = generalFunctions.propagate_archived_contacts(object(), 'key', {}, state)
+        self.assertEqual(removed, 0)
+        get_archived.assert_not_called()
+        self.assertIn('archived_contacts_checkpoint', state)
+
+    def test_unsubscribes_contacts_archived_since_the_checkpoint(self):
+        archived_at = datetime(2024, 6, 1, tzinfo=timezone.utc)
+        archived = [SimpleNamespace(properties={'email': 'gone@example.com'}, archived_at=archived_at)]
+        subscribers = {'gone@example.com': {'id': 'sub-gone', 'status': 'active'}}
+        state = {'archived_contacts_checkpoint': '2024-05-01T00:00:00+00:00'}
+        with mock.patch.object(generalFunctions, 'get_archived_hubspot_contacts', return_value=archived), \
+                mock.patch.object(generalFunctions, 'unsubscribe_mailerlite_subscribers', return_value=1) as unsubscribe:
+            removed = generalFunctions.propagate_archived_contacts(object(), 'key', subscribers, state)
+        self.assertEqual(removed, 1)
+        self.assertEqual(unsubscribe.call_args[0][1], [subscribers['gone@example.com']])
+        self.assertEqual(state['archived_contacts_checkpoint'], archived_at.isoformat())
+
+
+
+class HubSpotClientTests(unittest.TestCase):
+    def test_each_api_is_built_once_and_asks_for_gzip(self):
+        with mock.patch.object(generalFunctions, 'HubSpot') as hubspot, \
+                mock.patch.object(generalFunctions.DiscoveryBase, '_default_api_factory', side_effect=lambda *args: mock.Mock()) as build:
+            generalFunctions.create_hubspot_client('token')
+            api_factory = hubspot.call_args[1]['api_factory']
+            package = SimpleNamespace(__name__='hubspot.crm.contacts')
+            api = api_factory(package, 'BasicApi', {'access_token': 'token'})
+            self.assertIs(api_factory(package, 'BasicApi', {'access_token': 'token'}), api)
+            self.assertIsNot(api_factory(package, 'BatchApi', {'access_token': 'token'}), api)
+        self.assertEqual(build.call_count, 2)
+        api.api_client.set_default_header.assert_called_once_with('Accept-Encoding', 'gzip')
+
+
+class ContactCacheTests(unittest.TestCase):
+    def test_incremental_runs_update_changed_contacts_and_drop_archived_ones(self):
+        contact_cache = {'checkpoint': '2024-05-01T00:00:00+00:00',
+                         'contacts': {'1': _contact(1), '2': _contact(2), '3': _contact(3)}}
+        changed = _contact(2)
+        with mock.patch.object(generalFunctions, 'search_hubspot_contacts_modified_since', return_value=[changed]), \
+                mock.patch.object(generalFunctions, 'get_archived_hubspot_contacts', return_value=[_contact(3)]), \
+                mock.patch.object(generalFunctions, 'get_all_hubspot_contacts') as get_all:
+            contacts = generalFunctions.get_cached_hubspot_contacts(object(), ['email'], contact_cache)
+        get_all.assert_not_called()
+        self.assertEqual([contact.id for contact in contacts], ['1', '2'])
+        self.assertIs(contact_cache['contacts']['2'], changed)
+
+    def test_a_failed_archived_read_fetches_every_contact(self):
+        contact_cache = {'checkpoint': '2024-05-01T00:00:00+00:00', 'contacts': {'1': _contact(1)}}
+        with mock.patch.object(generalFunctions, 'search_hubspot_contacts_modified_since', return_value=[]), \
+                mock.patch.object(generalFunctions, 'get_archived_hubspot_contacts', return_value=None), \
+                mock.patch.object(generalFunctions, 'get_all_hubspot_contacts', return_value=[_contact(4)]):
+            contacts = generalFunctions.get_cached_hubspot_contacts(object(), ['email'], contact_cache)
+        self.assertEqual([contact.id for contact in contacts], ['4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
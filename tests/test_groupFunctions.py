@@ -0,0 +1,49 @@
+import unittest
+from types import SimpleNamespace
+
+from src.groupFunctions import diff_group_memberships, get_group_names, is_managed_group
+
+
+def make_contact(email, **properties):
+    return SimpleNamespace(properties=dict(properties, email=email))
+
+
+class GroupNameTests(unittest.TestCase):
+    def test_each_property_value_gets_a_group(self):
+        contact = make_contact('a@example.com', lifecyclestage='customer', hs_persona='persona_1; persona_2;')
+        self.assertEqual(get_group_names(contact),
+                         {'Lifecycle stage: customer', 'Persona: persona_1', 'Persona: persona_2'})
+
+    def test_empty_properties_have_no_groups(self):
+        self.assertEqual(get_group_names(make_contact('a@example.com', lifecyclestage='', hs_persona=None)), set())
+
+    def test_only_prefixed_groups_are_managed(self):
+        self.assertTrue(is_managed_group('Persona: persona_1'))
+        self.assertFalse(is_managed_group('Newsletter'))
+
+
+class DiffGroupMembershipsTests(unittest.TestCase):
+    def setUp(self):
+        self.group_ids_by_name = {'Lifecycle stage: lead': '1', 'Lifecycle stage: customer': '2', 'Persona: persona_1': '3'}
+
+    def test_adds_missing_and_removes_stale_memberships(self):
+        contacts = [make_contact('a@example.com', lifecyclestage='customer', hs_persona='persona_1')]
+        subscribers = {'a@example.com': {'id': 'sub-a', 'groups': [{'id': 1}, {'id': 3}]}}
+        assignments, unassignments = diff_group_memberships(contacts, subscribers, self.group_ids_by_name)
+        self.assertEqual(assignments, [('sub-a', '2')])
+        self.assertEqual(unassignments, [('sub-a', '1')])
+
+    def test_groups_not_managed_by_the_sync_are_left_alone(self):
+        contacts = [make_contact('a@example.com', lifecyclestage='lead')]
+        subscribers = {'a@example.com': {'id': 'sub-a', 'groups': [{'id': 1}, {'id': 99}]}}
+        self.assertEqual(diff_group_memberships(contacts, subscribers, self.group_ids_by_name), ([], []))
+
+    def test_contacts_without_a_subscriber_or_group_are_skipped(self):
+        contacts = [make_contact('new@example.com', lifecyclestage='lead'),
+                    make_contact('a@example.com', lifecyclestage='evangelist')]
+        subscribers = {'a@example.com': {'id': 'sub-a', 'groups': None}}
+        self.assertEqual(diff_group_memberships(contacts, subscribers, self.group_ids_by_name), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
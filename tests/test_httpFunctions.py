@@ -0,0 +1,73 @@
+import gzip
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from src import httpFunctions
+
+URL = 'https://connect.mailerlite.com/api/batch'
+BODY = {'requests': [{'method': 'GET', 'path': 'api/subscribers/' + 'x' * 2000}]}
+
+
+def make_response(status_code, text=''):
+    return SimpleNamespace(status_code=status_code, text=text, content=text.encode('utf-8'), raw=None)
+
+
+class GzipFallbackTests(unittest.TestCase):
+    def setUp(self):
+        patches = [mock.patch.object(httpFunctions, '_gzip_rejected_hosts', set()),
+                   mock.patch.object(httpFunctions, '_transfer_stats', {}),
+                   mock.patch.dict(os.environ, {'HTTP_GZIP_REQUESTS': 'true', 'HTTP_GZIP_MIN_BYTES': '1024'})]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def send(self, *responses):
+        session = mock.Mock()
+        session.request.side_effect = responses
+        with mock.patch.object(httpFunctions, 'get_session', return_value=session):
+            response = httpFunctions.send_request('POST', URL, json_body=BODY)
+        return response, session.request.call_args_list
+
+    def test_large_bodies_are_gzipped(self):
+        response, calls = self.send(make_response(200))
+        self.assertEqual(calls[0][1]['headers']['Content-Encoding'], 'gzip')
+        self.assertIn(b'subscribers', gzip.decompress(calls[0][1]['data']))
+
+    def test_requests_have_a_timeout(self):
+        response, calls = self.send(make_response(200))
+        self.assertEqual(calls[0][1]['timeout'], httpFunctions.DEFAULT_TIMEOUT)
+
+    def test_a_415_is_retried_uncompressed_and_turns_compression_off(self):
+        response, calls = self.send(make_response(415), make_response(200))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', calls[1][1]['headers'])
+        self.assertIn('connect.mailerlite.com', httpFunctions._gzip_rejected_hosts)
+
+    def test_a_plain_400_is_not_retried(self):
+        response, calls = self.send(make_response(400, '{"message": "The email must be a valid email address."}'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(httpFunctions._gzip_rejected_hosts)
+
+    def test_compression_stays_on_if_the_uncompressed_retry_also_fails(self):
+        response, calls = self.send(make_response(400, 'Unsupported content encoding'), make_response(400, 'Bad request'))
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(httpFunctions._gzip_rejected_hosts)
+
+    def test_bad_minimum_size_falls_back_to_the_default(self):
+        with mock.patch.dict(os.environ, {'HTTP_GZIP_MIN_BYTES': 'lots'}):
+            self.assertEqual(httpFunctions._get_gzip_settings(), (True, httpFunctions.DEFAULT_GZIP_MIN_BYTES))
+        with mock.patch.dict(os.environ, {'HTTP_GZIP_MIN_BYTES': '10'}):
+            self.assertEqual(httpFunctions._get_gzip_settings(), (True, 10))
+
+    def test_reset_clears_the_byte_counts(self):
+        self.send(make_response(200))
+        self.assertEqual(httpFunctions.get_transfer_stats()['connect.mailerlite.com']['requests'], 1)
+        httpFunctions.reset_transfer_stats()
+        self.assertEqual(httpFunctions.get_transfer_stats(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
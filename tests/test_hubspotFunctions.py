@@ -0,0 +1,212 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
+
+from src import coalesceFunctions, hubspotFunctions
+from src.rateControlFunctions import AdaptiveController
+
+
+def _model(**kwargs):
+    # Stands in for the SDK's request models, which just hold their keyword arguments.
+    return SimpleNamespace(**kwargs)
+
+
+SEARCH_MODELS = (_model, _model, _model)
+
+
+class FakeSearchApi:
+    # Filters, sorts and pages a list of objects like the HubSpot search API, including refusing to go past its result limit.
+    def __init__(self, objects, result_limit):
+        self.objects = objects
+        self.result_limit = result_limit
+        self.requests = 0
+
+    @staticmethod
+    def _value(result, property_name):
+        if property_name == 'hs_object_id':
+            return int(result.id)
+        return int(result.updated_at.timestamp() * 1000)
+
+    def _matches(self, result, search_filter):
+        value = self._value(result, search_filter.property_name)
+        expected = int(search_filter.value)
+        return {'GT': value > expected, 'GTE': value >= expected, 'EQ': value == expected}[search_filter.operator]
+
+    def do_search(self, request):
+        self.requests += 1
+        if self.requests > 100:
+            raise AssertionError("The search never finished.")
+        matches = [result for result in self.objects
+                   if any(all(self._matches(result, search_filter) for search_filter in group.filters)
+                          for group in request.filter_groups)]
+        matches.sort(key=lambda result: self._value(result, request.sorts[0]['propertyName']))
+        start = int(request.after or 0)
+        if start + request.limit > self.result_limit:
+            raise AssertionError("Searched past the result limit.")
+        end = start + request.limit
+        paging = SimpleNamespace(next=SimpleNamespace(after=str(end))) if end < len(matches) else None
+        return SimpleNamespace(results=matches[start:end], paging=paging)
+
+
+class SearchModifiedSinceTests(unittest.TestCase):
+    def setUp(self):
+        controller = AdaptiveController('test_search', page_size=5, min_page_size=5, max_page_size=5)
+        patches = [mock.patch.object(hubspotFunctions, 'get_controller', return_value=controller),
+                   mock.patch.object(hubspotFunctions, 'SEARCH_RESULT_LIMIT', 20)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def _object(self, object_id, minutes):
+        return SimpleNamespace(id=str(object_id), updated_at=self.since + timedelta(minutes=minutes), properties={})
+
+    def _search(self, objects):
+        return hubspotFunctions._search_modified_since(FakeSearchApi(objects, 20), SEARCH_MODELS, 'lastmodifieddate',
+                                                       self.since, ['email'])
+
+    def test_restarts_past_the_result_limit(self):
+        objects = [self._object(number, number) for number in range(1, 48)]
+        self.assertEqual(sorted(int(result.id) for result in self._search(objects)), list(range(1, 48)))
+
+    def test_reads_more_objects_than_the_limit_modified_at_the_same_moment(self):
+        # A bulk import modifies 43 objects at once, followed by a few normal changes.
+        objects = [self._object(number, 5) for number in range(1, 44)] + [self._object(number, number) for number in range(44, 50)]
+        self.assertEqual(sorted(int(result.id) for result in self._search(objects)), list(range(1, 50)))
+
+
+class FakeAssociationsApi:
+    # Returns up to page_size associations per object, with a cursor for the rest, like the v4 batch API.
+    def __init__(self, associations, page_size):
+        self.associations = associations
+        self.page_size = page_size
+
+    def get_page(self, from_object_type, to_object_type, batch_input_public_fetch_associations_batch_request):
+        results = []
+        for request_input in batch_input_public_fetch_associations_batch_request.inputs:
+            to_ids = self.associations.get(request_input.id, [])
+            if not to_ids:
+                continue
+            start = int(request_input.after or 0)
+            end = start + self.page_size
+            paging = SimpleNamespace(next=SimpleNamespace(after=str(end))) if end < len(to_ids) else None
+            results.append(SimpleNamespace(_from=SimpleNamespace(id=request_input.id), paging=paging,
+                                           to=[SimpleNamespace(to_object_id=int(to_id)) for to_id in to_ids[start:end]]))
+        return SimpleNamespace(results=results)
+
+
+class BatchReadAssociationsTests(unittest.TestCase):
+    def test_follows_paging_for_objects_with_many_associations(self):
+        associations = {'1': [str(number) for number in range(1200)], '2': ['5', '6'], '3': []}
+        client = SimpleNamespace(crm=SimpleNamespace(associations=SimpleNamespace(v4=SimpleNamespace(
+            batch_api=FakeAssociationsApi(associations, 500)))))
+        result = hubspotFunctions.batch_read_hubspot_associations(client, 'contacts', 'deals', ['1', '2', '3'])
+        self.assertEqual(result, {'1': associations['1'], '2': ['5', '6']})
+
+
+class CallHubSpotTests(unittest.TestCase):
+    def _controller(self):
+        # A controller that doesn't pause after a 429, so the retries run straight away.
+        controller = AdaptiveController('test_call')
+        controller.record = mock.Mock()
+        return controller
+
+    def test_retries_a_rate_limited_call(self):
+        api_call = mock.Mock(side_effect=[hubspotFunctions.HUBSPOT_API_EXCEPTIONS[0](status=429), 'page'])
+        self.assertEqual(hubspotFunctions._call_hubspot(self._controller(), api_call), 'page')
+
+    def test_gives_up_after_too_many_rate_limits(self):
+        api_call = mock.Mock(side_effect=hubspotFunctions.HUBSPOT_API_EXCEPTIONS[0](status=429))
+        with self.assertRaises(hubspotFunctions.HUBSPOT_API_EXCEPTIONS):
+            hubspotFunctions._call_hubspot(self._controller(), api_call)
+        self.assertEqual(api_call.call_count, hubspotFunctions.MAX_RATE_LIMIT_RETRIES + 1)
+
+
+class FakeBatchApi:
+    # Updates objects like the HubSpot batch update API. A bad object fails the whole request with a 400,
+    # and an object listed in partial_failures only fails itself, in a 207 response.
+    def __init__(self, bad_ids=(), partial_failures=()):
+        self.bad_ids = set(bad_ids)
+        self.partial_failures = set(partial_failures)
+        self.requests = []
+
+    def update(self, batch_input_simple_public_object_batch_input):
+        ids = [item.id for item in batch_input_simple_public_object_batch_input.inputs]
+        self.requests.append(ids)
+        if self.bad_ids.intersection(ids):
+            raise hubspotFunctions.HUBSPOT_API_EXCEPTIONS[0](status=400)
+        failed = [object_id for object_id in ids if object_id in self.partial_failures]
+        errors = [SimpleNamespace(message=f"{object_id} is locked", context={'ids': [object_id]}) for object_id in failed]
+        return SimpleNamespace(results=[SimpleNamespace(id=object_id) for object_id in ids if object_id not in failed],
+                               errors=errors)
+
+
+class BatchUpdateTests(unittest.TestCase):
+    def setUp(self):
+        controller = AdaptiveController('test_batch_update', page_size=4, min_page_size=4, max_page_size=4)
+        patch = mock.patch.object(hubspotFunctions, 'get_controller', return_value=controller)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.updates = {str(number): {'mailerlite_opens_count': '1'} for number in range(1, 7)}
+
+    def _update(self, api):
+        client = SimpleNamespace(crm=SimpleNamespace(contacts=SimpleNamespace(batch_api=api)))
+        return hubspotFunctions.batch_update_hubspot_objects(client, 'contacts', self.updates)
+
+    def test_updates_every_object_in_chunks(self):
+        api = FakeBatchApi()
+        self.assertEqual(self._update(api), list(self.updates))
+        self.assertEqual(api.requests, [['1', '2', '3', '4'], ['5', '6']])
+
+    def test_objects_that_failed_in_a_partial_response_are_left_out(self):
+        self.assertEqual(self._update(FakeBatchApi(partial_failures={'2', '5'})), ['1', '3', '4', '6'])
+
+    def test_a_bad_object_does_not_stop_the_rest_of_its_chunk(self):
+        api = FakeBatchApi(bad_ids={'3'})
+        self.assertEqual(self._update(api), ['1', '2', '4', '5', '6'])
+        self.assertIn(['3'], api.requests)
+
+
+class AssociatedDealsTests(unittest.TestCase):
+    def setUp(self):
+        patches = [mock.patch.object(coalesceFunctions, '_coalescers', {}),
+                   mock.patch.object(hubspotFunctions, 'batch_read_hubspot_associations', return_value={'1': ['10', '11']})]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_deals_that_no_longer_exist_are_left_out(self):
+        deal = mock.Mock(id='10')
+        deal.to_dict.return_value = {'id': '10'}
+        with mock.patch.object(hubspotFunctions, '_batch_read_hubspot_objects', return_value=[deal]):
+            self.assertEqual(hubspotFunctions.get_associated_deals(object(), '1'), [{'id': '10'}])
+
+    def test_a_failed_deal_read_returns_none(self):
+        with mock.patch.object(hubspotFunctions, '_batch_read_hubspot_objects', return_value=None):
+            self.assertIsNone(hubspotFunctions.get_associated_deals(object(), '1'))
+
+
+
+class DefaultPropertiesTests(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(coalesceFunctions, '_coalescers', {})
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_email_lookups_ask_for_the_default_contact_properties(self):
+        contact = SimpleNamespace(id='1', properties={'email': 'jamie@example.com'})
+        with mock.patch.object(hubspotFunctions, '_batch_read_hubspot_objects', return_value=[contact]) as read:
+            self.assertEqual(hubspotFunctions.search_hubspot_contact_by_email(object(), ' Jamie@example.com'), [contact])
+        self.assertEqual(read.call_args[0][3], hubspotFunctions.DEFAULT_CONTACT_PROPERTIES)
+        self.assertEqual(read.call_args[1]['id_property'], 'email')
+
+    def test_deal_lookups_ask_for_the_default_deal_properties(self):
+        deal = SimpleNamespace(id='10')
+        with mock.patch.object(hubspotFunctions, '_batch_read_hubspot_objects', return_value=[deal]) as read:
+            self.assertIs(hubspotFunctions.get_deal_details_by_id(object(), 10), deal)
+        self.assertEqual(read.call_args[0][3], hubspotFunctions.DEFAULT_DEAL_PROPERTIES)
+
+
+if __name__ == '__main__':
+    unittest.main()
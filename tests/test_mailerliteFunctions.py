@@ -0,0 +1,169 @@
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+from src import mailerliteFunctions
+from src.mailerliteFunctions import MAX_RATE_LIMIT_RETRIES
+from src.retryFunctions import CircuitBreaker
+
+
+class FakeController:
+    # Stands in for an AdaptiveController so rate limited requests don't actually wait.
+    page_size = 50
+
+    @contextmanager
+    def slot(self):
+        yield
+
+    def record(self, latency, status_code, headers=None):
+        pass
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, text=''):
+        self.status_code = status_code
+        self.headers = {}
+        self.text = text
+        self._data = data if data is not None else {}
+
+    def json(self):
+        return self._data
+
+
+class RateLimitTests(unittest.TestCase):
+    def setUp(self):
+        # Give each test its own circuit breaker, so failures in one test can't open the circuit for the next.
+        self.circuit_breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+        patch = mock.patch.object(mailerliteFunctions, 'get_circuit_breaker', return_value=self.circuit_breaker)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_subscriber_scan_gives_up_after_too_many_rate_limits(self):
+        with mock.patch.object(mailerliteFunctions, 'send_request', return_value=FakeResponse(429)) as send_request:
+            result = mailerliteFunctions.get_mailerlite_subscribers_by_status('key', 'active', FakeController())
+        self.assertIsNone(result)
+        self.assertEqual(send_request.call_count, MAX_RATE_LIMIT_RETRIES + 1)
+
+    def test_subscriber_scan_retries_a_rate_limited_page(self):
+        responses = [FakeResponse(429), FakeResponse(200, {'data': [{'id': '1'}], 'meta': {'next_cursor': None}})]
+        with mock.patch.object(mailerliteFunctions, 'send_request', side_effect=responses):
+            result = mailerliteFunctions.get_mailerlite_subscribers_by_status('key', 'active', FakeController())
+        self.assertEqual(result, [{'id': '1'}])
+
+    def test_subscriber_scan_fails_on_an_error_partway_through(self):
+        responses = [FakeResponse(200, {'data': [{'id': '1'}], 'meta': {'next_cursor': 'next'}}),
+                     FakeResponse(500, text='Server error')]
+        with mock.patch.object(mailerliteFunctions, 'send_request', side_effect=responses):
+            result = mailerliteFunctions.get_mailerlite_subscribers_by_status('key', 'active', FakeController())
+        self.assertIsNone(result)
+
+    def test_subscriber_scan_fails_on_a_timeout(self):
+        with mock.patch.object(mailerliteFunctions, 'send_request',
+                               side_effect=mailerliteFunctions.requests.exceptions.Timeout("Read timed out")):
+            result = mailerliteFunctions.get_mailerlite_subscribers_by_status('key', 'active', FakeController())
+        self.assertIsNone(result)
+
+    def test_full_scan_fails_if_any_status_fails(self):
+        def send_request(method, url, headers=None, params=None, **kwargs):
+            if params['filter[status]'] == 'bounced':
+                return FakeResponse(500, text='Server error')
+            return FakeResponse(200, {'data': [{'id': params['filter[status]']}], 'meta': {}})
+
+        with mock.patch.object(mailerliteFunctions, 'send_request', side_effect=send_request):
+            self.assertIsNone(mailerliteFunctions.get_all_mailerlite_subscribers('key', FakeController()))
+            subscribers = mailerliteFunctions.get_all_mailerlite_subscribers('key', FakeController(), ['active', 'junk'])
+        self.assertEqual(subscribers, [{'id': 'active'}, {'id': 'junk'}])
+
+    def test_batch_fails_the_chunk_after_too_many_rate_limits(self):
+        batch_requests = [{'method': 'DELETE', 'path': f"api/subscribers/{number}"} for number in range(3)]
+        with mock.patch.object(mailerliteFunctions, 'send_request', return_value=FakeResponse(429)) as send_request:
+            responses = mailerliteFunctions.send_mailerlite_batch('key', batch_requests, FakeController())
+        self.assertEqual(send_request.call_count, MAX_RATE_LIMIT_RETRIES + 1)
+        self.assertEqual([response['code'] for response in responses], [429, 429, 429])
+
+    def test_batch_pads_a_short_list_of_responses(self):
+        batch_requests = [{'method': 'DELETE', 'path': f"api/subscribers/{number}"} for number in range(4)]
+        controller = FakeController()
+        controller.page_size = 2
+        responses = [FakeResponse(200, {'responses': [{'code': 200, 'body': {}}]}),
+                     FakeResponse(200, {'responses': [{'code': 204, 'body': {}}, {'code': 404, 'body': {}}]})]
+        with mock.patch.object(mailerliteFunctions, 'send_request', side_effect=responses):
+            batch_responses = mailerliteFunctions.send_mailerlite_batch('key', batch_requests, controller)
+        self.assertEqual([response['code'] for response in batch_responses], [200, None, 204, 404])
+
+    def test_a_timed_out_batch_is_failed_and_counts_towards_the_circuit(self):
+        batch_requests = [{'method': 'DELETE', 'path': f"api/subscribers/{number}"} for number in range(2)]
+        with mock.patch.object(mailerliteFunctions, 'send_request',
+                               side_effect=mailerliteFunctions.requests.exceptions.Timeout("Read timed out")):
+            batch_responses = mailerliteFunctions.send_mailerlite_batch('key', batch_requests, FakeController())
+        self.assertEqual([response['code'] for response in batch_responses], [None, None])
+        self.assertEqual(self.circuit_breaker._failures, 1)
+
+    def test_batch_stops_once_the_circuit_opens(self):
+        batch_requests = [{'method': 'DELETE', 'path': f"api/subscribers/{number}"} for number in range(4)]
+        controller = FakeController()
+        controller.page_size = 1
+        with mock.patch.object(mailerliteFunctions, 'send_request', return_value=FakeResponse(503, text='Unavailable')) as send_request:
+            batch_responses = mailerliteFunctions.send_mailerlite_batch('key', batch_requests, controller)
+        # The circuit opens after two failures in a row, so the last two requests are never sent.
+        self.assertEqual(send_request.call_count, 2)
+        self.assertTrue(self.circuit_breaker.is_open)
+        self.assertEqual([response['code'] for response in batch_responses], [503, 503, None, None])
+
+    def test_a_rejected_batch_does_not_count_towards_the_circuit(self):
+        batch_requests = [{'method': 'DELETE', 'path': f"api/subscribers/{number}"} for number in range(3)]
+        controller = FakeController()
+        controller.page_size = 1
+        with mock.patch.object(mailerliteFunctions, 'send_request', return_value=FakeResponse(422, text='Invalid')):
+            mailerliteFunctions.send_mailerlite_batch('key', batch_requests, controller)
+        self.assertFalse(self.circuit_breaker.is_open)
+
+
+class GroupTests(unittest.TestCase):
+    def test_creating_a_group_waits_out_rate_limits(self):
+        responses = [FakeResponse(429), FakeResponse(201, {'data': {'id': '7', 'name': 'Persona: persona_1'}})]
+        with mock.patch.object(mailerliteFunctions, 'get_controller', return_value=FakeController()), \
+                mock.patch.object(mailerliteFunctions, 'send_request', side_effect=responses):
+            group = mailerliteFunctions.create_mailerlite_group('key', 'Persona: persona_1')
+        self.assertEqual(group['id'], '7')
+
+    def test_creating_a_group_gives_up_after_too_many_rate_limits(self):
+        with mock.patch.object(mailerliteFunctions, 'get_controller', return_value=FakeController()), \
+                mock.patch.object(mailerliteFunctions, 'send_request', return_value=FakeResponse(429)) as send_request:
+            self.assertIsNone(mailerliteFunctions.create_mailerlite_group('key', 'Persona: persona_1'))
+        self.assertEqual(send_request.call_count, MAX_RATE_LIMIT_RETRIES + 1)
+
+    def test_missing_membership_responses_count_as_failures(self):
+        retry_queue = mock.Mock()
+        with mock.patch.object(mailerliteFunctions, 'send_mailerlite_batch', return_value=[{'code': 200, 'body': {}}]):
+            result = mailerliteFunctions.set_mailerlite_group_memberships('key', [('1', '10')], [('2', '10'), ('3', '10')],
+                                                                          retry_queue)
+        self.assertEqual(result, (1, 0))
+        self.assertEqual([call[0][1] for call in retry_queue.add.call_args_list],
+                         [{'subscriber_id': '2', 'group_id': '10'}, {'subscriber_id': '3', 'group_id': '10'}])
+
+
+class BatchFailureTests(unittest.TestCase):
+    def test_queues_retryable_failures_and_dead_letters_the_rest(self):
+        retry_queue = mock.Mock()
+        args_list = [{'subscriber_id': str(number)} for number in range(4)]
+        responses = [{'code': 200, 'body': {}}, {'code': 503, 'body': {'message': 'Unavailable'}},
+                     {'code': 422, 'body': {'message': 'Invalid'}}, {'code': 404, 'body': {}}]
+        succeeded = mailerliteFunctions.handle_mailerlite_batch_failures('delete_mailerlite_subscriber', args_list, responses,
+                                                                         retry_queue, ignored_codes=(404,))
+        self.assertEqual(succeeded, 2)
+        self.assertEqual([call[0][1] for call in retry_queue.add.call_args_list], [{'subscriber_id': '1'}])
+        self.assertEqual([call[0][1] for call in retry_queue.dead_letter.call_args_list], [{'subscriber_id': '2'}])
+
+    def test_requests_without_a_response_are_queued(self):
+        retry_queue = mock.Mock()
+        args_list = [{'subscriber_id': str(number)} for number in range(3)]
+        succeeded = mailerliteFunctions.handle_mailerlite_batch_failures('delete_mailerlite_subscriber', args_list,
+                                                                         [{'code': 200, 'body': {}}], retry_queue)
+        self.assertEqual(succeeded, 1)
+        self.assertEqual([call[0][1] for call in retry_queue.add.call_args_list],
+                         [{'subscriber_id': '1'}, {'subscriber_id': '2'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
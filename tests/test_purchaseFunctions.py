@@ -0,0 +1,134 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest import mock
+
+from src import purchaseFunctions
+from src.purchaseFunctions import aggregate_purchases, get_purchase_fields
+
+
+class AggregatePurchasesTests(unittest.TestCase):
+    def setUp(self):
+        self.deals_by_id = {
+            'old': {'dealstage': 'closedwon', 'closedate': '2024-01-01T00:00:00Z'},
+            'new': {'dealstage': 'closedwon', 'closedate': '2024-03-01T00:00:00Z'},
+            'lost': {'dealstage': 'closedlost', 'closedate': '2024-06-01T00:00:00Z'},
+        }
+        self.line_item_ids_by_deal = {'old': ['a'], 'new': ['b', 'c'], 'lost': ['d']}
+        self.line_items_by_id = {
+            'a': {'name': 'Widget', 'price': '10', 'quantity': '2'},
+            'b': {'name': 'Gadget', 'price': '20', 'quantity': '1', 'hs_url': 'https://example.com/gadget'},
+            'c': {'name': 'Widget', 'price': '10', 'quantity': '1.5'},
+            'd': {'name': 'Gizmo', 'price': '5', 'quantity': '4'},
+        }
+
+    def test_newest_deal_fills_the_last_products(self):
+        fields = aggregate_purchases({'contact': ['old', 'new']}, self.deals_by_id, self.line_item_ids_by_deal,
+                                     self.line_items_by_id)['contact']
+        self.assertEqual(fields['last_product_bought'], 'Gadget')
+        self.assertEqual(fields['last_products_bought'], 'Gadget, Widget')
+        self.assertEqual(fields['last_total_number_of_products_bought'], '2.5')
+        self.assertEqual(fields['last_products_bought_product_1_url'], 'https://example.com/gadget')
+        self.assertEqual(fields['last_products_bought_product_2_name'], 'Widget')
+        self.assertIsNone(fields['last_products_bought_product_3_name'])
+        self.assertEqual(fields['total_number_of_products_bought'], '4.5')
+        self.assertEqual(fields['products_bought'], 'Gadget;Widget')
+
+    def test_only_counts_won_deals(self):
+        fields = aggregate_purchases({'contact': ['old', 'lost']}, self.deals_by_id, self.line_item_ids_by_deal,
+                                     self.line_items_by_id, won_stages={'closedwon'})['contact']
+        self.assertEqual(fields['last_product_bought'], 'Widget')
+        self.assertEqual(fields['total_number_of_products_bought'], '2')
+
+    def test_contact_without_deals_has_empty_fields(self):
+        fields = aggregate_purchases({'contact': ['missing']}, self.deals_by_id, self.line_item_ids_by_deal,
+                                     self.line_items_by_id)['contact']
+        self.assertTrue(all(value is None for value in fields.values()))
+
+
+
+class GetPurchaseFieldsTests(unittest.TestCase):
+    # Contact c1 has a won deal d1, and contact c2 has a won deal d2 and a lost deal d3.
+    ASSOCIATIONS = {
+        ('deals', 'contacts'): {'d1': ['c1'], 'd2': ['c2'], 'd3': ['c2']},
+        ('contacts', 'deals'): {'c1': ['d1'], 'c2': ['d2', 'd3']},
+        ('deals', 'line_items'): {'d1': ['l1'], 'd2': ['l2'], 'd3': ['l3']},
+    }
+    OBJECTS = {
+        'deals': {'d1': {'dealstage': 'closedwon', 'closedate': '2024-01-01'},
+                  'd2': {'dealstage': 'closedwon', 'closedate': '2024-02-01'},
+                  'd3': {'dealstage': 'closedlost', 'closedate': '2024-03-01'}},
+        'line_items': {'l1': {'name': 'Widget', 'quantity': '1'}, 'l2': {'name': 'Gadget', 'quantity': '2'},
+                       'l3': {'name': 'Gizmo', 'quantity': '5'}},
+    }
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output_dir = directory.name
+        self.search = mock.Mock()
+        self.get_all = mock.Mock()
+
+        def read_associations(client, from_type, to_type, object_ids):
+            associations = self.ASSOCIATIONS[(from_type, to_type)]
+            return {object_id: associations[object_id] for object_id in object_ids if object_id in associations}
+
+        def read_objects(client, object_type, object_ids, properties):
+            return {object_id: self.OBJECTS[object_type][object_id] for object_id in object_ids}
+
+        patches = [mock.patch.object(purchaseFunctions, 'search_hubspot_deals_modified_since', self.search),
+                   mock.patch.object(purchaseFunctions, 'get_all_hubspot_deals', self.get_all),
+                   mock.patch.object(purchaseFunctions, 'batch_read_hubspot_associations', side_effect=read_associations),
+                   mock.patch.object(purchaseFunctions, 'batch_read_hubspot_objects', side_effect=read_objects),
+                   mock.patch.dict(os.environ, {'HUBSPOT_WON_DEAL_STAGES': ''})]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_first_run_reads_every_deal_and_only_counts_won_deals(self):
+        self.get_all.return_value = [SimpleNamespace(id='d1'), SimpleNamespace(id='d2'), SimpleNamespace(id='d3')]
+        state = {}
+        fields = get_purchase_fields(object(), state, self.output_dir)
+        self.search.assert_not_called()
+        self.assertEqual(fields['c1']['products_bought'], 'Widget')
+        self.assertEqual(fields['c2']['products_bought'], 'Gadget')
+        self.assertEqual(fields['c2']['total_number_of_products_bought'], '2')
+        self.assertIn('deals_checkpoint', state)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'purchaseFields.snap')))
+
+    def test_later_runs_merge_the_changed_contacts_into_the_snapshot(self):
+        self.get_all.return_value = [SimpleNamespace(id='d1')]
+        state = {}
+        get_purchase_fields(object(), state, self.output_dir)
+        checkpoint = state['deals_checkpoint']
+
+        # Only d2 has changed since, so c1's fields come from the snapshot and c2's are worked out.
+        self.search.return_value = [SimpleNamespace(id='d2')]
+        fields = get_purchase_fields(object(), state, self.output_dir)
+        self.assertEqual(self.search.call_args[0][1], datetime.fromisoformat(checkpoint))
+        self.assertEqual(fields['c1']['products_bought'], 'Widget')
+        self.assertEqual(fields['c2']['products_bought'], 'Gadget')
+        self.assertGreaterEqual(state['deals_checkpoint'], checkpoint)
+
+    def test_a_failed_search_keeps_the_saved_fields_and_the_checkpoint(self):
+        self.get_all.return_value = [SimpleNamespace(id='d1')]
+        state = {}
+        get_purchase_fields(object(), state, self.output_dir)
+        state['deals_checkpoint'] = checkpoint = datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat()
+
+        self.search.return_value = None
+        fields = get_purchase_fields(object(), state, self.output_dir)
+        self.assertEqual(list(fields), ['c1'])
+        self.assertEqual(state['deals_checkpoint'], checkpoint)
+
+    def test_won_stages_can_be_set(self):
+        self.get_all.return_value = [SimpleNamespace(id='d3')]
+        with mock.patch.dict(os.environ, {'HUBSPOT_WON_DEAL_STAGES': 'closedwon, closedlost'}):
+            fields = get_purchase_fields(object(), {}, self.output_dir)
+        self.assertEqual(fields['c2']['products_bought'], 'Gizmo;Gadget')
+
+
+if __name__ == '__main__':
+    unittest.main()
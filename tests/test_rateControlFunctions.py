@@ -0,0 +1,82 @@
+import time
+import unittest
+
+from src.rateControlFunctions import AdaptiveController, account_scope, get_controller
+
+
+class AdaptiveControllerTests(unittest.TestCase):
+    def _controller(self, **settings):
+        settings = dict(dict(page_size=50, min_page_size=10, max_page_size=100, page_size_step=10,
+                             concurrency=4, max_concurrency=8, target_latency=1.0, increase_after=3), **settings)
+        return AdaptiveController('test', **settings)
+
+    def test_rate_limit_halves_concurrency_and_pauses(self):
+        controller = self._controller()
+        controller.record(0.1, 429, {'Retry-After': '30'})
+        self.assertEqual(controller.concurrency, 2)
+        self.assertEqual(controller.page_size, 50)
+        self.assertGreater(controller._paused_until, time.monotonic() + 25)
+        self.assertEqual(controller.summary()['throttled'], 1)
+
+    def test_error_halves_page_size_and_concurrency(self):
+        controller = self._controller()
+        controller.record(0.1, 500)
+        self.assertEqual((controller.page_size, controller.concurrency), (25, 2))
+        controller.record(0.1, None)
+        self.assertEqual((controller.page_size, controller.concurrency), (12, 1))
+        # Never backs off below the minimums.
+        controller.record(0.1, 503)
+        self.assertEqual((controller.page_size, controller.concurrency), (10, 1))
+
+    def test_slow_response_shrinks_page_size(self):
+        controller = self._controller()
+        controller.record(2.0, 200)
+        self.assertEqual((controller.page_size, controller.concurrency), (37, 4))
+
+    def test_increases_after_a_run_of_fast_responses(self):
+        controller = self._controller()
+        controller.record(0.1, 200)
+        controller.record(0.1, 200)
+        self.assertEqual((controller.page_size, controller.concurrency), (50, 4))
+        controller.record(0.1, 200)
+        self.assertEqual((controller.page_size, controller.concurrency), (60, 5))
+        self.assertEqual(len(controller.decisions), 1)
+
+    def test_only_grows_the_page_size_with_little_headroom(self):
+        controller = self._controller()
+        headers = {'X-RateLimit-Remaining': '10', 'X-RateLimit-Limit': '100'}
+        for _ in range(3):
+            controller.record(0.1, 200, headers)
+        self.assertEqual((controller.page_size, controller.concurrency), (60, 4))
+
+    def test_low_headroom_reduces_concurrency(self):
+        controller = self._controller()
+        controller.record(0.1, 200, {'X-HubSpot-RateLimit-Remaining': '1', 'X-HubSpot-RateLimit-Max': '100'})
+        self.assertEqual((controller.page_size, controller.concurrency), (50, 3))
+
+    def test_slot_limits_requests_in_flight(self):
+        controller = self._controller(concurrency=1, max_concurrency=1)
+        with controller.slot():
+            self.assertEqual(controller._in_flight, 1)
+        self.assertEqual(controller._in_flight, 0)
+
+    def test_reset_summary_keeps_the_tuned_settings(self):
+        controller = self._controller()
+        controller.record(0.1, 500)
+        controller.reset_summary()
+        summary = controller.summary()
+        self.assertEqual((summary['requests'], summary['errors'], summary['decisions']), (0, 0, 0))
+        self.assertEqual((controller.page_size, controller.concurrency), (25, 2))
+        self.assertEqual(summary['page_size_range'], (25, 25))
+
+    def test_controllers_are_shared_per_account(self):
+        default_controller = get_controller('test_shared')
+        self.assertIs(get_controller('test_shared'), default_controller)
+        with account_scope('brand_a'):
+            account_controller = get_controller('test_shared')
+        self.assertIsNot(account_controller, default_controller)
+        self.assertEqual(account_controller.name, 'brand_a:test_shared')
+
+
+if __name__ == '__main__':
+    unittest.main()
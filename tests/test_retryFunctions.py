@@ -0,0 +1,164 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.retryFunctions import CircuitBreaker, RetryQueue, get_alert_arguments, is_retryable_error
+
+
+class HTTPError(OSError):
+    # Shaped like requests' HTTPError, which carries the response.
+    def __init__(self, status_code):
+        super().__init__(f"{status_code} error")
+        self.response = mock.Mock(status_code=status_code)
+
+
+class JSONDecodeError(OSError, ValueError):
+    # Shaped like requests' JSONDecodeError, which is both an IOError and a ValueError.
+    pass
+
+
+class RetryableErrorTests(unittest.TestCase):
+    def test_retryable_errors(self):
+        self.assertTrue(is_retryable_error(HTTPError(429)))
+        self.assertTrue(is_retryable_error(HTTPError(503)))
+        self.assertTrue(is_retryable_error(TimeoutError("timed out")))
+        self.assertTrue(is_retryable_error(ConnectionError("reset")))
+
+    def test_non_retryable_errors(self):
+        self.assertFalse(is_retryable_error(HTTPError(400)))
+        self.assertFalse(is_retryable_error(HTTPError(422)))
+        self.assertFalse(is_retryable_error(JSONDecodeError("Expecting value")))
+        self.assertFalse(is_retryable_error(KeyError('data')))
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open)
+        self.assertFalse(breaker.allow())
+
+    def test_allows_one_trial_after_the_timeout(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertFalse(breaker.is_open)
+        self.assertTrue(breaker.allow())
+
+
+class RetryQueueTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.queue_path = os.path.join(directory.name, 'retryQueue.jsonl')
+        self.dead_letter_path = os.path.join(directory.name, 'deadLetters.jsonl')
+
+    def _queue(self, **settings):
+        return RetryQueue(self.queue_path, self.dead_letter_path, base_delay=0, **settings)
+
+    def _read_lines(self, path):
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r') as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    def test_add_appends_and_persists(self):
+        queue = self._queue()
+        queue.add('update', {'subscriber_id': '1'}, "503")
+        queue.add('update', {'subscriber_id': '2'}, "503")
+        self.assertEqual([item['args'] for item in self._read_lines(self.queue_path)],
+                         [{'subscriber_id': '1'}, {'subscriber_id': '2'}])
+        self.assertEqual(len(self._queue()), 2)
+
+    def test_add_does_not_rewrite_the_file(self):
+        queue = self._queue()
+        with mock.patch.object(RetryQueue, '_save') as save:
+            for number in range(10):
+                queue.add('update', {'subscriber_id': str(number)}, "503")
+        save.assert_not_called()
+
+    def test_drain_retries_until_success(self):
+        queue = self._queue()
+        queue.add('update', {'subscriber_id': '1'}, "503")
+        attempts = []
+
+        def update(subscriber_id):
+            attempts.append(subscriber_id)
+            if len(attempts) < 3:
+                raise HTTPError(503)
+
+        self.assertEqual(queue.drain({'update': update}), 1)
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(self._read_lines(self.queue_path), [])
+
+    def test_drain_dead_letters_after_max_attempts(self):
+        queue = self._queue(max_attempts=2)
+        queue.add('update', {'subscriber_id': '1'}, "503")
+
+        def update(subscriber_id):
+            raise HTTPError(503)
+
+        self.assertEqual(queue.drain({'update': update}), 0)
+        self.assertEqual(queue.dead_letter_count, 1)
+        self.assertEqual(self._read_lines(self.dead_letter_path)[0]['attempts'], 2)
+
+    def test_client_errors_are_dead_lettered_without_tripping_the_circuit(self):
+        queue = self._queue()
+        for number in range(5):
+            queue.add('update', {'subscriber_id': str(number)}, "503")
+        breaker = CircuitBreaker('test', failure_threshold=2)
+
+        def update(subscriber_id):
+            raise HTTPError(422)
+
+        self.assertEqual(queue.drain({'update': update}, breaker), 0)
+        self.assertFalse(breaker.is_open)
+        self.assertEqual(queue.dead_letter_count, 5)
+
+    def test_open_circuit_keeps_the_rest_for_the_next_run(self):
+        queue = self._queue()
+        for number in range(5):
+            queue.add('update', {'subscriber_id': str(number)}, "503")
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+
+        def update(subscriber_id):
+            raise HTTPError(503)
+
+        queue.drain({'update': update}, breaker)
+        self.assertTrue(breaker.is_open)
+        self.assertEqual(len(queue), 5)
+        self.assertEqual(len(self._read_lines(self.queue_path)), 5)
+
+    def test_dead_letter_alerts_leave_out_the_payload(self):
+        alerts = mock.Mock()
+        queue = RetryQueue(self.queue_path, self.dead_letter_path, alerts=alerts)
+        subscriber = {'email': 'someone@example.com', 'fields': {'phone': '0400 000 000', 'address': '1 Example St'}}
+        queue.dead_letter('upsert_mailerlite_subscriber', {'subscriber': subscriber}, "422: Invalid phone")
+
+        message = alerts.alert.call_args[0][1]
+        self.assertIn('someone@example.com', message)
+        self.assertNotIn('0400 000 000', message)
+        self.assertNotIn('1 Example St', message)
+        # The dead-letter file keeps everything needed to replay the write by hand.
+        self.assertEqual(self._read_lines(self.dead_letter_path)[0]['args'], {'subscriber': subscriber})
+
+    def test_alert_arguments(self):
+        self.assertEqual(get_alert_arguments({'subscriber_id': '1', 'email': {'fields': {'name': 'Someone'}}}),
+                         {'subscriber_id': '1'})
+        self.assertEqual(get_alert_arguments({'subscriber_id': '1', 'group_id': '2'}), {'subscriber_id': '1', 'group_id': '2'})
+        self.assertEqual(get_alert_arguments({'email': 'someone@example.com', 'name': 'Someone'}), {'email': 'someone@example.com'})
+
+
+if __name__ == '__main__':
+    unittest.main()
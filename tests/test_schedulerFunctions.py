@@ -0,0 +1,38 @@
+import unittest
+from unittest import mock
+
+from src import schedulerFunctions
+from src.schedulerFunctions import SyncScheduler
+
+
+class ScheduleTests(unittest.TestCase):
+    def _scheduler(self, interval=60, jitter=10):
+        scheduler = SyncScheduler(lambda: None, interval, jitter)
+        scheduler._start = 1000.0
+        return scheduler
+
+    def test_runs_are_due_on_a_grid_from_the_start(self):
+        scheduler = self._scheduler()
+        # However the jitter falls, it never carries over to the next run.
+        with mock.patch.object(schedulerFunctions.random, 'uniform', side_effect=[10, 10, -10]):
+            runs = [scheduler._get_next_run() for _ in range(3)]
+        self.assertEqual(runs, [1070.0, 1130.0, 1170.0])
+
+    def test_changing_the_schedule_keeps_the_runs_already_due(self):
+        scheduler = self._scheduler(jitter=0)
+        scheduler._get_next_run()
+        scheduler._get_next_run()
+        scheduler.set_schedule(30, 0)
+        self.assertEqual(scheduler._get_next_run(), 1150.0)
+        self.assertEqual(scheduler._get_next_run(), 1180.0)
+
+    def test_a_failed_reload_keeps_running(self):
+        runs = []
+        scheduler = SyncScheduler(lambda: runs.append(1), 60, reload_function=mock.Mock(side_effect=ValueError('bad')))
+        scheduler.request_reload()
+        scheduler._run()
+        self.assertEqual((runs, scheduler.completed_runs), ([1], 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from src.snapshotFunctions import SnapshotReader, diff_snapshots, write_snapshot
+
+
+class SnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_roundtrip(self):
+        subscribers = [{'id': str(number), 'email': f"person{number}@example.com", 'fields': {'name': f"Person {number}"}}
+                       for number in range(50)]
+        contact = {'id': '7', 'properties': {'email': 'contact@example.com', 'firstname': 'Ünïcode'}}
+        path = self._path('records.snap')
+
+        self.assertEqual(write_snapshot(subscribers + [contact], path), 51)
+        with SnapshotReader(path) as snapshot:
+            self.assertEqual(len(snapshot), 51)
+            self.assertEqual(list(snapshot), subscribers + [contact])
+            self.assertEqual(snapshot.get('person42@example.com'), subscribers[42])
+            # HubSpot contacts are indexed by the email in their properties.
+            self.assertEqual(snapshot.get('contact@example.com'), contact)
+            self.assertIsNone(snapshot.get('missing@example.com'))
+            self.assertNotIn('missing@example.com', snapshot)
+            self.assertEqual(list(snapshot.emails()), sorted([record['email'] for record in subscribers] + ['contact@example.com']))
+
+    def test_empty_snapshot(self):
+        path = self._path('empty.snap')
+        write_snapshot([], path)
+        with SnapshotReader(path) as snapshot:
+            self.assertEqual(len(snapshot), 0)
+            self.assertEqual(list(snapshot), [])
+            self.assertIsNone(snapshot.get('someone@example.com'))
+
+    def test_later_duplicate_email_wins(self):
+        path = self._path('duplicates.snap')
+        write_snapshot([{'email': 'a@example.com', 'id': '1'}, {'email': 'a@example.com', 'id': '2'}], path)
+        with SnapshotReader(path) as snapshot:
+            self.assertEqual(snapshot.get('a@example.com')['id'], '2')
+
+    def test_rejects_other_files(self):
+        path = self._path('not-a-snapshot.json')
+        with open(path, 'w') as file:
+            file.write('[]' * 100)
+        with self.assertRaises(ValueError):
+            SnapshotReader(path)
+
+    def test_diff_snapshots(self):
+        old_path = self._path('old.snap')
+        new_path = self._path('new.snap')
+        write_snapshot([{'email': 'kept@example.com', 'status': 'active'},
+                        {'email': 'changed@example.com', 'status': 'active'},
+                        {'email': 'removed@example.com', 'status': 'active'}], old_path)
+        write_snapshot([{'email': 'added@example.com', 'status': 'active'},
+                        {'email': 'changed@example.com', 'status': 'unsubscribed'},
+                        {'email': 'kept@example.com', 'status': 'active'}], new_path)
+
+        changes = [(change, email) for change, email, _, _ in diff_snapshots(old_path, new_path)]
+        self.assertEqual(changes, [('added', 'added@example.com'), ('changed', 'changed@example.com'),
+                                   ('removed', 'removed@example.com')])
+
+
+if __name__ == '__main__':
+    unittest.main()